@@ -0,0 +1,160 @@
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+import json
+import time
+
+from ansible.plugins.callback import CallbackBase
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import METRICS_RESULT_KEY, histogram_percentile, merge_endpoint_metrics
+
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+name: cp4s_metrics
+
+type: aggregate
+
+short_description: Summarises the API calls made by the cp4s modules in a playbook
+
+version_added: "1.1.0"
+
+description:
+    - Collects the logins, API calls, bytes and latencies every cp4s module reports in its result under cp4s_metrics.
+    - At the end of the playbook prints the calls, errors and p50, p95 and p99 latency of every endpoint, and the slowest cp4s tasks.
+    - Latencies are the time to the response headers, to within 10 percent.
+    - Bytes are counted as sent on the wire and before compression or after decoding, to show what gzip saves.
+
+requirements:
+    - enable in configuration, e.g callbacks_enabled = ryan_gordon1.cloud_pak_for_security.cp4s_metrics
+
+options:
+    report_file:
+        description: Also write the summary, with every cp4s task, to this file as JSON
+        required: false
+        type: path
+        env:
+            - name: CP4S_METRICS_REPORT
+        ini:
+            - section: callback_cp4s_metrics
+              key: report_file
+    slowest_tasks:
+        description: The number of slowest tasks to print
+        required: false
+        type: int
+        default: 5
+        env:
+            - name: CP4S_METRICS_SLOWEST_TASKS
+        ini:
+            - section: callback_cp4s_metrics
+              key: slowest_tasks
+
+author:
+    - Ryan Gordon (@Ryan-Gordon)
+'''
+
+PERCENTILES = (50, 95, 99)
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'ryan_gordon1.cloud_pak_for_security.cp4s_metrics'
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self, *args, **kwargs):
+        super(CallbackModule, self).__init__(*args, **kwargs)
+        self.started = {}
+        self.tasks = []
+        self.start = time.time()
+
+    def v2_runner_on_start(self, host, task):
+        self.started[(host.get_name(), task._uuid)] = time.time()
+
+    def v2_runner_on_ok(self, result):
+        self._record(result, "ok")
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._record(result, "failed")
+
+    def _record(self, result, status):
+        results = [result._result] + list(result._result.get("results") or [])
+        metrics = [item[METRICS_RESULT_KEY] for item in results if isinstance(item, dict) and item.get(METRICS_RESULT_KEY)]
+        if not metrics:
+            return
+
+        host = result._host.get_name()
+        started = self.started.pop((host, result._task._uuid), None)
+        endpoints = {}
+        for task_metrics in metrics:
+            for key, endpoint in task_metrics.get("endpoints", {}).items():
+                merge_endpoint_metrics(endpoints.setdefault(key, {}), endpoint)
+
+        self.tasks.append({
+            "task": result._task.get_name(),
+            "action": result._task.action,
+            "host": host,
+            "status": status,
+            "elapsed": round(time.time() - started, 3) if started else None,
+            "logins": sum(task_metrics.get("logins", 0) for task_metrics in metrics),
+            "login_seconds": round(sum(task_metrics.get("login_seconds", 0) for task_metrics in metrics), 3),
+            "calls": sum(endpoint["calls"] for endpoint in endpoints.values()),
+            "errors": sum(endpoint["errors"] for endpoint in endpoints.values()),
+            "endpoints": endpoints
+        })
+
+    def summary(self):
+        """summary merges the metrics of every cp4s task in the playbook."""
+        endpoints = {}
+        for task in self.tasks:
+            for key, endpoint in task["endpoints"].items():
+                merge_endpoint_metrics(endpoints.setdefault(key, {}), endpoint)
+        for endpoint in endpoints.values():
+            for percentile in PERCENTILES:
+                # A bucket's upper bound can be above the slowest call it holds
+                endpoint["p{}".format(percentile)] = min(histogram_percentile(endpoint["histogram"], percentile), endpoint["max"])
+
+        return {
+            "elapsed": round(time.time() - self.start, 3),
+            "tasks": len(self.tasks),
+            "logins": sum(task["logins"] for task in self.tasks),
+            "login_seconds": round(sum(task["login_seconds"] for task in self.tasks), 3),
+            "calls": sum(endpoint["calls"] for endpoint in endpoints.values()),
+            "errors": sum(endpoint["errors"] for endpoint in endpoints.values()),
+            "bytes_sent": sum(endpoint["bytes_sent"] for endpoint in endpoints.values()),
+            "bytes_received": sum(endpoint["bytes_received"] for endpoint in endpoints.values()),
+            "bytes_sent_raw": sum(endpoint["bytes_sent_raw"] for endpoint in endpoints.values()),
+            "bytes_received_decoded": sum(endpoint["bytes_received_decoded"] for endpoint in endpoints.values()),
+            "endpoints": endpoints
+        }
+
+    def v2_playbook_on_stats(self, stats):
+        if not self.tasks:
+            return
+        summary = self.summary()
+
+        self._display.banner("CP4S API SUMMARY")
+        self._display.display(u"{tasks} tasks, {logins} logins ({login_seconds}s), {calls} calls, {errors} errors, "
+                              u"{bytes_sent} bytes sent ({bytes_sent_raw} uncompressed), "
+                              u"{bytes_received} bytes received ({bytes_received_decoded} decoded)".format(**summary))
+        self._display.display(u"{:<48} {:>7} {:>6} {:>8} {:>8} {:>8} {:>8}".format(
+            "ENDPOINT", "CALLS", "ERRORS", "P50", "P95", "P99", "MAX"))
+        for key, endpoint in sorted(summary["endpoints"].items(), key=lambda item: -item[1]["seconds"]):
+            self._display.display(u"{:<48} {:>7} {:>6} {:>8} {:>8} {:>8} {:>8}".format(
+                key, endpoint["calls"], endpoint["errors"],
+                *["{:.3f}s".format(endpoint[name]) for name in ("p50", "p95", "p99", "max")]))
+
+        slowest = sorted(self.tasks, key=lambda task: -(task["elapsed"] or 0))[:self.get_option("slowest_tasks")]
+        self._display.display(u"Slowest tasks:")
+        for task in slowest:
+            self._display.display(u"  {task} ({host}): {elapsed}s, {calls} calls, {errors} errors".format(**task))
+
+        report_file = self.get_option("report_file")
+        if report_file:
+            with open(report_file, "w") as report:
+                json.dump({**summary, "task_metrics": self.tasks}, report, indent=2, sort_keys=True)
+            self._display.display(u"CP4S API report written to {}".format(report_file))
@@ -0,0 +1,47 @@
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+
+class ModuleDocFragment(object):
+
+    # Options of the shared rest client, CLIENT_ARGS in cp4s_common_logic
+    DOCUMENTATION = r'''
+options:
+    compress_requests_over:
+        description:
+            - gzip the body of any POST, PUT or PATCH of at least this many bytes, such as a large query or bulk create
+            - Only enable this against servers which accept gzip encoded requests. 0 disables it
+            - Responses are always asked for gzip encoded
+        required: false
+        type: int
+        default: 0
+    connect_timeout:
+        description:
+            - Seconds to wait for a connection to CP4S on each call. 0 waits forever
+            - The login made by the resilient package uses its own settings
+        required: false
+        type: float
+        default: 10
+    read_timeout:
+        description:
+            - Seconds to wait for each part of a response on each call, so a hung call fails instead of holding the fork. 0 waits forever
+        required: false
+        type: float
+        default: 120
+    deadline:
+        description:
+            - Seconds from the start of the module by which every call must be done. 0 sets no deadline
+            - Each call gets only the time left, and no call starts after the deadline
+            - Bulk and paged modes stop at the deadline and return what they finished, with deadline_exceeded set, rather than failing
+            - Keep it below the task timeout so there is a result to return
+        required: false
+        type: float
+        default: 0
+'''
@@ -0,0 +1,136 @@
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+import time
+
+from ansible.errors import AnsibleFilterError
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_dsl import parse_duration
+
+__metaclass__ = type
+
+# Labels of the default severity_code values
+SEVERITY_LABELS = {4: "Low", 5: "Medium", 6: "High"}
+DEFAULT_AGE_BUCKETS = ("1d", "7d", "30d")
+
+
+def _field(case, path):
+    """_field returns the value of a dotted path such as properties.source, None if any part is missing."""
+    value = case
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _cases(cases, filter_name):
+    if cases is None:
+        return []
+    if not isinstance(cases, (list, tuple)):
+        raise AnsibleFilterError(u"{} expects a list of cases, got {}".format(filter_name, type(cases).__name__))
+    return cases
+
+
+def cp4s_index_by(cases, key="id", unique=True):
+    """cp4s_index_by turns a list of cases into a dict keyed by a field.
+    With unique=false every key holds the list of cases sharing it.
+    Cases without the field are left out.
+    """
+    index = {}
+    for case in _cases(cases, "cp4s_index_by"):
+        value = _field(case, key)
+        if value is None:
+            continue
+        if unique:
+            index[value] = case
+        else:
+            index.setdefault(value, []).append(case)
+    return index
+
+
+def cp4s_group_by_severity(cases, labels=None):
+    """cp4s_group_by_severity groups cases by severity label, High, Medium
+    and Low by default. labels maps any other severity_code to its label.
+    Cases fetched with handle names already carry the label and are kept as is.
+    """
+    severity_labels = dict(SEVERITY_LABELS)
+    severity_labels.update({int(code): label for code, label in (labels or {}).items()})
+
+    groups = {}
+    for case in _cases(cases, "cp4s_group_by_severity"):
+        code = case.get("severity_code")
+        if code is None:
+            label = "Unknown"
+        elif isinstance(code, int):
+            label = severity_labels.get(code, str(code))
+        else:
+            label = str(code)
+        groups.setdefault(label, []).append(case)
+    return groups
+
+
+def cp4s_project(cases, fields):
+    """cp4s_project keeps only the given fields of every case. fields is a
+    list of dotted paths, each kept under its own path, or a dict of output
+    name to dotted path. Missing fields are None.
+    """
+    if isinstance(fields, dict):
+        columns = list(fields.items())
+    elif isinstance(fields, (list, tuple)):
+        columns = [(path, path) for path in fields]
+    else:
+        raise AnsibleFilterError(u"cp4s_project expects a list or dict of fields, got {}".format(type(fields).__name__))
+    return [{name: _field(case, path) for name, path in columns} for case in _cases(cases, "cp4s_project")]
+
+
+def cp4s_age_buckets(cases, buckets=DEFAULT_AGE_BUCKETS, field="create_date", now=None):
+    """cp4s_age_buckets groups cases by how long ago a date field is, using
+    relative durations as the bucket edges, e.g ['1d', '7d', '30d'] gives
+    <1d, 1d-7d, 7d-30d and >=30d. Every bucket is returned, empty or not,
+    in age order. Cases without the date are under 'unknown'.
+
+    :param now: epoch seconds to measure age from, the current time if not set
+    """
+    try:
+        edges = sorted((parse_duration(bucket), bucket) for bucket in buckets)
+    except ValueError as e:
+        raise AnsibleFilterError(u"cp4s_age_buckets: {}".format(e))
+    if not edges:
+        raise AnsibleFilterError(u"cp4s_age_buckets needs at least one bucket")
+
+    labels = [u"<{}".format(edges[0][1])]
+    labels += [u"{}-{}".format(low[1], high[1]) for low, high in zip(edges, edges[1:])]
+    labels.append(u">={}".format(edges[-1][1]))
+    grouped = {label: [] for label in labels}
+    grouped["unknown"] = []
+
+    # Incident dates are epoch milliseconds
+    now_ms = (time.time() if now is None else now) * 1000
+    edges_ms = [seconds * 1000 for seconds, _ in edges]
+    for case in _cases(cases, "cp4s_age_buckets"):
+        date = _field(case, field)
+        if not isinstance(date, (int, float)):
+            grouped["unknown"].append(case)
+            continue
+        age = now_ms - date
+        position = 0
+        while position < len(edges_ms) and age >= edges_ms[position]:
+            position += 1
+        grouped[labels[position]].append(case)
+    return grouped
+
+
+class FilterModule(object):
+    """Filters for lists of CP4S Cases"""
+
+    def filters(self):
+        return {
+            "cp4s_index_by": cp4s_index_by,
+            "cp4s_group_by_severity": cp4s_group_by_severity,
+            "cp4s_project": cp4s_project,
+            "cp4s_age_buckets": cp4s_age_buckets
+        }
@@ -0,0 +1,155 @@
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+import json
+import os
+import tempfile
+
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import get_cache_dir, get_connection_opts
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_cache import cache_key
+
+__metaclass__ = type
+
+ARTIFACT_INDEX_CACHE_NAME = "artifact_index"
+# Bumped when the layout of the index file changes, an index of another version is rebuilt
+ARTIFACT_INDEX_VERSION = 1
+
+
+class ArtifactIndex(object):
+    """ArtifactIndex is a local inverted index of artifact values to the
+    Cases holding them, so a batch of values can be correlated against
+    every synced Case without a call per value.
+
+    It is one json file per instance and org with two parts:
+    values maps a value to the Cases holding it per artifact type, and
+    cases holds the artifacts and last modified date of every Case, so
+    the postings of a Case can be replaced when it changes. Values are
+    lower cased unless the index was built case sensitive.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.exists = False
+        self.case_sensitive = False
+        self.synced_to = None
+        self.cases = {}
+        self.values = {}
+
+    def load(self):
+        """load reads the index file, a missing, unreadable or older
+        version file leaves the index empty.
+
+        :return: The index, to chain from the constructor
+        :rtype: ArtifactIndex
+        """
+        try:
+            with open(self.path, "r") as index_file:
+                stored = json.load(index_file)
+        except (OSError, IOError, ValueError):
+            return self
+        if stored.get("version") != ARTIFACT_INDEX_VERSION:
+            return self
+        self.exists = True
+        self.case_sensitive = stored.get("case_sensitive", False)
+        self.synced_to = stored.get("synced_to")
+        self.cases = stored.get("cases", {})
+        self.values = stored.get("values", {})
+        return self
+
+    def save(self):
+        # Write to a temp file and rename so a lookup never reads a partial index
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+        with os.fdopen(fd, "w") as index_file:
+            json.dump({
+                "version": ARTIFACT_INDEX_VERSION,
+                "case_sensitive": self.case_sensitive,
+                "synced_to": self.synced_to,
+                "cases": self.cases,
+                "values": self.values
+            }, index_file, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+        self.exists = True
+
+    def clear(self, case_sensitive=False):
+        self.case_sensitive = case_sensitive
+        self.synced_to = None
+        self.cases = {}
+        self.values = {}
+
+    def normalize(self, value):
+        value = str(value).strip()
+        return value if self.case_sensitive else value.lower()
+
+    def remove_case(self, case_id):
+        """remove_case drops a Case and its postings from the index."""
+        case_id = int(case_id)
+        case = self.cases.pop(str(case_id), None)
+        if case is None:
+            return
+        for artifact_type, value in case["artifacts"]:
+            by_type = self.values.get(value, {})
+            case_ids = by_type.get(artifact_type, [])
+            if case_id in case_ids:
+                case_ids.remove(case_id)
+            if not case_ids:
+                by_type.pop(artifact_type, None)
+            if not by_type:
+                self.values.pop(value, None)
+
+    def set_case(self, case_id, artifacts: list, modified=None, plan_status=None):
+        """set_case replaces the artifacts indexed for a Case with artifacts,
+        as returned by the API with their type ID and value.
+        """
+        case_id = int(case_id)
+        self.remove_case(case_id)
+        # Types are stored as strings, the keys json gives back on load
+        keys = sorted({(str(artifact.get("type")), self.normalize(artifact.get("value")))
+                       for artifact in artifacts if artifact.get("value") not in (None, "")})
+        for artifact_type, value in keys:
+            self.values.setdefault(value, {}).setdefault(artifact_type, []).append(case_id)
+        self.cases[str(case_id)] = {"modified": modified, "plan_status": plan_status,
+                                    "artifacts": [list(key) for key in keys]}
+
+    def lookup(self, values, types=None):
+        """lookup finds the Cases holding any of values, in one pass over
+        values with a dict lookup each, however many Cases are indexed.
+
+        :param types: Only match artifacts of these type IDs, every type when empty
+        :return: One match per value and type found, with the sorted Case IDs holding it
+        :rtype: list
+        """
+        types = {str(artifact_type) for artifact_type in types or []}
+        matches = []
+        seen = set()
+        for value in values:
+            normalized = self.normalize(value)
+            if normalized in seen:
+                continue
+            seen.add(normalized)
+            for artifact_type, case_ids in self.values.get(normalized, {}).items():
+                if not types or artifact_type in types:
+                    matches.append({"value": value, "type": int(artifact_type), "case_ids": sorted(case_ids)})
+        return matches
+
+    def stats(self):
+        return {
+            "cases": len(self.cases),
+            "values": len(self.values),
+            "artifacts": sum(len(case["artifacts"]) for case in self.cases.values()),
+            "synced_to": self.synced_to
+        }
+
+
+def open_artifact_index():
+    """open_artifact_index loads the index of the instance and org in
+    app.config, an empty index if it was never synced.
+
+    :rtype: ArtifactIndex
+    """
+    opts = get_connection_opts()
+    key = cache_key(ARTIFACT_INDEX_CACHE_NAME, opts.get("host"), opts.get("org"))
+    return ArtifactIndex(os.path.join(get_cache_dir(ARTIFACT_INDEX_CACHE_NAME), "{}.json".format(key))).load()
@@ -1,16 +1,488 @@
 # Copyright: (c) 2021, Ryan Gordon
 # The MIT License
-#  
+#  
 # Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
 # The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+import gzip
+import json
+import os
+import time
 
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import CLIENT_METRICS, instrument_session
 
-def create_authenticated_client():
+__metaclass__ = type
+
+# Shared option spec for the behaviour of the rest client, applied with configure_client
+CLIENT_ARGS = dict(
+    compress_requests_over=dict(type='int', required=False, default=0),
+    connect_timeout=dict(type='float', required=False, default=10),
+    read_timeout=dict(type='float', required=False, default=120),
+    deadline=dict(type='float', required=False, default=0)
+)
+# The client options of the running module, every session made here uses them
+CLIENT_OPTIONS = {key: spec["default"] for key, spec in CLIENT_ARGS.items()}
+# When the running module has to be done with its calls, set from the deadline option by configure_client
+DEADLINE = {"at": None}
+# Methods whose bodies may be compressed
+COMPRESSIBLE_METHODS = frozenset(["POST", "PUT", "PATCH"])
+
+# Root directory for any state the modules keep between runs (query cache etc.)
+# Can be moved with the CP4S_CACHE_DIR environment variable
+CACHE_ROOT = os.environ.get(
+    "CP4S_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".ansible", "cp4s_cache"))
+
+
+def get_cache_dir(name: str):
+    """get_cache_dir returns the directory used to store
+    the named piece of module state, creating it if needed.
+
+    :param name: The name of the cache e.g 'queries'
+    :type name: str
+    :return: The absolute path of the cache directory
+    :rtype: str
+    """
+    path = os.path.join(CACHE_ROOT, name)
+    if not os.path.isdir(path):
+        os.makedirs(path, exist_ok=True)
+    return path
+
+
+def get_connection_opts():
+    """get_connection_opts uses the resilient package
+    to gather values from a standard app.config file without
+    making any API calls. Useful when only the host and org
+    are needed, for example to scope a cache.
+
+    :return: The parsed app.config options
+    :rtype: dict
+    """
     import resilient
-    # Create Resilient API Client
     resilient_parser = resilient.ArgumentParser(
         config_file=resilient.get_config_file())
-    resilient_opts = resilient_parser.parse_known_args()
-    # Instantiate a client using the gathered opts
-    return resilient.get_client(resilient_opts[0])
\ No newline at end of file
+    return resilient_parser.parse_known_args()[0]
+
+
+def create_authenticated_client(opts=None):
+    """create_authenticated_client uses the resilient package
+    to gather values from a standard app.config file; the configuration file
+    used for an Integration Server or App Host App.
+    This means all credentials needed to run this module can be kept
+    separate and we can also avoid var prompts.
+    Note: If your running this module on a host other than localhost,
+    that host needs to have an app.config file or you need to copy one over.
+
+    :param opts: Already parsed app.config options, parsed from the default app.config if not provided
+    :type opts: dict
+    :return: An authenticated rest client to CP4S or Resilient
+    :rtype: SimpleClient
+    """
+    import resilient
+    if opts is None:
+        opts = get_connection_opts()
+    check_deadline()
+    # Instantiate a client using the gathered opts, the login happens here
+    start = time.time()
+    client = resilient.get_client(opts)
+    CLIENT_METRICS.record_login(time.time() - start)
+    if getattr(client, "session", None) is not None:
+        prepare_session(client.session)
+    return client
+
+
+def configure_client(params: dict):
+    """configure_client applies the CLIENT_ARGS options of a module to
+    every client and session it creates from then on.
+    """
+    CLIENT_OPTIONS.update({key: params[key] for key in CLIENT_ARGS if params.get(key) is not None})
+    deadline = CLIENT_OPTIONS["deadline"]
+    DEADLINE["at"] = time.time() + deadline if deadline and deadline > 0 else None
+
+
+class DeadlineExceeded(Exception):
+    """Raised for a call which would start, or was still waiting, after the deadline of the module."""
+
+
+def remaining_time():
+    """remaining_time returns the seconds left before the deadline,
+    None if the module has no deadline.
+    """
+    if DEADLINE["at"] is None:
+        return None
+    return DEADLINE["at"] - time.time()
+
+
+def deadline_passed():
+    remaining = remaining_time()
+    return remaining is not None and remaining <= 0
+
+
+def check_deadline():
+    if deadline_passed():
+        raise DeadlineExceeded(u"The deadline of {}s has passed".format(CLIENT_OPTIONS["deadline"]))
+
+
+def request_timeout():
+    """request_timeout returns the (connect, read) timeout for the next
+    call, each cut down to the time left before the deadline. A timeout
+    of 0 waits as long as the deadline allows, or forever without one.
+
+    :raises DeadlineExceeded: if the deadline has already passed
+    :rtype: tuple
+    """
+    check_deadline()
+    remaining = remaining_time()
+    timeouts = []
+    for timeout in (CLIENT_OPTIONS["connect_timeout"], CLIENT_OPTIONS["read_timeout"]):
+        if remaining is not None:
+            timeout = min(timeout, remaining) if timeout else remaining
+        timeouts.append(timeout or None)
+    return tuple(timeouts)
+
+
+def prepare_session(session):
+    """prepare_session sets up a requests session the way every call to
+    CP4S should be made. Responses are asked for gzip encoded, bodies over
+    compress_requests_over bytes are sent gzip encoded, every call gets the
+    connect and read timeouts, and every call is recorded for the
+    cp4s_metrics callback with its bytes on the wire and decoded.
+    """
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    if CLIENT_OPTIONS["compress_requests_over"] > 0:
+        compress_request_bodies(session, CLIENT_OPTIONS["compress_requests_over"])
+    apply_timeouts(session)
+    instrument_session(session)
+    return session
+
+
+def compress_request_bodies(session, min_bytes: int):
+    """compress_request_bodies makes a session gzip the body of any POST,
+    PUT or PATCH of at least min_bytes before it is sent. Only enable it
+    against servers which accept Content-Encoding: gzip on requests.
+    """
+    send = session.send
+
+    def compressing_send(request, **kwargs):
+        body = request.body
+        if (request.method in COMPRESSIBLE_METHODS and isinstance(body, (bytes, str))
+                and len(body) >= min_bytes and "Content-Encoding" not in request.headers):
+            raw = body.encode("utf-8") if isinstance(body, str) else body
+            request.body = gzip.compress(raw)
+            request.headers["Content-Encoding"] = "gzip"
+            request.headers["Content-Length"] = str(len(request.body))
+            # Read by the metrics hook to report the bytes saved
+            request.cp4s_raw_bytes = len(raw)
+        return send(request, **kwargs)
+
+    session.send = compressing_send
+    return session
+
+
+def apply_timeouts(session):
+    """apply_timeouts makes a session send every call with the timeouts
+    from request_timeout, unless the caller gave its own. Once the deadline
+    has passed no call is sent, and a call which times out because of the
+    deadline raises DeadlineExceeded, so callers can tell it apart.
+    """
+    import requests
+    send = session.send
+
+    def send_with_timeouts(request, **kwargs):
+        timeout = request_timeout()
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = timeout
+        try:
+            return send(request, **kwargs)
+        except requests.exceptions.Timeout as e:
+            if deadline_passed():
+                raise DeadlineExceeded(u"The deadline passed waiting for {} {}".format(request.method, request.url)) from e
+            raise
+
+    session.send = send_with_timeouts
+    return session
+
+
+def execute_request_with_global_keys(operation: str, host: str, endpoint: str, **kwargs):
+    """execute_request_with_global_keys helper function
+    which takes a global CP4S API Key and Secret rather than one
+    derived from cases.
+    These API keys use different authentication methods and
+    API calls using this client will be slightly different to cases
+
+    That being said, this client provides full access to the CP4S
+    instance.
+
+    :param operation: get or post
+    :param host: The CP4S host name or IP
+    :param endpoint: The privacy endpoint e.g data_type_categories
+    :return: The response
+    :rtype: requests.Response
+    """
+    import requests
+    from requests.auth import HTTPBasicAuth
+
+    session = prepare_session(requests.Session())
+    url = "https://{}/rest/privacy/{}".format(host, endpoint)
+    auth = HTTPBasicAuth(kwargs.get('api_key_id'), kwargs.get('api_key_secret'))
+    if operation == 'get':
+        return session.get(url, auth=auth, verify=kwargs.get('verify', False))
+    elif operation == 'post':
+        return session.post(url, auth=auth, json=kwargs.get('body'), verify=kwargs.get('verify', False))
+
+
+def incident_field_value(incident: dict, field_name: str):
+    """incident_field_value reads a field from an IncidentDTO or a
+    create payload, looking in the custom 'properties' if the field
+    is not a builtin one.
+    """
+    if field_name in incident:
+        return incident[field_name]
+    return incident.get("properties", {}).get(field_name)
+
+
+def diff_incident_fields(incident: dict, desired: dict):
+    """diff_incident_fields compares an incident with the desired
+    field values and returns only the fields which differ.
+
+    :param incident: The current IncidentDTO
+    :type incident: dict
+    :param desired: A dict of field name to desired value, custom fields by their plain name
+    :type desired: dict
+    :return: A dict of field name to (current value, desired value) for every field which differs
+    :rtype: dict
+    """
+    return {
+        field_name: (incident_field_value(incident, field_name), value)
+        for field_name, value in desired.items()
+        if incident_field_value(incident, field_name) != value
+    }
+
+
+def build_incident_patch(incident: dict, changes: dict):
+    """build_incident_patch turns the output of diff_incident_fields into a
+    resilient Patch. The patch carries the version of the incident and the
+    old value of every field, so the server rejects it with a conflict if the
+    incident was changed by someone else since it was read.
+
+    :return: A patch which can be sent with client.patch
+    :rtype: resilient.Patch
+    """
+    import resilient
+    patch = resilient.Patch(incident)
+    for field_name, (old_value, new_value) in changes.items():
+        patch.add_value(field_name, new_value, old_value=old_value)
+    return patch
+
+
+def build_incident_query(conditions: list, method=None, plan_status="A", mulitple_fields=False):
+    """build_incident_query builds the uri and the filter body for an
+    incident query from the conditions format used by cp4s_query_incidents.
+    Conditions are sorted so the same query always builds the same body.
+
+    :param condition_list: list of conditions as [field_name, field_value, method] or a list of list conditions if multiple_fields==True
+    :param method: set all field conditions to this method (save user from typing it for each field)
+    :param plan_status: "A" == Active, "C" == Closed
+    :param multiple_fields: query more than one field
+    :return: The query uri and the query body
+    :rtype: tuple
+    """
+
+    def buildConditionDict(conditions, method=method):
+        return {
+            'field_name': conditions[0],
+            'value': conditions[1],
+            "method": method if method else conditions[2],
+        }
+
+    if not mulitple_fields:
+        conditions = [conditions]
+
+    conditionList = [buildConditionDict(condition) for condition in conditions]
+    # Conditions are AND'ed so their order has no meaning, sort them for a canonical body
+    conditionList.sort(key=lambda condition: json.dumps(condition, sort_keys=True, default=str))
+
+    query_uri = u"/incidents/query?return_level=normal"
+    for condition in conditionList:
+        query_uri += u"&field_handle={}".format(condition['field_name'])
+
+    conditionList.append({
+                    'field_name': 'plan_status',
+                    'method': 'equals',
+                    'value': plan_status
+                })
+
+    query = {
+        'filters': [{
+            'conditions': conditionList
+        }],
+        "sorts": [{
+            "field_name": "create_date",
+            "type": "desc"
+        }]
+    }
+
+    return query_uri, query
+
+
+def find_incident_ids(client, conditions: list, method=None, plan_status="A", mulitple_fields=False):
+    """find_incident_ids returns the ids of every incident matching
+    the conditions, using the same query as cp4s_query_incidents.
+    """
+    query_uri, query = build_incident_query(conditions, method=method, plan_status=plan_status, mulitple_fields=mulitple_fields)
+    return [incident["id"] for incident in client.post(query_uri, query)]
+
+
+def query_incidents_paged(client, query: dict, start=0, length=100, return_level="normal"):
+    """query_incidents_paged makes one call to the paged incident query
+    endpoint. Unlike /incidents/query this returns a single page of results
+    along with the total number of incidents matching the filters.
+
+    :param client: An authenticated rest client
+    :type client: SimpleClient
+    :param query: A query body with filters and sorts, as sent to /incidents/query
+    :type query: dict
+    :param start: Offset of the first incident to return
+    :type start: int
+    :param length: The maximum number of incidents to return
+    :type length: int
+    :return: The page, with the incidents under 'data' and the match count under 'recordsTotal'
+    :rtype: dict
+    """
+    return client.post(u"/incidents/query_paged?return_level={}".format(return_level), {
+        **query,
+        "start": start,
+        "length": length
+    })
+
+
+def count_incidents(client, query: dict):
+    """count_incidents returns how many incidents match the filters
+    of query. Only a single incident is asked for so the cost of the
+    call does not grow with the number of matches.
+
+    :return: The number of matching incidents
+    :rtype: int
+    """
+    page = query_incidents_paged(client, query, start=0, length=1, return_level="partial")
+    return page.get("recordsTotal", 0)
+
+
+def iter_incidents_paged(client, query: dict, page_size=500, return_level="normal"):
+    """iter_incidents_paged is a generator which walks every page of
+    the paged incident query and yields the incidents one at a time.
+    Only one page is held in memory at once. Once the deadline passes it
+    stops without an error, so check deadline_passed() to know if every
+    incident was yielded.
+
+    :param page_size: How many incidents to ask for per call
+    :type page_size: int
+    :return: A generator of IncidentDTOs in the order of the query sorts
+    :rtype: generator
+    """
+    start = 0
+    while not deadline_passed():
+        try:
+            page = query_incidents_paged(client, query, start=start, length=page_size, return_level=return_level)
+        except DeadlineExceeded:
+            return
+        incidents = page.get("data", [])
+        for incident in incidents:
+            yield incident
+        start += len(incidents)
+        if not incidents or start >= page.get("recordsTotal", 0):
+            return
+
+
+def run_concurrently(func, items, concurrency=8):
+    """run_concurrently calls func once for every item on a pool of
+    threads. An exception for one item does not stop the others, it is
+    recorded against that item instead. Results keep the order of items.
+    Items not started by the deadline are not called and get a
+    DeadlineExceeded error.
+
+    :param func: A function taking a single item
+    :param items: The items to process
+    :param concurrency: The maximum number of calls in flight at once
+    :type concurrency: int
+    :return: One dict per item with the item, its result or error and the seconds it took
+    :rtype: list
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def timed_call(item):
+        start = time.time()
+        outcome = {"item": item, "result": None, "error": None}
+        try:
+            check_deadline()
+            outcome["result"] = func(item)
+        except Exception as e:
+            outcome["error"] = e
+        outcome["elapsed"] = round(time.time() - start, 3)
+        return outcome
+
+    items = list(items)
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(items)))) as pool:
+        return list(pool.map(timed_call, items))
+
+
+def add_incident_conditions(query: dict, conditions: list):
+    """add_incident_conditions returns a copy of query with the extra
+    conditions AND'ed onto every filter group.
+    """
+    return {
+        **query,
+        "filters": [
+            {**query_filter, "conditions": query_filter.get("conditions", []) + conditions}
+            for query_filter in query.get("filters", [])
+        ]
+    }
+
+
+def http_status(error):
+    """http_status returns the HTTP status code of an error raised by the
+    rest client or by requests, None when the call got no response at
+    all, such as a timeout or a refused connection.
+
+    :rtype: int
+    """
+    return getattr(getattr(error, "response", None), "status_code", None)
+
+
+def client_url(client, uri: str):
+    """client_url builds the absolute url of an org scoped uri, the same
+    way the rest client does for its own calls.
+    """
+    return u"{}/rest/orgs/{}{}".format(client.base_url, client.org_id, uri)
+
+
+def raw_request(client, method: str, uri: str, org_scoped=True, **kwargs):
+    """raw_request makes a call with the requests session of an authenticated
+    client. Used where the client's json helpers do not fit, such as streaming
+    a file, and returns the requests Response rather than decoded json.
+
+    :param method: The HTTP method e.g 'get'
+    :type method: str
+    :param uri: An org scoped uri e.g '/incidents/2095/attachments'
+    :type uri: str
+    :param org_scoped: False for a uri from the root of the API e.g '/rest/session'
+    :type org_scoped: bool
+    :return: The response, already checked for an error status
+    :rtype: requests.Response
+    """
+    import requests
+    session = getattr(client, "session", None) or requests
+    headers = {key: value for key, value in client.headers.items() if key.lower() != "content-type"}
+    headers.update(kwargs.pop("headers", {}))
+    url = client_url(client, uri) if org_scoped else u"{}{}".format(client.base_url, uri)
+    response = session.request(method, url,
+                               headers=headers,
+                               cookies=getattr(client, "cookies", None),
+                               auth=getattr(client, "authdata", None),
+                               verify=getattr(client, "verify", True),
+                               proxies=getattr(client, "proxies", None),
+                               **kwargs)
+    response.raise_for_status()
+    return response
@@ -0,0 +1,101 @@
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+import fcntl
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import get_cache_dir, incident_field_value
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_cache import cache_key
+
+__metaclass__ = type
+
+INDEX_CACHE_NAME = "idempotency"
+INDEX_FILE_NAME = "fingerprints.json"
+
+
+def fingerprint_incident(incident: dict, fields: list):
+    """fingerprint_incident hashes the name of an incident together
+    with the values of the selected fields. The same function is used
+    on the create payload and on existing incidents so the two can be compared.
+
+    :param incident: An IncidentDTO or a create payload
+    :type incident: dict
+    :param fields: The extra fields which make an incident unique
+    :type fields: list
+    :return: The fingerprint
+    :rtype: str
+    """
+    return cache_key(incident.get("name"), [[field, incident_field_value(incident, field)] for field in sorted(fields)])
+
+
+class FingerprintIndex(object):
+    """FingerprintIndex is a json file mapping a fingerprint, scoped to
+    an instance and org, to the id of the case created for it.
+    Every read-modify-write holds an exclusive lock so parallel forks
+    creating cases never lose each others entries.
+    """
+
+    def __init__(self, cache_dir=None):
+        cache_dir = cache_dir or get_cache_dir(INDEX_CACHE_NAME)
+        self.path = os.path.join(cache_dir, INDEX_FILE_NAME)
+        self.lock_path = self.path + ".lock"
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as index_file:
+                return json.load(index_file)
+        except (OSError, IOError, ValueError):
+            return {}
+
+    def _save(self, index: dict):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+        with os.fdopen(fd, "w") as index_file:
+            json.dump(index, index_file)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _scoped(scope, fingerprint):
+        return cache_key(scope, fingerprint)
+
+    def get(self, scope, fingerprint):
+        """get returns the case id recorded for fingerprint or None"""
+        return self._load().get(self._scoped(scope, fingerprint))
+
+    def add(self, scope, fingerprint, case_id):
+        with self._locked():
+            index = self._load()
+            index[self._scoped(scope, fingerprint)] = case_id
+            self._save(index)
+
+    def remove(self, scope, fingerprint):
+        """remove drops a single fingerprint, used when its case no longer exists."""
+        with self._locked():
+            index = self._load()
+            if index.pop(self._scoped(scope, fingerprint), None) is not None:
+                self._save(index)
+
+    def remove_case(self, case_id):
+        """remove_case drops every fingerprint pointing at case_id,
+        used when a case is deleted so it can be created again.
+        """
+        with self._locked():
+            index = self._load()
+            remaining = {key: value for key, value in index.items() if str(value) != str(case_id)}
+            if len(remaining) != len(index):
+                self._save(remaining)
@@ -0,0 +1,133 @@
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+import threading
+import time
+
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import create_authenticated_client, remaining_time
+
+__metaclass__ = type
+
+# Key added to every record returned from an instance, holding the instance name
+INSTANCE_RESULT_KEY = "cp4s_instance"
+# app.config options a profile can override
+PROFILE_OVERRIDES = ("host", "org", "api_key_id", "api_key_secret")
+
+# Shared option spec for modules which can run against several instances
+INSTANCE_ARGS = dict(
+    instances=dict(type='list', elements='dict', required=False, default=None, options=dict(
+        name=dict(type='str', required=True),
+        config_file=dict(type='path', required=False, default=None),
+        host=dict(type='str', required=False, default=None),
+        org=dict(type='str', required=False, default=None),
+        api_key_id=dict(type='str', required=False, default=None, no_log=True),
+        api_key_secret=dict(type='str', required=False, default=None, no_log=True)
+    )),
+    instance_timeout=dict(type='int', required=False, default=60)
+)
+
+
+def get_profile_opts(profile: dict):
+    """get_profile_opts parses the app.config of a connection profile,
+    the default app.config if the profile has no config_file, and applies
+    any host, org or API key given in the profile on top of it.
+
+    :return: The connection options for the instance
+    :rtype: dict
+    """
+    import resilient
+    resilient_parser = resilient.ArgumentParser(
+        config_file=profile.get("config_file") or resilient.get_config_file())
+    opts = dict(resilient_parser.parse_known_args()[0])
+    opts.update({key: profile[key] for key in PROFILE_OVERRIDES if profile.get(key) is not None})
+    return opts
+
+
+def run_on_instances(func, profiles: list, timeout=60):
+    """run_on_instances logs in to every instance and calls
+    func(client, opts) for each, all at once. Instances which have not
+    answered after timeout seconds are reported as timeout and the
+    others are returned without waiting for them. The threads are daemon
+    threads so a hung instance never keeps the module from exiting.
+
+    :param func: A function taking an authenticated client and its options
+    :param profiles: Connection profiles from the instances option
+    :param timeout: Seconds to wait for all instances, cut down to the time left before the deadline
+    :return: One dict per profile with its name, host, org, status (ok, failed or timeout), seconds taken and result or error
+    :rtype: list
+    """
+    remaining = remaining_time()
+    if remaining is not None:
+        timeout = max(0, min(timeout, remaining))
+    outcomes = []
+    threads = []
+    lock = threading.Lock()
+    finished = {"closed": False}
+
+    for profile in profiles:
+        outcome = {"instance": profile["name"], "host": profile.get("host"), "org": profile.get("org"),
+                   "status": "timeout", "elapsed": timeout}
+        outcomes.append(outcome)
+        try:
+            opts = get_profile_opts(profile)
+        except Exception as e:
+            outcome.update({"status": "failed", "error": u"Could not read the connection profile: {}".format(e), "elapsed": 0})
+            continue
+        outcome.update({"host": opts.get("host"), "org": opts.get("org")})
+
+        def run(opts=opts, outcome=outcome):
+            start = time.time()
+            try:
+                update = {"result": func(create_authenticated_client(opts), opts), "status": "ok"}
+            except Exception as e:
+                update = {"error": str(e), "status": "failed"}
+            update["elapsed"] = round(time.time() - start, 3)
+            with lock:
+                # A late answer from a timed out instance is dropped
+                if not finished["closed"]:
+                    outcome.update(update)
+
+        thread = threading.Thread(target=run, name="cp4s-{}".format(profile["name"]))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    deadline = time.time() + timeout
+    for thread in threads:
+        thread.join(max(0, deadline - time.time()))
+
+    with lock:
+        finished["closed"] = True
+        return [dict(outcome) for outcome in outcomes]
+
+
+def merge_instance_results(outcomes: list, count_only=False):
+    """merge_instance_results combines the per instance results of
+    run_on_instances. Records are tagged with the name of the instance
+    they came from under cp4s_instance, counts are summed.
+
+    :return: The combined response or count, a summary of every instance and whether any instance is missing
+    :rtype: dict
+    """
+    merged = {"instances": [], "partial": False}
+    if count_only:
+        merged["count"] = 0
+    else:
+        merged["response"] = []
+
+    for outcome in outcomes:
+        summary = {key: value for key, value in outcome.items() if key != "result"}
+        if outcome["status"] != "ok":
+            merged["partial"] = True
+        elif count_only:
+            summary["count"] = outcome["result"]
+            merged["count"] += outcome["result"]
+        else:
+            summary["count"] = len(outcome["result"])
+            merged["response"].extend({**record, INSTANCE_RESULT_KEY: outcome["instance"]} for record in outcome["result"])
+        merged["instances"].append(summary)
+    return merged
@@ -0,0 +1,180 @@
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+import json
+import os
+import tempfile
+import threading
+import time
+
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import get_cache_dir, get_connection_opts
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_cache import cache_key
+
+__metaclass__ = type
+
+JOURNAL_CACHE_NAME = "journals"
+# Least seconds between two writes of the progress file
+PROGRESS_INTERVAL = 1.0
+
+
+class Journal(object):
+    """Journal records the progress of a long bulk operation in a state
+    file, so a run which was killed or failed part way can be resumed
+    without redoing what already finished. It holds the IDs of the items
+    which are done and a cursor, such as a page offset, for operations
+    which walk a stream.
+
+    The file is append only json lines, one line per record, so recording
+    an item costs the same however many are already done. It is safe to
+    record from the threads of the concurrent modes.
+    The progress is also kept in a small json file which can be read while
+    the module runs, for example while it runs with async. async_status
+    only returns the result of a job once it ends, so a caller wanting to
+    watch it passes a progress_path it chose, by default the file is next
+    to the journal and named after the operation.
+    """
+
+    def __init__(self, key, operation="", journal_dir=None, progress_path=None):
+        journal_dir = journal_dir or get_cache_dir(JOURNAL_CACHE_NAME)
+        self.path = os.path.join(journal_dir, "{}.jsonl".format(key))
+        self.progress_path = os.path.abspath(progress_path) if progress_path else os.path.join(
+            journal_dir, "{}-{}.progress.json".format(operation or "journal", key))
+        self.operation = operation
+        self.done = set()
+        self.cursor = None
+        self.total = None
+        self.resumed = 0
+        self._lock = threading.Lock()
+        self._reported = 0
+        self._torn = False
+        self._finished = False
+
+    def start(self, resume=False, total=None):
+        """start loads what a previous run finished when resume is set,
+        otherwise a previous journal is discarded and the run starts over.
+
+        :param total: The number of items or the cursor value at which the operation is done, for the progress
+        :return: The journal, to chain from the constructor
+        :rtype: Journal
+        """
+        if resume:
+            self._load()
+        else:
+            self._remove()
+        self.resumed = len(self.done)
+        self.total = total
+        self.report_progress(force=True)
+        return self
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A run killed while writing leaves a partial last line
+                        self._torn = not line.endswith("\n")
+                        continue
+                    self.done.update(record.get("done", []))
+                    if "cursor" in record:
+                        self.cursor = record["cursor"]
+        except (OSError, IOError):
+            pass
+
+    def _append(self, record: dict):
+        with open(self.path, "a") as journal:
+            if self._torn:
+                # End the partial line so the record is not appended to it
+                journal.write("\n")
+                self._torn = False
+            journal.write(json.dumps(record, separators=(",", ":")) + "\n")
+            journal.flush()
+
+    def is_done(self, item_id):
+        return item_id in self.done
+
+    def pending(self, item_ids):
+        """pending returns the item IDs which are not done yet, in their order."""
+        return [item_id for item_id in item_ids if item_id not in self.done]
+
+    def record_done(self, *item_ids):
+        """record_done marks items as done, straight away on disk."""
+        with self._lock:
+            new_ids = [item_id for item_id in item_ids if item_id not in self.done]
+            if not new_ids:
+                return
+            self.done.update(new_ids)
+            self._append({"done": new_ids})
+        self.report_progress()
+
+    def record_cursor(self, cursor):
+        """record_cursor saves how far through a stream the operation got."""
+        with self._lock:
+            self.cursor = cursor
+            self._append({"cursor": cursor})
+        self.report_progress()
+
+    def progress(self):
+        return {
+            "operation": self.operation,
+            "done": len(self.done),
+            "total": self.total,
+            "cursor": self.cursor,
+            "resumed": self.resumed,
+            "finished": self._finished,
+            "updated": round(time.time(), 3)
+        }
+
+    def report_progress(self, force=False):
+        """report_progress writes the progress file, at most once every
+        PROGRESS_INTERVAL seconds unless forced.
+        """
+        if not force and time.time() - self._reported < PROGRESS_INTERVAL:
+            return
+        with self._lock:
+            self._reported = time.time()
+            try:
+                # Write to a temp file and rename so a reader never sees a partial file
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.progress_path), suffix=".tmp")
+                with os.fdopen(fd, "w") as progress_file:
+                    json.dump(self.progress(), progress_file)
+                os.replace(tmp_path, self.progress_path)
+            except (OSError, IOError):
+                # Progress is best effort, it must never fail the operation
+                pass
+
+    def finish(self):
+        """finish removes the journal once the whole operation is done, so
+        there is nothing left to resume. The progress file is kept, marked
+        finished, and replaced by the next run of the same operation.
+        """
+        self._finished = True
+        self.report_progress(force=True)
+        self._remove()
+
+    def _remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def open_journal(operation: str, *parts, resume=False, total=None, progress_path=None):
+    """open_journal starts the journal of an operation, keyed by the
+    operation, the instance and org from app.config and any json
+    serializable parts which identify the run, such as its parameters.
+    A rerun with the same parameters and resume finds the same journal.
+
+    :param progress_path: Where to write the progress, a file next to the journal when not set
+
+    :return: The started journal
+    :rtype: Journal
+    """
+    opts = get_connection_opts()
+    key = cache_key(operation, opts.get("host"), opts.get("org"), *parts)
+    return Journal(key, operation=operation, progress_path=progress_path).start(resume=resume, total=total)
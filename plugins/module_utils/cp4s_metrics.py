@@ -0,0 +1,210 @@
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+import math
+import re
+import threading
+
+__metaclass__ = type
+
+# Key the modules return their instrumentation under, read by the cp4s_metrics callback
+METRICS_RESULT_KEY = "cp4s_metrics"
+# Latencies are kept as a histogram of millisecond buckets, each 10% wider than the last,
+# so any number of calls costs a few dozen entries and histograms from many tasks can be merged
+HISTOGRAM_GROWTH = 1.1
+
+ORG_PREFIX_PATTERN = re.compile(r"^.*?/rest/orgs/\d+")
+ID_SEGMENT_PATTERN = re.compile(r"/\d+(?=/|$)")
+
+
+def endpoint_template(url: str):
+    """endpoint_template turns a request url into the endpoint it calls,
+    e.g https://host/rest/orgs/201/incidents/2095/comments?handle_format=names
+    becomes /incidents/{id}/comments, so calls to the same endpoint are grouped.
+    """
+    path = ORG_PREFIX_PATTERN.sub("", url.split("?", 1)[0].split("#", 1)[0])
+    return ID_SEGMENT_PATTERN.sub("/{id}", path) or "/"
+
+
+def latency_bucket(seconds: float):
+    """latency_bucket returns the histogram bucket of a latency."""
+    milliseconds = seconds * 1000
+    if milliseconds <= 1:
+        return "0"
+    return str(int(math.ceil(math.log(milliseconds, HISTOGRAM_GROWTH))))
+
+
+def bucket_upper_bound(bucket):
+    """bucket_upper_bound returns the largest latency in seconds which falls in bucket."""
+    return round(HISTOGRAM_GROWTH ** int(bucket) / 1000, 4)
+
+
+def merge_histograms(*histograms):
+    merged = {}
+    for histogram in histograms:
+        for bucket, count in (histogram or {}).items():
+            merged[str(bucket)] = merged.get(str(bucket), 0) + count
+    return merged
+
+
+def histogram_percentile(histogram: dict, percentile: float):
+    """histogram_percentile returns the latency in seconds below which
+    percentile percent of the calls in histogram fell, to within a bucket.
+
+    :return: The latency or None if the histogram is empty
+    :rtype: float
+    """
+    total = sum(histogram.values())
+    if not total:
+        return None
+    rank = percentile / 100.0 * total
+    seen = 0
+    for bucket in sorted(histogram, key=int):
+        seen += histogram[bucket]
+        if seen >= rank:
+            return bucket_upper_bound(bucket)
+    return bucket_upper_bound(max(histogram, key=int))
+
+
+def merge_endpoint_metrics(merged: dict, endpoint: dict):
+    """merge_endpoint_metrics adds the counters of one endpoint onto merged, in place."""
+    merged["calls"] = merged.get("calls", 0) + endpoint.get("calls", 0)
+    merged["errors"] = merged.get("errors", 0) + endpoint.get("errors", 0)
+    merged["seconds"] = round(merged.get("seconds", 0) + endpoint.get("seconds", 0), 3)
+    merged["max"] = max(merged.get("max", 0), endpoint.get("max", 0))
+    merged["bytes_sent"] = merged.get("bytes_sent", 0) + endpoint.get("bytes_sent", 0)
+    merged["bytes_received"] = merged.get("bytes_received", 0) + endpoint.get("bytes_received", 0)
+    # Bytes before request compression and after response decoding, the same as on the wire when uncompressed
+    merged["bytes_sent_raw"] = merged.get("bytes_sent_raw", 0) + endpoint.get("bytes_sent_raw", endpoint.get("bytes_sent", 0))
+    merged["bytes_received_decoded"] = (merged.get("bytes_received_decoded", 0)
+                                        + endpoint.get("bytes_received_decoded", endpoint.get("bytes_received", 0)))
+    statuses = merged.setdefault("statuses", {})
+    for status, count in endpoint.get("statuses", {}).items():
+        statuses[str(status)] = statuses.get(str(status), 0) + count
+    merged["histogram"] = merge_histograms(merged.get("histogram"), endpoint.get("histogram"))
+    return merged
+
+
+class ClientMetrics(object):
+    """ClientMetrics counts the logins and API calls made by a module,
+    grouped by method and endpoint. It is safe to record from the threads
+    of the concurrent modes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.logins = 0
+        self.login_seconds = 0.0
+        self.endpoints = {}
+
+    def record_login(self, seconds: float):
+        with self._lock:
+            self.logins += 1
+            self.login_seconds += seconds
+
+    def record(self, method: str, url: str, status: int, seconds: float, bytes_sent=0, bytes_received=0,
+               bytes_sent_raw=None, bytes_received_decoded=None):
+        """record counts one call. bytes_sent and bytes_received are the
+        sizes on the wire, the raw and decoded sizes default to the same.
+        """
+        key = "{} {}".format(method.upper(), endpoint_template(url))
+        with self._lock:
+            merge_endpoint_metrics(self.endpoints.setdefault(key, {}), {
+                "calls": 1,
+                "errors": 1 if status >= 400 else 0,
+                "seconds": seconds,
+                "max": round(seconds, 4),
+                "bytes_sent": bytes_sent,
+                "bytes_received": bytes_received,
+                "bytes_sent_raw": bytes_sent if bytes_sent_raw is None else bytes_sent_raw,
+                "bytes_received_decoded": bytes_received if bytes_received_decoded is None else bytes_received_decoded,
+                "statuses": {str(status): 1},
+                "histogram": {latency_bucket(seconds): 1}
+            })
+
+    def is_empty(self):
+        return not self.logins and not self.endpoints
+
+    def as_dict(self):
+        with self._lock:
+            endpoints = {key: dict(value) for key, value in self.endpoints.items()}
+            return {
+                "logins": self.logins,
+                "login_seconds": round(self.login_seconds, 3),
+                "calls": sum(endpoint["calls"] for endpoint in endpoints.values()),
+                "errors": sum(endpoint["errors"] for endpoint in endpoints.values()),
+                "bytes_sent": sum(endpoint["bytes_sent"] for endpoint in endpoints.values()),
+                "bytes_received": sum(endpoint["bytes_received"] for endpoint in endpoints.values()),
+                "bytes_sent_raw": sum(endpoint["bytes_sent_raw"] for endpoint in endpoints.values()),
+                "bytes_received_decoded": sum(endpoint["bytes_received_decoded"] for endpoint in endpoints.values()),
+                "endpoints": endpoints
+            }
+
+
+# The metrics of the running module, every client made by create_authenticated_client records here
+CLIENT_METRICS = ClientMetrics()
+
+
+def _content_length(headers, body=None):
+    if headers and headers.get("Content-Length"):
+        try:
+            return int(headers["Content-Length"])
+        except ValueError:
+            pass
+    if isinstance(body, (bytes, str)):
+        return len(body)
+    return 0
+
+
+def instrument_session(session, metrics=None):
+    """instrument_session adds a response hook to a requests session
+    which records every call made through it. The latency is the time to
+    the response headers. Bodies which requests reads anyway are read here
+    to get both their size on the wire and decoded. Streamed bodies are
+    never read by the hook and are sized from Content-Length.
+    """
+    metrics = metrics or CLIENT_METRICS
+
+    def record_response(response, *args, **kwargs):
+        request = response.request
+        bytes_sent = _content_length(request.headers, request.body)
+        bytes_received = _content_length(response.headers)
+        bytes_received_decoded = None
+        if not kwargs.get("stream"):
+            bytes_received_decoded = len(response.content)
+            if not bytes_received:
+                # Without a Content-Length the raw stream knows how much came over the wire
+                tell = getattr(response.raw, "tell", None)
+                bytes_received = tell() if callable(tell) else bytes_received_decoded
+        metrics.record(request.method, request.url, response.status_code, response.elapsed.total_seconds(),
+                       bytes_sent=bytes_sent, bytes_received=bytes_received,
+                       bytes_sent_raw=getattr(request, "cp4s_raw_bytes", None),
+                       bytes_received_decoded=bytes_received_decoded)
+        return response
+
+    session.hooks.setdefault("response", []).append(record_response)
+    return session
+
+
+def instrument_module(module, metrics=None):
+    """instrument_module makes exit_json and fail_json of an AnsibleModule
+    add the metrics of the module's API calls to its result, under
+    cp4s_metrics, for the cp4s_metrics callback plugin to aggregate.
+    Nothing is added when the module made no calls.
+    """
+    metrics = metrics or CLIENT_METRICS
+
+    def with_metrics(exit_function):
+        def report(*args, **kwargs):
+            if not metrics.is_empty():
+                kwargs[METRICS_RESULT_KEY] = metrics.as_dict()
+            return exit_function(*args, **kwargs)
+        return report
+
+    module.exit_json = with_metrics(module.exit_json)
+    module.fail_json = with_metrics(module.fail_json)
+    return module
@@ -0,0 +1,307 @@
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+import csv
+import datetime
+import gzip
+import json
+import os
+import sys
+import traceback
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    HAS_PYARROW = True
+    PYARROW_IMPORT_ERROR = None
+except ImportError:
+    HAS_PYARROW = False
+    PYARROW_IMPORT_ERROR = traceback.format_exc()
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+__metaclass__ = type
+
+# Column types which can be given as path:type in a column list
+COLUMN_TYPES = ("int", "float", "bool", "str", "timestamp")
+# Builtin incident fields and the type of their column when no type is given
+INCIDENT_COLUMN_TYPES = {
+    "id": "int", "owner_id": "int", "creator_id": "int", "severity_code": "int", "phase_id": "int",
+    "resolution_id": "int", "org_id": "int", "vers": "int", "confirmed": "bool", "is_scenario": "bool",
+    "create_date": "timestamp", "discovered_date": "timestamp", "due_date": "timestamp",
+    "end_date": "timestamp", "start_date": "timestamp", "inc_start": "timestamp",
+    "inc_last_modified_date": "timestamp"
+}
+DEFAULT_EXPORT_COLUMNS = [
+    "id", "name", "plan_status", "severity_code", "owner_id", "phase_id",
+    "create_date", "discovered_date", "inc_last_modified_date", "incident_type_ids"
+]
+
+# Shared option spec for modules which can write their records to a file instead of the result
+OUTPUT_FILE_ARGS = dict(
+    output_file=dict(type='path', required=False, default=None),
+    output_gzip=dict(type='bool', required=False, default=False),
+    page_size=dict(type='int', required=False, default=500)
+)
+# Shared option spec for modules which can return large lists of records in the result
+RESULT_ENCODING_ARGS = dict(
+    fast_json=dict(type='bool', required=False, default=False),
+    drop_empty_fields=dict(type='bool', required=False, default=False)
+)
+
+
+def write_ndjson(path: str, records, compress=False):
+    """write_ndjson writes each record as one line of json to path
+    as the records are produced, so a generator of records is never
+    fully held in memory.
+
+    :param path: The file to write, parent directories must exist
+    :type path: str
+    :param records: Any iterable of json serializable records
+    :param compress: gzip the file as it is written
+    :type compress: bool
+    :return: The path, the number of records and the size of the file in bytes
+    :rtype: dict
+    """
+    opener = gzip.open if compress else open
+    record_count = 0
+    with opener(path, "wt", encoding="utf-8") as output:
+        for record in records:
+            output.write(json.dumps(record, separators=(",", ":")))
+            output.write("\n")
+            record_count += 1
+
+    return {
+        "path": path,
+        "record_count": record_count,
+        "bytes": os.path.getsize(path)
+    }
+
+
+def parse_columns(columns: list):
+    """parse_columns turns a column list into (name, path, type) tuples.
+    Each column is a dotted path into the record such as properties.source,
+    optionally followed by :type. Builtin incident fields default to their
+    own type and anything else to str. Dots in the path become _ in the name.
+
+    :raises ValueError: If a type is unknown
+    """
+    parsed = []
+    for column in columns:
+        path, _, column_type = column.partition(":")
+        column_type = column_type or INCIDENT_COLUMN_TYPES.get(path, "str")
+        if column_type not in COLUMN_TYPES:
+            raise ValueError(u"Column '{}' has type '{}', expected one of {}".format(path, column_type, ", ".join(COLUMN_TYPES)))
+        parsed.append((path.replace(".", "_"), path, column_type))
+    return parsed
+
+
+def _record_value(record: dict, path: str):
+    value = record
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _typed_value(value, column_type: str):
+    """_typed_value converts a DTO value to the type of its column, None if it cannot be."""
+    if value is None or value == "":
+        return None
+    try:
+        if column_type in ("int", "timestamp"):
+            return int(value)
+        if column_type == "float":
+            return float(value)
+        if column_type == "bool":
+            return value if isinstance(value, bool) else str(value).lower() in ("true", "1", "yes")
+    except (TypeError, ValueError):
+        return None
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(",", ":"), sort_keys=True)
+    return str(value)
+
+
+def flatten_record(record: dict, columns: list):
+    """flatten_record picks the typed value of every column out of a nested record.
+
+    :param columns: Columns from parse_columns
+    :return: The values in column order
+    :rtype: list
+    """
+    return [_typed_value(_record_value(record, path), column_type) for _, path, column_type in columns]
+
+
+def write_csv(path: str, records, columns: list, compress=False):
+    """write_csv writes each record as one flattened row as the records
+    are produced. Timestamps are written as UTC ISO 8601.
+
+    :param columns: Columns from parse_columns
+    :return: The path, the number of records and the size of the file in bytes
+    :rtype: dict
+    """
+    timestamps = [position for position, column in enumerate(columns) if column[2] == "timestamp"]
+    opener = gzip.open if compress else open
+    record_count = 0
+    with opener(path, "wt", encoding="utf-8", newline="") as output:
+        writer = csv.writer(output)
+        writer.writerow([name for name, _, _ in columns])
+        for record in records:
+            row = flatten_record(record, columns)
+            for position in timestamps:
+                if row[position] is not None:
+                    row[position] = datetime.datetime.fromtimestamp(
+                        row[position] / 1000.0, tz=datetime.timezone.utc).isoformat(timespec="milliseconds")
+            writer.writerow(row)
+            record_count += 1
+
+    return {
+        "path": path,
+        "record_count": record_count,
+        "bytes": os.path.getsize(path)
+    }
+
+
+def parquet_schema(columns: list):
+    arrow_types = {
+        "int": pyarrow.int64(),
+        "float": pyarrow.float64(),
+        "bool": pyarrow.bool_(),
+        "str": pyarrow.string(),
+        # Incident dates are epoch milliseconds
+        "timestamp": pyarrow.timestamp("ms", tz="UTC")
+    }
+    return pyarrow.schema([(name, arrow_types[column_type]) for name, _, column_type in columns])
+
+
+def write_parquet(path: str, records, columns: list, compression="snappy", row_group_size=10000):
+    """write_parquet writes the flattened records to a Parquet file one row
+    group at a time, so at most row_group_size records are held in memory.
+    Requires pyarrow.
+
+    :param columns: Columns from parse_columns
+    :param compression: The Parquet codec e.g snappy, gzip, zstd or none
+    :return: The path, the number of records and row groups and the size of the file in bytes
+    :rtype: dict
+    """
+    schema = parquet_schema(columns)
+    names = [name for name, _, _ in columns]
+    record_count = 0
+    row_groups = 0
+
+    def write_group(writer, group):
+        writer.write_table(pyarrow.Table.from_pydict(
+            {name: [row[position] for row in group] for position, name in enumerate(names)}, schema=schema))
+
+    with pyarrow.parquet.ParquetWriter(path, schema, compression=compression or "none") as writer:
+        group = []
+        for record in records:
+            group.append(flatten_record(record, columns))
+            if len(group) >= row_group_size:
+                write_group(writer, group)
+                record_count += len(group)
+                row_groups += 1
+                group = []
+        if group or not row_groups:
+            write_group(writer, group)
+            record_count += len(group)
+            row_groups += 1
+
+    return {
+        "path": path,
+        "record_count": record_count,
+        "row_groups": row_groups,
+        "bytes": os.path.getsize(path)
+    }
+
+
+def _mark_non_empty(record: dict, node: tuple):
+    """_mark_non_empty records which fields of record have a value. A node
+    is the set of fields seen with a value, kept whole, and a node for every
+    field seen holding an object. Fields already kept whole are skipped with
+    one set difference, so after the first records only the fields which
+    are still empty cost anything.
+    """
+    whole, children = node
+    for key in record.keys() - whole:
+        value = record[key]
+        if isinstance(value, dict):
+            _mark_non_empty(value, children.setdefault(key, (set(), {})))
+        # Only None and empty strings, lists and objects are empty, 0 and false are values
+        elif value or not (value is None or isinstance(value, (str, list))):
+            whole.add(key)
+
+
+def _live_node(node: tuple):
+    """_live_node drops the object fields with no value anywhere below them."""
+    whole, children = node
+    live = {}
+    for key, child in children.items():
+        if key not in whole:
+            child = _live_node(child)
+            if child[0] or child[1]:
+                live[key] = child
+    return whole, live
+
+
+def _prune(record: dict, node: tuple):
+    whole, live = node
+    if record.keys() <= whole:
+        return record
+    pruned = {}
+    for key, value in record.items():
+        if key in whole:
+            pruned[key] = value
+        elif key in live:
+            pruned[key] = _prune(value, live[key]) if isinstance(value, dict) else value
+    return pruned
+
+
+def drop_empty_fields(records: list):
+    """drop_empty_fields removes the fields which are null, empty strings,
+    lists or objects in every one of records, including nested fields such
+    as the custom fields under properties. A field with a value in any
+    record is kept in all of them, so every record keeps the same shape.
+    0 and false are values and are kept.
+
+    :return: The records without the always empty fields, sharing any unchanged objects with the input
+    :rtype: list
+    """
+    node = (set(), {})
+    for record in records:
+        _mark_non_empty(record, node)
+    node = _live_node(node)
+    return [_prune(record, node) for record in records]
+
+
+def _encode_default(value):
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+
+def fast_jsonify(data):
+    """fast_jsonify encodes a module result with orjson when it is installed
+    and stdout takes utf-8, otherwise with the stdlib encoder. Either way the
+    output has no whitespace between tokens.
+    """
+    if HAS_ORJSON and (getattr(sys.stdout, "encoding", None) or "").lower().replace("-", "") == "utf8":
+        return orjson.dumps(data, default=_encode_default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(data, separators=(",", ":"), default=_encode_default)
+
+
+def use_fast_json(module):
+    """use_fast_json makes exit_json and fail_json of an AnsibleModule
+    encode the result with fast_jsonify instead of the default encoder.
+    """
+    module.jsonify = fast_jsonify
+    return module
@@ -0,0 +1,130 @@
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import get_cache_dir
+
+__metaclass__ = type
+
+QUERY_CACHE_NAME = "queries"
+# Eviction limits, whichever is hit first removes the least recently used entries
+DEFAULT_MAX_ENTRIES = 128
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def cache_key(*parts):
+    """cache_key builds a stable hash from any json serializable parts.
+    Keys are sorted and whitespace removed so two equal
+    queries always produce the same key.
+
+    :return: A hex digest to be used as the cache key
+    :rtype: str
+    """
+    canonical = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class QueryCache(object):
+    """QueryCache is a small on disk LRU cache for query results.
+    Each entry is a json file named after its key. The mtime of the
+    file is refreshed on every hit and used as the LRU order, while
+    the creation time stored in the entry is used for the TTL.
+    Modules run on the controller for this collection so the cache
+    is shared between every task of a play.
+    """
+
+    def __init__(self, cache_dir=None, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or get_cache_dir(QUERY_CACHE_NAME)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, "{}.json".format(key))
+
+    def get(self, key, ttl):
+        """get returns the cached value for key or None if
+        there is no entry or the entry is older than ttl seconds.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r") as cache_file:
+                entry = json.load(cache_file)
+        except (OSError, IOError, ValueError):
+            return None
+
+        if time.time() - entry.get("created", 0) > ttl:
+            self._remove(path)
+            return None
+        # Mark the entry as recently used
+        os.utime(path, None)
+        return entry.get("value")
+
+    def set(self, key, value):
+        """set stores value under key, then evicts
+        the least recently used entries if over the limits.
+        """
+        # Write to a temp file and rename so concurrent forks never read a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as cache_file:
+            json.dump({"created": time.time(), "value": value}, cache_file)
+        os.replace(tmp_path, self._path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        while entries and (len(entries) > self.max_entries or total_bytes > self.max_bytes):
+            _, size, path = entries.pop(0)
+            self._remove(path)
+            total_bytes -= size
+
+    def clear(self):
+        for name in os.listdir(self.cache_dir):
+            self._remove(os.path.join(self.cache_dir, name))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def invalidate_query_cache(module=None):
+    """invalidate_query_cache drops every cached query result.
+    Called by any module which mutates incidents so a later
+    query in the same run never returns stale cases.
+    It never raises, the change it follows has already been made so
+    failing the module would only invite a retry which makes it twice.
+
+    :param module: The AnsibleModule to warn on if the cache could not be cleared
+    :return: Whether the cache was cleared
+    :rtype: bool
+    """
+    try:
+        QueryCache().clear()
+    except (OSError, IOError) as e:
+        if module is not None:
+            module.warn(u'The query cache could not be cleared, cached queries may return stale cases: {}'.format(e))
+        return False
+    return True
@@ -0,0 +1,148 @@
+# Copyright: (c) 2021, Brian Reid
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+import difflib
+import json
+import re
+import time
+
+__metaclass__ = type
+
+# Builtin incident fields which can be used in a query without a properties. prefix
+INCIDENT_FIELDS = frozenset([
+    "addr", "city", "confirmed", "country", "create_date", "creator_id", "crimestatus_id",
+    "description", "discovered_date", "due_date", "employee_involved", "end_date",
+    "exposure_dept_id", "exposure_individual_name", "exposure_type_id", "exposure_vendor_id",
+    "id", "inc_last_modified_date", "inc_start", "inc_training", "incident_type_ids",
+    "is_scenario", "jurisdiction_name", "members", "name", "negative_pr_likely", "nist_attack_vectors",
+    "org_handle", "org_id", "owner_id", "phase_id", "plan_status", "reporter", "resolution_id",
+    "resolution_summary", "severity_code", "start_date", "state", "vers", "workspace", "zip"
+])
+
+# Operators which are sent to the server as they are
+METHODS = frozenset([
+    "equals", "not_equals", "contains", "not_contains", "gt", "gte", "lt", "lte",
+    "in", "not_in", "has_a_value", "not_has_a_value"
+])
+# Operators which take a list of values
+LIST_METHODS = frozenset(["in", "not_in"])
+# Operators which take no value
+VALUELESS_METHODS = frozenset(["has_a_value", "not_has_a_value"])
+# Relative date operators, compiled to a server side comparison against now - duration
+RELATIVE_DATE_METHODS = {"within": "gte", "older_than": "lt"}
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+DURATION_PATTERN = re.compile(r"^\s*(\d+)\s*([smhdw])\s*$")
+
+
+def parse_duration(duration: str):
+    """parse_duration turns a relative duration like '24h' or '7d' into seconds.
+
+    :raises ValueError: If the duration is not a number followed by one of s, m, h, d or w
+    """
+    match = DURATION_PATTERN.match(str(duration))
+    if not match:
+        raise ValueError(u"Invalid duration '{}', expected a number followed by one of {}".format(
+            duration, ", ".join(DURATION_UNITS)))
+    return int(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def validate_field(field_name: str, known_fields=INCIDENT_FIELDS):
+    """validate_field checks a field name before it is sent to the server.
+    Custom fields must be given with a properties. prefix.
+
+    :raises ValueError: With the closest known field names if the field is unknown
+    """
+    if field_name.startswith("properties.") or field_name in known_fields:
+        return
+    suggestions = difflib.get_close_matches(field_name, known_fields, n=3)
+    raise ValueError(u"Unknown incident field '{}'{}".format(
+        field_name, u", did you mean {}?".format(" or ".join(suggestions)) if suggestions else
+        u", custom fields need a properties. prefix"))
+
+
+def compile_condition(condition: dict, now=None, known_fields=INCIDENT_FIELDS):
+    """compile_condition turns one DSL condition, {field, op, value},
+    into a server side condition.
+
+    :raises ValueError: If the field, operator or value is invalid
+    """
+    field_name = condition.get("field")
+    op = condition.get("op", "equals")
+    value = condition.get("value")
+    if not field_name:
+        raise ValueError(u"Condition {} has no field".format(json.dumps(condition, default=str)))
+    validate_field(field_name, known_fields)
+
+    if op in RELATIVE_DATE_METHODS:
+        now = time.time() if now is None else now
+        # Incident date fields are epoch milliseconds
+        return {
+            "field_name": field_name,
+            "method": RELATIVE_DATE_METHODS[op],
+            "value": int((now - parse_duration(value)) * 1000)
+        }
+    if op not in METHODS:
+        raise ValueError(u"Unknown operator '{}' for field '{}', expected one of {}".format(
+            op, field_name, ", ".join(sorted(METHODS | set(RELATIVE_DATE_METHODS)))))
+    if op in LIST_METHODS and not isinstance(value, list):
+        value = [value]
+    if op in VALUELESS_METHODS:
+        return {"field_name": field_name, "method": op}
+    return {"field_name": field_name, "method": op, "value": value}
+
+
+def compile_sorts(sorts, known_fields=INCIDENT_FIELDS):
+    """compile_sorts turns a list of field names, each optionally prefixed
+    with - for descending order, into server side sorts.
+    """
+    compiled = []
+    for sort in sorts:
+        descending = sort.startswith("-")
+        field_name = sort.lstrip("-+")
+        validate_field(field_name, known_fields)
+        compiled.append({"field_name": field_name, "type": "desc" if descending else "asc"})
+    return compiled
+
+
+def compile_query(query: dict, plan_status="A", now=None, known_fields=INCIDENT_FIELDS):
+    """compile_query turns the structured query option into a single
+    /incidents/query request. Each entry of query['filters'] is a group of
+    AND'ed conditions, and the groups are OR'ed by the server.
+
+    :param query: {'filters': [{'conditions': [{'field', 'op', 'value'}]}], 'sorts': ['-create_date']}
+    :type query: dict
+    :param plan_status: Added to every group that does not filter on plan_status itself. None to match any status
+    :type plan_status: str
+    :param now: The epoch seconds relative dates are computed from, the current time if not provided
+    :type now: float
+    :return: The query uri and the query body
+    :rtype: tuple
+    :raises ValueError: If any part of the query is invalid, before anything is sent
+    """
+    groups = query.get("filters") or []
+    if not groups:
+        raise ValueError(u"The query needs at least one entry in filters")
+
+    filters = []
+    field_names = set()
+    for group in groups:
+        conditions = [compile_condition(condition, now, known_fields) for condition in group.get("conditions", [])]
+        if plan_status and not any(condition["field_name"] == "plan_status" for condition in conditions):
+            conditions.append({"field_name": "plan_status", "method": "equals", "value": plan_status})
+        field_names.update(condition["field_name"] for condition in conditions)
+        filters.append({"conditions": conditions})
+
+    body = {
+        "filters": filters,
+        "sorts": compile_sorts(query.get("sorts") or ["-create_date"], known_fields)
+    }
+
+    query_uri = u"/incidents/query?return_level=normal"
+    for field_name in sorted(field_names - {"plan_status"}):
+        query_uri += u"&field_handle={}".format(field_name)
+    return query_uri, body
@@ -0,0 +1,162 @@
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+import difflib
+
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import create_authenticated_client, get_cache_dir, get_connection_opts
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_cache import QueryCache, cache_key
+
+__metaclass__ = type
+
+SCHEMA_CACHE_NAME = "schema"
+DEFAULT_SCHEMA_TTL = 3600
+# Field input types whose values are sent as the ID of one of the field's values
+SELECT_INPUT_TYPES = frozenset(["select", "multiselect"])
+# Keys of an IncidentDTO payload which are not incident fields
+PAYLOAD_EXTRA_KEYS = frozenset(["properties", "artifacts", "comments", "id", "vers", "org_id"])
+
+# Shared option spec for modules which validate against the incident schema
+SCHEMA_ARGS = dict(
+    schema_ttl=dict(type='int', required=False, default=DEFAULT_SCHEMA_TTL)
+)
+
+
+class IncidentSchema(object):
+    """IncidentSchema wraps the incident field definitions returned by
+    /types/incident/fields. Builtin fields are keyed by their name and
+    custom fields by properties.<name>, the same way they are named in a query.
+    """
+
+    def __init__(self, fields: list):
+        self.fields = {}
+        for field in fields:
+            prefix = field.get("prefix")
+            self.fields["{}.{}".format(prefix, field["name"]) if prefix else field["name"]] = field
+
+    def field_names(self):
+        return frozenset(self.fields)
+
+    def validate_field(self, field_name: str):
+        """validate_field checks field_name exists on this instance.
+
+        :raises ValueError: With the closest known field names if the field is unknown
+        """
+        if field_name in self.fields:
+            return
+        suggestions = difflib.get_close_matches(field_name, self.fields, n=3)
+        raise ValueError(u"Unknown incident field '{}'{}".format(
+            field_name, u", did you mean {}?".format(" or ".join(suggestions)) if suggestions else ""))
+
+    def resolve_value(self, field_name: str, value):
+        """resolve_value turns the label of a select or multiselect value,
+        e.g 'High' for severity_code, into the ID the API expects.
+        IDs and values of other field types are returned unchanged.
+
+        :raises ValueError: If a label does not match any value of the field
+        """
+        field = self.fields.get(field_name, {})
+        if field.get("input_type") not in SELECT_INPUT_TYPES or value is None:
+            return value
+        if isinstance(value, list):
+            return [self.resolve_value(field_name, item) for item in value]
+
+        values = field.get("values", [])
+        if value in [option.get("value") for option in values]:
+            return value
+        labels = {str(option.get("label", "")).lower(): option.get("value") for option in values}
+        if str(value).lower() in labels:
+            return labels[str(value).lower()]
+        raise ValueError(u"'{}' is not a value of incident field '{}', expected one of {}".format(
+            value, field_name, ", ".join(str(option.get("label")) for option in values)))
+
+    def resolve_query(self, query: dict):
+        """resolve_query validates every field of an incident query body and
+        resolves select labels in its conditions.
+
+        :return: A copy of the query with resolved values
+        :rtype: dict
+        """
+        filters = []
+        for query_filter in query.get("filters", []):
+            conditions = []
+            for condition in query_filter.get("conditions", []):
+                self.validate_field(condition["field_name"])
+                if "value" in condition:
+                    condition = {**condition, "value": self.resolve_value(condition["field_name"], condition["value"])}
+                conditions.append(condition)
+            filters.append({**query_filter, "conditions": conditions})
+        for sort in query.get("sorts", []):
+            self.validate_field(sort["field_name"])
+        return {**query, "filters": filters}
+
+    def resolve_payload(self, payload: dict):
+        """resolve_payload validates the keys of a create or close payload,
+        including its custom properties, and resolves select labels.
+
+        :return: A copy of the payload with resolved values
+        :rtype: dict
+        """
+        resolved = {}
+        for field_name, value in payload.items():
+            if field_name in PAYLOAD_EXTRA_KEYS:
+                resolved[field_name] = value
+                continue
+            self.validate_field(field_name)
+            resolved[field_name] = self.resolve_value(field_name, value)
+
+        properties = {}
+        for field_name, value in (payload.get("properties") or {}).items():
+            self.validate_field("properties.{}".format(field_name))
+            properties[field_name] = self.resolve_value("properties.{}".format(field_name), value)
+        if properties:
+            resolved["properties"] = properties
+        return resolved
+
+
+def load_incident_schema(ttl=DEFAULT_SCHEMA_TTL, opts=None, client=None):
+    """load_incident_schema returns the incident schema of the instance in
+    app.config. The field definitions are fetched at most once per instance,
+    org and ttl seconds and kept on disk for every other task and play.
+
+    :param ttl: Seconds the cached field definitions stay valid
+    :type ttl: int
+    :param opts: Already parsed app.config options
+    :type opts: dict
+    :param client: An already authenticated client to use on a cache miss
+    :type client: SimpleClient
+    :return: The incident schema
+    :rtype: IncidentSchema
+    """
+    opts = opts or get_connection_opts()
+    key = cache_key(opts.get("host"), opts.get("org"), "/types/incident/fields")
+    cache = QueryCache(cache_dir=get_cache_dir(SCHEMA_CACHE_NAME))
+
+    fields = cache.get(key, ttl)
+    if fields is None:
+        client = client or create_authenticated_client(opts)
+        fields = client.get("/types/incident/fields")
+        cache.set(key, fields)
+    return IncidentSchema(fields)
+
+
+def load_module_schema(module):
+    """load_module_schema loads the incident schema for a module using its
+    schema_ttl option. Validation is an optimisation, the server still checks
+    every request, so a failure to load the schema is a warning and None
+    is returned rather than failing the task.
+
+    :param module: An AnsibleModule with the SCHEMA_ARGS options
+    :return: The incident schema or None if disabled or unavailable
+    :rtype: IncidentSchema
+    """
+    if module.params["schema_ttl"] <= 0:
+        return None
+    try:
+        return load_incident_schema(module.params["schema_ttl"])
+    except Exception as e:
+        module.warn(u"Could not load the incident schema, fields will not be validated locally: {}".format(e))
+        return None
@@ -0,0 +1,151 @@
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+import hashlib
+import json
+import mimetypes
+import os
+import tempfile
+import time
+import uuid
+
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import raw_request
+
+__metaclass__ = type
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# Progress is recorded each time another PROGRESS_STEP percent of the file has moved
+PROGRESS_STEP = 10
+
+
+class TransferProgress(object):
+    """TransferProgress tracks the bytes moved by a transfer, the sha256 of
+    those bytes and the elapsed time at every PROGRESS_STEP percent.
+    """
+
+    def __init__(self, total_bytes=None):
+        self.total_bytes = total_bytes
+        self.bytes = 0
+        self.sha256 = hashlib.sha256()
+        self.start = time.time()
+        self.checkpoints = []
+
+    def update(self, chunk: bytes):
+        self.bytes += len(chunk)
+        self.sha256.update(chunk)
+        if self.total_bytes:
+            percent = min(100, self.bytes * 100 // self.total_bytes)
+            reached = percent - percent % PROGRESS_STEP
+            if reached and (not self.checkpoints or self.checkpoints[-1]["percent"] < reached):
+                self.checkpoints.append({"percent": reached, "elapsed": round(time.time() - self.start, 3)})
+
+    def summary(self):
+        elapsed = time.time() - self.start
+        return {
+            "bytes": self.bytes,
+            "sha256": self.sha256.hexdigest(),
+            "elapsed": round(elapsed, 3),
+            "bytes_per_second": int(self.bytes / elapsed) if elapsed else self.bytes,
+            "progress": self.checkpoints
+        }
+
+
+class MultipartFileStream(object):
+    """MultipartFileStream is a file-like multipart/form-data body for a
+    single file. The file is read one chunk at a time as requests sends
+    the body, so it is never fully loaded into memory. Its length is known
+    up front so the upload is sent with a Content-Length, not chunked.
+    """
+
+    def __init__(self, path: str, field_name="file", filename=None, content_type=None, progress=None):
+        self.boundary = uuid.uuid4().hex
+        filename = filename or os.path.basename(path)
+        content_type = content_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        self.preamble = (
+            u"--{}\r\nContent-Disposition: form-data; name=\"{}\"; filename={}\r\n"
+            u"Content-Type: {}\r\n\r\n".format(self.boundary, field_name, json.dumps(filename), content_type)
+        ).encode("utf-8")
+        self.epilogue = u"\r\n--{}--\r\n".format(self.boundary).encode("utf-8")
+        self.file_size = os.path.getsize(path)
+        self.file = open(path, "rb")
+        self.progress = progress or TransferProgress(self.file_size)
+        self._parts = [self.preamble, None, self.epilogue]
+
+    @property
+    def content_type(self):
+        return "multipart/form-data; boundary={}".format(self.boundary)
+
+    def __len__(self):
+        return len(self.preamble) + self.file_size + len(self.epilogue)
+
+    def read(self, size=DEFAULT_CHUNK_SIZE):
+        if size is None or size < 0:
+            size = DEFAULT_CHUNK_SIZE
+        while self._parts:
+            part = self._parts[0]
+            if part is None:
+                chunk = self.file.read(size)
+                if chunk:
+                    self.progress.update(chunk)
+                    return chunk
+                self._parts.pop(0)
+                continue
+            self._parts.pop(0)
+            if part:
+                return part
+        return b""
+
+    def close(self):
+        self.file.close()
+
+
+def upload_file(client, uri: str, path: str, filename=None, content_type=None, **kwargs):
+    """upload_file streams the file at path to an attachments endpoint.
+
+    :param uri: The attachments uri e.g '/incidents/2095/attachments'
+    :type uri: str
+    :return: The created attachment and the transfer summary
+    :rtype: tuple
+    """
+    body = MultipartFileStream(path, filename=filename, content_type=content_type)
+    try:
+        response = raw_request(client, "post", uri, data=body,
+                               headers={"Content-Type": body.content_type, "Content-Length": str(len(body))}, **kwargs)
+    finally:
+        body.close()
+    return response.json(), body.progress.summary()
+
+
+def download_file(client, uri: str, dest: str, chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
+    """download_file streams the response of uri straight to dest. The file
+    is written under a temporary name and only renamed into place once
+    complete, so a failed download never leaves a partial file at dest.
+
+    :param uri: The contents uri e.g '/incidents/2095/attachments/12/contents'
+    :type uri: str
+    :return: The transfer summary
+    :rtype: dict
+    """
+    response = raw_request(client, "get", uri, stream=True, **kwargs)
+    total = response.headers.get("Content-Length")
+    progress = TransferProgress(int(total) if total and total.isdigit() else None)
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(dest)), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as output:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    output.write(chunk)
+                    progress.update(chunk)
+        os.replace(tmp_path, dest)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        response.close()
+    return progress.summary()
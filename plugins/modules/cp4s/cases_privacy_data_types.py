@@ -6,11 +6,9 @@
 # The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 from __future__ import (absolute_import, division, print_function)
-from resilient_lib import close_incident
 from ansible.module_utils.basic import AnsibleModule
-
-# Additional import of common code
-# from cp4s_common import create_authenticated_client
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import CLIENT_ARGS, configure_client, execute_request_with_global_keys
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import instrument_module
 
 __metaclass__ = type
 
@@ -26,6 +24,9 @@ version_added: "1.0.0"
 
 description: This module is an example of how you can choose to use a module or a role to achieve a similar outcome. An almost identical piece of functionality exists in the CP4S role but this gives a programmatic way to do it.
 
+extends_documentation_fragment:
+    - ryan_gordon1.cloud_pak_for_security.cp4s_client
+
 author:
     - Ryan Gordon (@Ryan-Gordon)
 '''
@@ -57,10 +58,6 @@ message:
     returned: always
     sample: 'goodbye'
 '''
-# TODO: Review the encapsulation of common logic in module utils
-# So far i have not gotten it to work.
-# When working according to the docs this statement should work
-# from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import create_authenticated_client
 
 
 def run_module():
@@ -69,7 +66,8 @@ def run_module():
     module_args = dict(
         host=dict(type='str', required=True),
         api_key_id=dict(type='str', required=True),
-        api_key_secret=dict(type='str', required=True)
+        api_key_secret=dict(type='str', required=True),
+        **CLIENT_ARGS
     )
 
     # seed the result dict in the object
@@ -90,6 +88,8 @@ def run_module():
         argument_spec=module_args,
         supports_check_mode=True
     )
+    instrument_module(module)
+    configure_client(module.params)
 
     # if the user is working with this module in only check mode we do not
     # want to make any changes to the environment, just return the current
@@ -100,7 +100,7 @@ def run_module():
     # TODO: Review if we can make the exception less bare, or if we can use a conditional for the changed property instead
     try:  # Try to make the API call
         response = execute_request_with_global_keys(
-            'get', url=module.params['host'], api_key_id=module.params['api_key_id'], api_key_secret=module.params['api_key_secret'])
+            'get', module.params['host'], 'data_type_categories', api_key_id=module.params['api_key_id'], api_key_secret=module.params['api_key_secret'])
         result.update({"privacy_data_types": response.json()})
     except Exception as e:  # we need to except in order to do else; use bare except and just raise the exception as normal
         # raise  # raises the exact error that would have otherwise been raised.
@@ -114,36 +114,6 @@ def run_module():
     module.exit_json(**result)
 
 
-# TODO: Move to module utils
-def execute_request_with_global_keys(operation, url, **kwargs):
-    """execute_request_with_global_keys helper function 
-    which takes a global CP4S API Key and Secret rather than one 
-    derived from cases.
-    These API keys use different authentication methods and
-    API calls using this client will be slightly different to cases
-
-    That being said, this client provides full access to the CP4S
-    instance.
-    TODO: Should we rename this
-    """
-    import requests
-    from requests.auth import HTTPBasicAuth
-
-    url = "https://{}/rest/privacy/{}".format(url, "data_type_categories")
-    # TODO: This design could be improved
-    if operation == 'get':
-        return requests.get(url,
-                            auth=HTTPBasicAuth(kwargs.get(
-                                'api_key_id'), kwargs.get('api_key_secret')),
-                            verify=kwargs.get('verify', False))
-    elif operation == 'post':
-        return requests.post(url,
-                             auth=HTTPBasicAuth(kwargs.get(
-                                 'api_key_id'), kwargs.get('api_key_secret')),
-                             body=kwargs.get('body'),
-                             verify=kwargs.get('verify', False))
-
-
 def main():
     run_module()
 
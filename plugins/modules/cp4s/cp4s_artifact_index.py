@@ -0,0 +1,266 @@
+
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_artifact_index import open_artifact_index
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import CLIENT_ARGS, DeadlineExceeded, configure_client, create_authenticated_client, deadline_passed, query_incidents_paged, run_concurrently
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import instrument_module
+
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: cp4s_artifact_index
+
+short_description: A Module used to keep a local index of the artifact values of every Case in CP4S or Resilient
+
+# If this is part of a collection, you need to use semantic versioning,
+# i.e. the version is of the form "2.5.0" and not "2.4".
+version_added: "1.1.0"
+
+description:
+    - Syncs a local inverted index of artifact type and value to the Cases holding them, for cp4s_artifact_lookup to correlate values against without an API call per value.
+    - The index is a file under CP4S_CACHE_DIR, one per instance and org. The first run indexes every Case, later runs only the Cases modified since the last sync.
+    - A sync stopped by the deadline or by failed Cases keeps what it indexed, the next run carries on from the first Case it did not finish.
+    - Deleted Cases are not seen by an incremental sync, run with rebuild from time to time to drop them.
+
+options:
+    include_closed:
+        description: Index closed Cases too. When false a Case is dropped from the index once it is closed
+        required: false
+        type: bool
+        default: true
+    case_sensitive:
+        description:
+            - Index values as they are rather than lower cased. Most indicators, such as hashes, domains and email addresses, are not case sensitive
+            - Changing it rebuilds the index
+        required: false
+        type: bool
+        default: false
+    rebuild:
+        description: Throw the index away and index every Case again
+        required: false
+        type: bool
+        default: false
+    concurrency:
+        description: The maximum number of Cases whose artifacts are fetched at once
+        required: false
+        type: int
+        default: 8
+    page_size:
+        description: The number of Cases asked for per call when listing the modified Cases
+        required: false
+        type: int
+        default: 500
+
+extends_documentation_fragment:
+    - ryan_gordon1.cloud_pak_for_security.cp4s_client
+
+author:
+    - Ryan Gordon (@Ryan-Gordon)
+'''
+
+EXAMPLES = r'''
+# Bring the index up to date, run on a schedule or before every lookup
+- name: Sync the artifact index
+  ryan_gordon1.cloud_pak_for_security.cp4s_artifact_index:
+
+# Index only open Cases, from scratch
+- name: Rebuild the artifact index
+  ryan_gordon1.cloud_pak_for_security.cp4s_artifact_index:
+    include_closed: false
+    rebuild: true
+'''
+
+RETURN = r'''
+summary:
+    description:
+        - The number of modified Cases listed, indexed, unchanged since they were indexed, removed for being closed, failed and not reached by the deadline.
+        - In check mode indexed and removed are the Cases which would be, nothing is fetched.
+    type: dict
+    returned: always
+    sample: {'listed': 12, 'indexed': 11, 'unchanged': 1, 'removed': 0, 'failed': 0, 'timeout': 0}
+index:
+    description: The number of Cases, distinct values and artifacts in the index and the last modified date it is synced to.
+    type: dict
+    returned: always
+    sample: {'cases': 5210, 'values': 48211, 'artifacts': 61034, 'synced_to': 1633000000000}
+failed:
+    description: The Cases whose artifacts could not be fetched, with the error. They are fetched again by the next sync.
+    type: list
+    returned: always
+    sample: [{'case_id': 2095, 'status': 'failed', 'error': '404 Not Found'}]
+deadline_exceeded:
+    description: Whether the deadline passed before every modified Case was indexed.
+    type: bool
+    returned: always
+'''
+
+
+def run_module():
+    module_args = dict(
+        include_closed=dict(type='bool', required=False, default=True),
+        case_sensitive=dict(type='bool', required=False, default=False),
+        rebuild=dict(type='bool', required=False, default=False),
+        concurrency=dict(type='int', required=False, default=8),
+        page_size=dict(type='int', required=False, default=500),
+        **CLIENT_ARGS
+    )
+
+    result = dict(
+        changed=False,
+        summary={},
+        index={},
+        failed=[],
+        deadline_exceeded=False
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+    instrument_module(module)
+    configure_client(module.params)
+
+    params = module.params
+    try:  # Try to make the API calls
+        index = open_artifact_index()
+        if params['rebuild'] or index.case_sensitive != params['case_sensitive']:
+            index.clear(case_sensitive=params['case_sensitive'])
+        client = create_authenticated_client()
+        summary, failed = sync_artifact_index(client, index, include_closed=params['include_closed'],
+                                              concurrency=params['concurrency'], page_size=params['page_size'],
+                                              check_mode=module.check_mode)
+        result["changed"] = bool(summary["indexed"] or summary["removed"] or params['rebuild'] or not index.exists)
+        if result["changed"] and not module.check_mode:
+            index.save()
+    except Exception as e:
+        module.fail_json(msg=u'An exception occurred when syncing the artifact index: {}'.format(e), **result)
+
+    result.update({
+        "summary": summary,
+        "index": index.stats(),
+        "failed": failed,
+        "deadline_exceeded": summary["timeout"] > 0 or deadline_passed()
+    })
+    if summary["failed"]:
+        module.fail_json(msg=u'Failed to fetch the artifacts of {} of {} Cases, they are fetched again by the next sync'.format(
+            summary["failed"], summary["listed"]), **result)
+    if result["deadline_exceeded"]:
+        module.warn(u'The deadline passed before every modified Case was indexed, rerun to index the rest')
+    module.exit_json(**result)
+
+
+def list_modified_incidents(client, since=None, page_size=500):
+    """list_modified_incidents lists the Cases modified at or after since,
+    oldest first. It pages by key rather than by offset: every page asks
+    for the Cases after the last one listed, by modified date then ID.
+    A Case modified while the listing runs moves to the end instead of
+    shifting the pages, so no Case is ever skipped. Such a Case is listed
+    again at its new date and only that listing is kept.
+    Stops without an error once the deadline passes.
+
+    :return: The partial IncidentDTOs, oldest first
+    :rtype: list
+    """
+    listed = {}
+    last = None
+    while not deadline_passed():
+        if last is None:
+            # The filter groups are OR'ed, an empty group matches every Case
+            filters = [{"conditions": [] if since is None else [
+                {"field_name": "inc_last_modified_date", "method": "gte", "value": since}]}]
+        else:
+            modified, case_id = last
+            filters = [
+                {"conditions": [{"field_name": "inc_last_modified_date", "method": "gt", "value": modified}]},
+                {"conditions": [{"field_name": "inc_last_modified_date", "method": "equals", "value": modified},
+                                {"field_name": "id", "method": "gt", "value": case_id}]}
+            ]
+        query = {
+            "filters": filters,
+            "sorts": [{"field_name": "inc_last_modified_date", "type": "asc"}, {"field_name": "id", "type": "asc"}]
+        }
+        try:
+            incidents = query_incidents_paged(client, query, start=0, length=page_size, return_level="partial").get("data", [])
+        except DeadlineExceeded:
+            break
+        for incident in incidents:
+            # Keep the latest listing of a Case, in the order of its latest date
+            listed.pop(incident["id"], None)
+            listed[incident["id"]] = incident
+        if len(incidents) < page_size:
+            break
+        last = (incidents[-1].get("inc_last_modified_date"), incidents[-1]["id"])
+    return list(listed.values())
+
+
+def sync_artifact_index(client, index, include_closed=True, concurrency=8, page_size=500, check_mode=False):
+    """sync_artifact_index indexes the artifacts of every Case modified
+    since the index was last synced, oldest first, and moves synced_to on
+    to the first Case it did not finish. The listing is inclusive of
+    synced_to so Cases modified in the same millisecond are never missed,
+    those already indexed at that date are not fetched again.
+    In check mode the listing is compared to the index and the Cases which
+    would be indexed or removed are counted, without fetching or changing anything.
+
+    :return: The counts of the sync, see RETURN, and the Cases which failed
+    :rtype: tuple
+    """
+    listed = list_modified_incidents(client, since=index.synced_to, page_size=page_size)
+
+    summary = {"listed": len(listed), "indexed": 0, "unchanged": 0, "removed": 0, "failed": 0, "timeout": 0}
+    to_fetch = []
+    for incident in listed:
+        indexed = index.cases.get(str(incident["id"]))
+        if not include_closed and incident.get("plan_status") == "C":
+            if indexed is not None:
+                if not check_mode:
+                    index.remove_case(incident["id"])
+                summary["removed"] += 1
+        elif indexed is not None and indexed.get("modified") == incident.get("inc_last_modified_date"):
+            summary["unchanged"] += 1
+        else:
+            to_fetch.append(incident)
+
+    if check_mode:
+        summary["indexed"] = len(to_fetch)
+        return summary, []
+
+    failed = []
+    unfinished = []
+    runs = run_concurrently(lambda incident: client.get("/incidents/{}/artifacts".format(incident["id"])), to_fetch, concurrency)
+    for run in runs:
+        incident = run["item"]
+        if run["error"] is None:
+            index.set_case(incident["id"], run["result"], modified=incident.get("inc_last_modified_date"),
+                           plan_status=incident.get("plan_status"))
+            summary["indexed"] += 1
+            continue
+        unfinished.append(incident.get("inc_last_modified_date"))
+        if isinstance(run["error"], DeadlineExceeded):
+            summary["timeout"] += 1
+        else:
+            summary["failed"] += 1
+            failed.append({"case_id": incident["id"], "status": "failed", "error": str(run["error"])})
+
+    # Listed oldest first, so every Case modified before the first unfinished one is indexed.
+    # A listing cut short by the deadline ends at the last Case listed, the next sync starts from there
+    if unfinished:
+        index.synced_to = min(unfinished)
+    elif listed:
+        index.synced_to = max(incident.get("inc_last_modified_date") or 0 for incident in listed)
+    return summary, failed
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
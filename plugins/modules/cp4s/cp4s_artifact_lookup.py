@@ -0,0 +1,156 @@
+
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_artifact_index import open_artifact_index
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import CLIENT_ARGS, configure_client
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import instrument_module
+
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: cp4s_artifact_lookup
+
+short_description: A Module used to find the Cases in CP4S or Resilient holding any of a batch of artifact values
+
+# If this is part of a collection, you need to use semantic versioning,
+# i.e. the version is of the form "2.5.0" and not "2.4".
+version_added: "1.1.0"
+
+description:
+    - Correlates a batch of values, such as a fresh feed of indicators, against the artifacts of every Case in the local index kept by cp4s_artifact_index.
+    - The lookup is one local pass over the values and makes no API calls, so ten thousand values cost about as much as ten.
+    - Results are as fresh as the last sync of the index, run cp4s_artifact_index first to bring it up to date.
+
+options:
+    values:
+        description: The artifact values to look for. Either values or values_file is required
+        required: false
+        type: list
+        elements: str
+    values_file:
+        description: A file on the controller with one value to look for per line, for batches too big to pass as a variable
+        required: false
+        type: path
+    types:
+        description: Only match artifacts of these type IDs, for example 1 for IP addresses. Every type when empty
+        required: false
+        type: list
+        elements: int
+        default: []
+
+extends_documentation_fragment:
+    - ryan_gordon1.cloud_pak_for_security.cp4s_client
+
+author:
+    - Ryan Gordon (@Ryan-Gordon)
+'''
+
+EXAMPLES = r'''
+# Find the Cases which saw any of a feed of indicators
+- name: Sync the artifact index
+  ryan_gordon1.cloud_pak_for_security.cp4s_artifact_index:
+
+- name: Correlate the feed
+  ryan_gordon1.cloud_pak_for_security.cp4s_artifact_lookup:
+    values_file: /tmp/iocs.txt
+  register: hits
+
+- name: Note the Cases
+  ryan_gordon1.cloud_pak_for_security.cp4s_create_note:
+    case_id: "{{ item }}"
+    text: "This Case holds an indicator from today's feed"
+  loop: "{{ hits.case_ids }}"
+'''
+
+RETURN = r'''
+case_ids:
+    description: The sorted IDs of every Case holding any of the values.
+    type: list
+    returned: always
+    sample: [2095, 2311]
+matches:
+    description: Every value found, once per artifact type it was found as, with the sorted IDs of the Cases holding it.
+    type: list
+    returned: always
+    sample: [{'value': '10.0.0.8', 'type': 1, 'case_ids': [2095, 2311]}]
+summary:
+    description: The number of distinct values looked for, of those found and of the Cases holding them.
+    type: dict
+    returned: always
+    sample: {'values': 10000, 'matched': 2, 'cases': 2}
+index:
+    description: The number of Cases, distinct values and artifacts in the index and the last modified date it is synced to.
+    type: dict
+    returned: always
+    sample: {'cases': 5210, 'values': 48211, 'artifacts': 61034, 'synced_to': 1633000000000}
+'''
+
+
+def run_module():
+    module_args = dict(
+        values=dict(type='list', elements='str', required=False, default=None),
+        values_file=dict(type='path', required=False, default=None),
+        types=dict(type='list', elements='int', required=False, default=[]),
+        **CLIENT_ARGS
+    )
+
+    result = dict(
+        changed=False,
+        case_ids=[],
+        matches=[],
+        summary={},
+        index={}
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        mutually_exclusive=[('values', 'values_file')],
+        required_one_of=[('values', 'values_file')],
+        supports_check_mode=True
+    )
+    instrument_module(module)
+    configure_client(module.params)
+
+    try:
+        index = open_artifact_index()
+        values = module.params['values'] or read_values_file(module.params['values_file'])
+    except Exception as e:
+        module.fail_json(msg=u'An exception occurred when opening the artifact index: {}'.format(e), **result)
+
+    if not index.exists:
+        module.fail_json(msg=u'There is no artifact index for this instance yet, run cp4s_artifact_index first', **result)
+
+    matches = index.lookup(values, types=module.params['types'])
+    case_ids = sorted({case_id for match in matches for case_id in match["case_ids"]})
+    result.update({
+        "case_ids": case_ids,
+        "matches": matches,
+        "summary": {
+            "values": len({index.normalize(value) for value in values}),
+            "matched": len({index.normalize(match["value"]) for match in matches}),
+            "cases": len(case_ids)
+        },
+        "index": index.stats()
+    })
+    module.exit_json(**result)
+
+
+def read_values_file(path: str):
+    """read_values_file reads one value per line, skipping blank lines."""
+    with open(path, "r") as values_file:
+        return [line.strip() for line in values_file if line.strip()]
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
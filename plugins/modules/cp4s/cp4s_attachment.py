@@ -0,0 +1,195 @@
+
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import CLIENT_ARGS, configure_client, create_authenticated_client
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import instrument_module
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_cache import invalidate_query_cache
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_transfer import DEFAULT_CHUNK_SIZE, download_file, upload_file
+import os
+
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: cp4s_attachment
+
+short_description: A Module used to upload or download an attachment on a Case or Task in CP4S or Resilient
+
+# If this is part of a collection, you need to use semantic versioning,
+# i.e. the version is of the form "2.5.0" and not "2.4".
+version_added: "1.1.0"
+
+description:
+    - Uploads a file as an attachment to a Case or Task, or downloads an attachment to a file.
+    - Files are streamed in chunks in both directions so large files such as PCAPs or memory dumps are never loaded into memory.
+    - File contents are never returned in the result, only the size, sha256, throughput and progress of the transfer.
+
+options:
+    operation:
+        description: upload a file or download an attachment
+        required: true
+        type: str
+        choices: [upload, download]
+    case_id:
+        description: The ID of the Case the attachment belongs to
+        required: true
+        type: int
+    task_id:
+        description: The ID of a Task on the Case, to attach to the Task rather than the Case
+        required: false
+        type: int
+    src:
+        description: The file to upload. Required for upload.
+        required: false
+        type: path
+    filename:
+        description: The name to give the uploaded attachment, defaults to the name of src
+        required: false
+        type: str
+    content_type:
+        description: The content type of the uploaded attachment, guessed from its name if not set
+        required: false
+        type: str
+    attachment_id:
+        description: The ID of the attachment to download. Required for download.
+        required: false
+        type: int
+    dest:
+        description: The file to download the attachment to. Required for download.
+        required: false
+        type: path
+    force:
+        description: Download even if dest already exists
+        required: false
+        type: bool
+        default: true
+    chunk_size:
+        description: The number of bytes written to dest at a time when downloading
+        required: false
+        type: int
+        default: 1048576
+
+extends_documentation_fragment:
+    - ryan_gordon1.cloud_pak_for_security.cp4s_client
+
+author:
+    - Ryan Gordon (@Ryan-Gordon)
+'''
+
+EXAMPLES = r'''
+# Attach a packet capture to a Case
+- name: Upload a PCAP
+  ryan_gordon1.cloud_pak_for_security.cp4s_attachment:
+    operation: upload
+    case_id: 2095
+    src: /data/captures/incident.pcap
+
+# Download an attachment from a Task
+- name: Download a memory dump
+  ryan_gordon1.cloud_pak_for_security.cp4s_attachment:
+    operation: download
+    case_id: 2095
+    task_id: 301
+    attachment_id: 12
+    dest: /data/dumps/host01.mem
+'''
+
+RETURN = r'''
+attachment:
+    description: The created attachment.
+    type: dict
+    returned: on upload
+transfer:
+    description: The number of bytes moved, their sha256, the elapsed seconds, the throughput and the elapsed seconds at every 10 percent.
+    type: dict
+    returned: always
+    sample: {'bytes': 524288000, 'sha256': '9f86d08...', 'elapsed': 41.2, 'bytes_per_second': 12725436, 'progress': [{'percent': 10, 'elapsed': 4.1}]}
+dest:
+    description: The path the attachment was downloaded to.
+    type: str
+    returned: on download
+'''
+
+
+def run_module():
+    module_args = dict(
+        operation=dict(type='str', required=True, choices=['upload', 'download']),
+        case_id=dict(type='int', required=True),
+        task_id=dict(type='int', required=False, default=None),
+        src=dict(type='path', required=False, default=None),
+        filename=dict(type='str', required=False, default=None),
+        content_type=dict(type='str', required=False, default=None),
+        attachment_id=dict(type='int', required=False, default=None),
+        dest=dict(type='path', required=False, default=None),
+        force=dict(type='bool', required=False, default=True),
+        chunk_size=dict(type='int', required=False, default=DEFAULT_CHUNK_SIZE),
+        **CLIENT_ARGS
+    )
+
+    result = dict(
+        changed=False,
+        transfer={}
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        required_if=[
+            ('operation', 'upload', ('src',)),
+            ('operation', 'download', ('attachment_id', 'dest'))
+        ],
+        supports_check_mode=True
+    )
+    instrument_module(module)
+    configure_client(module.params)
+
+    if module.check_mode:
+        module.exit_json(**result)
+
+    params = module.params
+    attachments_uri = attachments_base_uri(params['case_id'], params['task_id'])
+
+    if params['operation'] == 'download' and not params['force'] and os.path.exists(params['dest']):
+        module.exit_json(dest=params['dest'], **result)
+
+    try:  # Try to make the API call
+        client = create_authenticated_client()
+        if params['operation'] == 'upload':
+            attachment, transfer = upload_file(client, attachments_uri, params['src'],
+                                               filename=params['filename'], content_type=params['content_type'])
+            result.update({"attachment": attachment, "transfer": transfer})
+        else:
+            transfer = download_file(client, "{}/{}/contents".format(attachments_uri, params['attachment_id']),
+                                     params['dest'], chunk_size=params['chunk_size'])
+            result.update({"dest": params['dest'], "transfer": transfer})
+    except Exception as e:
+        module.fail_json(msg=u'An exception occurred when trying to {} the attachment: {}'.format(params['operation'], e), **result)
+    else:
+        result['changed'] = True
+        if params['operation'] == 'upload':
+            # Cached queries hold the old inc_last_modified_date of the Case
+            invalidate_query_cache(module)
+
+    module.exit_json(**result)
+
+
+def attachments_base_uri(case_id: int, task_id=None):
+    """attachments_base_uri returns the attachments uri of a Task if
+    task_id is given, otherwise of the Case.
+    """
+    if task_id:
+        return "/tasks/{}/attachments".format(task_id)
+    return "/incidents/{}/attachments".format(case_id)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
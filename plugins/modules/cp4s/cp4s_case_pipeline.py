@@ -0,0 +1,299 @@
+
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import CLIENT_ARGS, DeadlineExceeded, build_incident_patch, configure_client, create_authenticated_client, diff_incident_fields, run_concurrently
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import instrument_module
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_cache import invalidate_query_cache
+
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: cp4s_case_pipeline
+
+short_description: A Module used to create a Case and run several steps on it in one task in CP4S or Resilient
+
+# If this is part of a collection, you need to use semantic versioning,
+# i.e. the version is of the form "2.5.0" and not "2.4".
+version_added: "1.1.0"
+
+description:
+    - Runs an ordered list of steps against one Case with a single login, instead of one task and one login per step.
+    - Steps run in the order given. Notes and artifacts have no order among themselves, a run of them runs concurrently once the step before it is done.
+      Every other step waits for every step listed before it, and the steps after it wait for it.
+    - The pipeline stops at the first wave with a failed step. Steps which did not run are reported as skipped.
+
+options:
+    case_id:
+        description: Run the steps against this existing Case. Required unless the first step is create_case.
+        required: false
+        type: int
+    steps:
+        description:
+            - The steps to run, each with a C(type) and the C(params) for that type
+            - C(type) is one of create_case, note, artifact, task, action, update or close
+            - create_case takes name and payload, note takes text, artifact takes type, value and description, task takes name and any task fields, action takes action_id and properties, update takes fields, close takes payload
+            - C(name) gives the step a name other steps can list in C(depends_on), to wait for a step they would otherwise run alongside. Names must be unique
+            - create_case must be the first step
+        required: true
+        type: list
+        elements: dict
+    concurrency:
+        description: The maximum number of steps run at once
+        required: false
+        type: int
+        default: 4
+
+extends_documentation_fragment:
+    - ryan_gordon1.cloud_pak_for_security.cp4s_client
+
+author:
+    - Ryan Gordon (@Ryan-Gordon)
+'''
+
+EXAMPLES = r'''
+# Create a Case, then add a note and artifacts in parallel, then add a task and run an action once the artifacts exist
+- name: Create and enrich a Case
+  ryan_gordon1.cloud_pak_for_security.cp4s_case_pipeline:
+    steps:
+      - type: create_case
+        params:
+          name: Case created from an Ansible Module
+          payload: {'description': {'format': 'html', 'content': 'hello'}}
+      - type: note
+        params:
+          text: Hello SOC Team
+      - type: artifact
+        params:
+          type: DNS Name
+          value: google.com
+      - type: artifact
+        params:
+          type: IP Address
+          value: 8.8.8.8
+      - type: task
+        params:
+          name: Review the DNS artifact
+      - type: action
+        params:
+          action_id: 42
+  register: pipeline
+'''
+
+RETURN = r'''
+case:
+    description: The Case the steps ran against. The created Case when the pipeline starts with create_case.
+    type: dict
+    returned: always
+steps:
+    description: Every step with its status (ok, failed, timeout or skipped), the seconds it took and its API response. Steps cut short by the deadline are timeout.
+    type: list
+    returned: always
+    sample: [{'name': 'step_0', 'type': 'create_case', 'status': 'ok', 'elapsed': 0.3, 'result': {}}]
+failed_step:
+    description: The name of the first step which failed.
+    type: str
+    returned: when a step failed
+deadline_exceeded:
+    description: Whether the deadline passed before every step ran. The steps which finished are still returned.
+    type: bool
+    returned: always
+'''
+
+STEP_TYPES = ("create_case", "note", "artifact", "task", "action", "update", "close")
+
+
+def run_module():
+    module_args = dict(
+        case_id=dict(type='int', required=False, default=None),
+        steps=dict(type='list', elements='dict', required=True),
+        concurrency=dict(type='int', required=False, default=4),
+        **CLIENT_ARGS
+    )
+
+    result = dict(
+        changed=False,
+        case={},
+        steps=[],
+        deadline_exceeded=False
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+    instrument_module(module)
+    configure_client(module.params)
+
+    try:
+        steps = plan_steps(module.params['steps'], module.params['case_id'])
+    except ValueError as e:
+        module.fail_json(msg=u'Invalid pipeline: {}'.format(e), **result)
+
+    if module.check_mode:
+        result["steps"] = [{"name": step["name"], "type": step["type"], "depends_on": sorted(step["depends_on"]),
+                            "status": "skipped"} for step in steps]
+        module.exit_json(**result)
+
+    try:  # Try to make the API calls
+        client = create_authenticated_client()
+        context = {"case": {"id": module.params['case_id']} if module.params['case_id'] else {}}
+        outcomes = run_pipeline(client, steps, context, concurrency=module.params['concurrency'])
+    except Exception as e:
+        module.fail_json(msg=u'An exception occurred when running the case pipeline: {}'.format(e), **result)
+
+    failed = [outcome for outcome in outcomes if outcome["status"] == "failed"]
+    result.update({
+        "case": context["case"],
+        "steps": outcomes,
+        "changed": any(outcome["status"] == "ok" for outcome in outcomes),
+        "deadline_exceeded": any(outcome["status"] == "timeout" for outcome in outcomes)
+    })
+    if result["changed"]:
+        invalidate_query_cache(module)
+
+    if failed:
+        result["failed_step"] = failed[0]["name"]
+        module.fail_json(msg=u'Step {} of the case pipeline failed: {}'.format(failed[0]["name"], failed[0]["error"]), **result)
+    if result["deadline_exceeded"]:
+        module.warn(u'The deadline passed before every step of the case pipeline ran')
+    module.exit_json(**result)
+
+
+def plan_steps(steps: list, case_id=None):
+    """plan_steps names every step and works out what it depends on from
+    the order of the list. A step other than a note or artifact depends on
+    every step before it, a note or artifact only on the last such step
+    before it, so a run of notes and artifacts shares one wave.
+
+    :raises ValueError: If a step type or dependency is unknown, a name is used twice, or there is no Case to run against
+    :return: The steps with a name and a set of dependencies
+    :rtype: list
+    """
+    planned = []
+    for position, step in enumerate(steps):
+        if step.get("type") not in STEP_TYPES:
+            raise ValueError(u"step {} has type '{}', expected one of {}".format(position, step.get("type"), ", ".join(STEP_TYPES)))
+        planned.append({
+            "name": step.get("name") or "step_{}".format(position),
+            "type": step["type"],
+            "params": step.get("params") or {},
+            "depends_on": set(step.get("depends_on") or [])
+        })
+
+    names = [step["name"] for step in planned]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(u"step names {} are used more than once".format(", ".join(duplicates)))
+    creates = [step["name"] for step in planned if step["type"] == "create_case"]
+    if len(creates) > 1:
+        raise ValueError(u"only one create_case step is allowed")
+    if creates and planned[0]["type"] != "create_case":
+        raise ValueError(u"create_case must be the first step")
+    if not creates and not case_id:
+        raise ValueError(u"case_id is required when there is no create_case step")
+
+    barrier = None
+    for position, step in enumerate(planned):
+        unknown = step["depends_on"] - set(names)
+        if unknown:
+            raise ValueError(u"step {} depends on unknown steps {}".format(step["name"], ", ".join(sorted(unknown))))
+        if step["type"] in ("note", "artifact"):
+            if barrier is not None:
+                step["depends_on"].add(barrier)
+        else:
+            step["depends_on"].update(names[:position])
+            barrier = step["name"]
+    return planned
+
+
+def run_pipeline(client, steps: list, context: dict, concurrency=4):
+    """run_pipeline runs the steps in waves. Each wave is every step whose
+    dependencies have finished, run concurrently over the one client.
+    A failure lets the rest of its wave finish, then skips every later step.
+    Steps cut short by the deadline are timeout and also end the pipeline.
+
+    :return: The outcome of every step in the order they were given
+    :rtype: list
+    """
+    outcomes = {step["name"]: {"name": step["name"], "type": step["type"], "status": "skipped"} for step in steps}
+    done = set()
+    remaining = list(steps)
+
+    while remaining:
+        wave = [step for step in remaining if step["depends_on"] <= done]
+        if not wave:
+            raise ValueError(u"steps {} have circular dependencies".format(", ".join(step["name"] for step in remaining)))
+
+        for run in run_concurrently(lambda step: run_step(client, step, context), wave, concurrency):
+            step = run["item"]
+            outcome = outcomes[step["name"]]
+            outcome["elapsed"] = run["elapsed"]
+            if isinstance(run["error"], DeadlineExceeded):
+                outcome.update({"status": "timeout", "error": str(run["error"])})
+            elif run["error"] is not None:
+                outcome.update({"status": "failed", "error": str(run["error"])})
+            else:
+                outcome.update({"status": "ok", "result": run["result"]})
+                done.add(step["name"])
+
+        if any(outcomes[step["name"]]["status"] in ("failed", "timeout") for step in wave):
+            break
+        remaining = [step for step in remaining if step["name"] not in done]
+
+    return [outcomes[step["name"]] for step in steps]
+
+
+def run_step(client, step: dict, context: dict):
+    """run_step makes the API call for one step. create_case stores the
+    new Case in context so every later step knows its ID.
+    """
+    params = step["params"]
+    if step["type"] == "create_case":
+        context["case"] = client.post("/incidents", {
+            "name": params["name"],
+            "discovered_date": 0,
+            **(params.get("payload") or {})
+        })
+        return context["case"]
+
+    case_uri = "/incidents/{}".format(context["case"]["id"])
+    if step["type"] == "note":
+        return client.post(case_uri + "/comments", {"text": params["text"], **(params.get("other") or {})})
+    if step["type"] == "artifact":
+        return client.post(case_uri + "/artifacts", {
+            "type": {"name": params["type"]},
+            "value": params["value"],
+            "description": params.get("description", ""),
+            **(params.get("other") or {})
+        })
+    if step["type"] == "task":
+        return client.post(case_uri + "/tasks", params)
+    if step["type"] == "action":
+        return client.post(case_uri + "/action_invocations", {
+            "action_id": params["action_id"],
+            "properties": params.get("properties") or {}
+        })
+    if step["type"] == "update":
+        incident = client.get(case_uri)
+        changes = diff_incident_fields(incident, params["fields"])
+        if not changes:
+            return {"changes": {}}
+        return client.patch(case_uri, build_incident_patch(incident, changes))
+    if step["type"] == "close":
+        from resilient_lib import close_incident
+        return close_incident(client, context["case"]["id"], params.get("payload") or {}).json()
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
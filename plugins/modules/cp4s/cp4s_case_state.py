@@ -0,0 +1,161 @@
+
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import CLIENT_ARGS, build_incident_patch, configure_client, create_authenticated_client, diff_incident_fields
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import instrument_module
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_cache import invalidate_query_cache
+
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: cp4s_case_state
+
+short_description: A Module used to make sure fields on a Case in CP4S or Resilient have the desired values
+
+# If this is part of a collection, you need to use semantic versioning,
+# i.e. the version is of the form "2.5.0" and not "2.4".
+version_added: "1.1.0"
+
+description:
+    - Reads the Case once and compares it to the desired field values locally.
+    - A single PATCH containing only the fields which differ is sent, and only if at least one field differs.
+    - The PATCH carries the version of the Case that was read, so a Case changed by someone else in the meantime is reported as a conflict rather than overwritten.
+    - Supports check mode and diff mode.
+
+options:
+    case_id:
+        description: This is the ID number of the Case to converge.
+        required: true
+        type: int
+    fields:
+        description:
+            - The desired value of each field, keyed by the field API name
+            - Custom fields are given by their plain name, without a properties. prefix
+            - Select fields take the ID of the value
+        required: true
+        type: dict
+    overwrite_conflict:
+        description: Apply the change even if the Case was modified between the read and the PATCH
+        required: false
+        type: bool
+        default: false
+
+extends_documentation_fragment:
+    - ryan_gordon1.cloud_pak_for_security.cp4s_client
+
+author:
+    - Ryan Gordon (@Ryan-Gordon)
+'''
+
+EXAMPLES = r'''
+# Make sure a Case has the right severity and owner
+- name: Converge a Case
+  ryan_gordon1.cloud_pak_for_security.cp4s_case_state:
+    case_id: 2095
+    fields:
+      severity_code: 6
+      owner_id: 12
+
+# Preview the changes which would be made
+- name: Converge a Case in check mode
+  ryan_gordon1.cloud_pak_for_security.cp4s_case_state:
+    case_id: 2095
+    fields:
+      phase_id: 1005
+      my_custom_field: escalated
+  check_mode: true
+  diff: true
+'''
+
+RETURN = r'''
+changes:
+    description: The fields which differed, with their current and desired values.
+    type: dict
+    returned: always
+    sample: {'severity_code': {'before': 4, 'after': 6}}
+case_patch_result:
+    description: The response of the PATCH call.
+    type: dict
+    returned: when the Case was changed outside of check mode
+'''
+
+
+def run_module():
+    module_args = dict(
+        case_id=dict(type='int', required=True),
+        fields=dict(type='dict', required=True),
+        overwrite_conflict=dict(type='bool', required=False, default=False),
+        **CLIENT_ARGS
+    )
+
+    result = dict(
+        changed=False,
+        changes={}
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+    instrument_module(module)
+    configure_client(module.params)
+
+    # Unlike the other modules check mode still reads the Case so a real diff can be reported
+    try:
+        client = create_authenticated_client()
+        incident = client.get("/incidents/{}".format(module.params['case_id']))
+        changes = diff_incident_fields(incident, module.params['fields'])
+    except Exception as e:
+        module.fail_json(msg=u'An exception occurred when reading Case {}: {}'.format(module.params['case_id'], e), **result)
+
+    result.update({
+        "changed": bool(changes),
+        "changes": {field_name: {"before": before, "after": after} for field_name, (before, after) in changes.items()},
+        "diff": {
+            "before": {field_name: before for field_name, (before, _) in changes.items()},
+            "after": {field_name: after for field_name, (_, after) in changes.items()}
+        }
+    })
+
+    if not changes or module.check_mode:
+        module.exit_json(**result)
+
+    try:  # Try to make the API call
+        response = patch_incident(client, incident, changes, overwrite_conflict=module.params['overwrite_conflict'])
+        invalidate_query_cache(module)
+        result.update({"case_patch_result": response})
+    except Exception as e:
+        module.fail_json(msg=u'An exception occurred when updating Case {}: {}'.format(module.params['case_id'], e), **result)
+
+    module.exit_json(**result)
+
+
+def patch_incident(client, incident: dict, changes: dict, overwrite_conflict=False):
+    """patch_incident sends one PATCH with every changed field.
+
+    :param incident: The IncidentDTO the changes were computed from
+    :type incident: dict
+    :param changes: The output of diff_incident_fields
+    :type changes: dict
+    :param overwrite_conflict: Apply the changes even if the incident changed since it was read
+    :type overwrite_conflict: bool
+    :return: The PATCH response; a conflict raises unless overwrite_conflict is set
+    :rtype: dict
+    """
+    patch = build_incident_patch(incident, changes)
+    return client.patch("/incidents/{}".format(incident["id"]), patch, overwrite_conflict=overwrite_conflict)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
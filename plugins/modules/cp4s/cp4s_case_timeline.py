@@ -0,0 +1,251 @@
+
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import CLIENT_ARGS, DeadlineExceeded, configure_client, create_authenticated_client, get_cache_dir, get_connection_opts, run_concurrently
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import instrument_module
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_cache import cache_key
+import json
+import os
+import tempfile
+
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: cp4s_case_timeline
+
+short_description: A Module used to get the newsfeed or history of one or many Cases in CP4S or Resilient
+
+# If this is part of a collection, you need to use semantic versioning,
+# i.e. the version is of the form "2.5.0" and not "2.4".
+version_added: "1.1.0"
+
+description:
+    - Gets the newsfeed or history entries of every Case in case_ids, several Cases at once.
+    - The last entry seen of every Case is kept in a state file under CP4S_CACHE_DIR, one per instance, org and source.
+      With incremental, a later run returns only the entries added since, so an audit job run on a schedule sees every entry once.
+    - The state of a Case only moves on once its timeline was fetched, a Case which failed or was not reached by the deadline is fetched again by the next run.
+
+options:
+    case_ids:
+        description: The IDs of the Cases to get the timeline of
+        required: true
+        type: list
+        elements: int
+    source:
+        description:
+            - newsfeed is the activity feed shown on the Case, history the audit trail of changes to its fields
+        required: false
+        type: str
+        choices: [newsfeed, history]
+        default: newsfeed
+    incremental:
+        description:
+            - Return only the entries after the last one seen by a previous run and remember the last entry for the next run
+            - When false every entry is returned and the state file is left as it is
+        required: false
+        type: bool
+        default: true
+    reset:
+        description: Forget the last entry seen of these Cases first, so every entry is returned and remembered again
+        required: false
+        type: bool
+        default: false
+    concurrency:
+        description: The maximum number of timelines fetched at once
+        required: false
+        type: int
+        default: 8
+
+extends_documentation_fragment:
+    - ryan_gordon1.cloud_pak_for_security.cp4s_client
+
+author:
+    - Ryan Gordon (@Ryan-Gordon)
+'''
+
+EXAMPLES = r'''
+# Get the new newsfeed entries of some Cases since the last run
+- name: Get Case timelines
+  ryan_gordon1.cloud_pak_for_security.cp4s_case_timeline:
+    case_ids: [2095, 2096, 2097]
+  register: timelines
+
+# Get the whole history of a Case without touching the state
+- name: Get the full history of a Case
+  ryan_gordon1.cloud_pak_for_security.cp4s_case_timeline:
+    case_ids: [2095]
+    source: history
+    incremental: false
+'''
+
+RETURN = r'''
+timelines:
+    description:
+        - Every Case with its status (fetched, failed or timeout), the new entries, oldest first, and the number of entries the API returned.
+        - Cases not reached by the deadline are timeout.
+    type: list
+    returned: always
+    sample: [{'case_id': 2095, 'status': 'fetched', 'elapsed': 0.31, 'fetched': 42, 'new': 2, 'entries': []}]
+summary:
+    description: The number of Cases fetched, failed and timed out and the number of new entries over every Case.
+    type: dict
+    returned: always
+    sample: {'fetched': 3, 'failed': 0, 'timeout': 0, 'entries': 7}
+deadline_exceeded:
+    description: Whether the deadline passed before every timeline was fetched.
+    type: bool
+    returned: always
+'''
+
+TIMELINE_CACHE_NAME = "timelines"
+TIMELINE_URIS = {
+    "newsfeed": "/incidents/{}/newsfeed",
+    "history": "/incidents/{}/history"
+}
+
+
+def run_module():
+    module_args = dict(
+        case_ids=dict(type='list', elements='int', required=True),
+        source=dict(type='str', required=False, default='newsfeed', choices=['newsfeed', 'history']),
+        incremental=dict(type='bool', required=False, default=True),
+        reset=dict(type='bool', required=False, default=False),
+        concurrency=dict(type='int', required=False, default=8),
+        **CLIENT_ARGS
+    )
+
+    result = dict(
+        changed=False,
+        timelines=[],
+        summary={},
+        deadline_exceeded=False
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+    instrument_module(module)
+    configure_client(module.params)
+
+    params = module.params
+    # A Case listed twice would be fetched twice and race on its state
+    case_ids = list(dict.fromkeys(params['case_ids']))
+
+    try:  # Try to make the API calls
+        state = TimelineState(params['source'])
+        if params['reset']:
+            state.forget(case_ids)
+        client = create_authenticated_client()
+        timelines = fetch_timelines(client, case_ids, params['source'], state if params['incremental'] else None,
+                                    concurrency=params['concurrency'])
+        # Reading a timeline changes nothing on the instance, check mode only leaves the state file alone
+        if (params['incremental'] or params['reset']) and not module.check_mode:
+            state.save()
+    except Exception as e:
+        module.fail_json(msg=u'An exception occurred when getting the {} of the Cases: {}'.format(params['source'], e), **result)
+
+    result.update({
+        "timelines": timelines,
+        "summary": {
+            **{status: sum(1 for timeline in timelines if timeline["status"] == status) for status in ("fetched", "failed", "timeout")},
+            "entries": sum(timeline.get("new", 0) for timeline in timelines)
+        },
+        "deadline_exceeded": any(timeline["status"] == "timeout" for timeline in timelines)
+    })
+    if result["summary"]["failed"]:
+        module.fail_json(msg=u'Failed to get the {} of {} of {} Cases'.format(
+            params['source'], result["summary"]["failed"], len(timelines)), **result)
+    if result["deadline_exceeded"]:
+        module.warn(u'The deadline passed before the {} of every Case was fetched, rerun to get the rest'.format(params['source']))
+    module.exit_json(**result)
+
+
+def entry_position(entry: dict):
+    """entry_position orders the entries of a timeline, by when they
+    happened and then by ID for entries of the same millisecond.
+    """
+    return (entry.get("timestamp") or entry.get("create_date") or 0, entry.get("id") or 0)
+
+
+class TimelineState(object):
+    """TimelineState holds the position of the last entry seen of every
+    Case, in one json file per instance, org and source. It is read once
+    and written once per run, the fetches only change it in memory.
+    """
+
+    def __init__(self, source: str, state_dir=None):
+        opts = get_connection_opts()
+        key = cache_key(TIMELINE_CACHE_NAME, opts.get("host"), opts.get("org"), source)
+        self.path = os.path.join(state_dir or get_cache_dir(TIMELINE_CACHE_NAME), "{}.json".format(key))
+        try:
+            with open(self.path, "r") as state_file:
+                self.positions = json.load(state_file)
+        except (OSError, IOError, ValueError):
+            self.positions = {}
+
+    def last_seen(self, case_id: int):
+        position = self.positions.get(str(case_id))
+        return tuple(position) if position is not None else None
+
+    def seen(self, case_id: int, position: tuple):
+        self.positions[str(case_id)] = list(position)
+
+    def forget(self, case_ids: list):
+        for case_id in case_ids:
+            self.positions.pop(str(case_id), None)
+
+    def save(self):
+        # Write to a temp file and rename so a killed run never leaves a partial state file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+        with os.fdopen(fd, "w") as state_file:
+            json.dump(self.positions, state_file, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+
+def fetch_timelines(client, case_ids: list, source: str, state=None, concurrency=8):
+    """fetch_timelines gets the timeline of every Case concurrently over
+    the one client. With a state only the entries after the last one seen
+    are returned and the state moves on to the newest entry of every Case
+    which was fetched.
+
+    :return: The outcome of every Case, with its status (fetched, failed or timeout) and new entries
+    :rtype: list
+    """
+    def fetch(case_id):
+        response = client.get(TIMELINE_URIS[source].format(case_id))
+        return response if isinstance(response, list) else response.get("entries", [])
+
+    timelines = []
+    for run in run_concurrently(fetch, case_ids, concurrency):
+        outcome = {"case_id": run["item"], "elapsed": run["elapsed"]}
+        if isinstance(run["error"], DeadlineExceeded):
+            outcome.update({"status": "timeout", "error": str(run["error"])})
+        elif run["error"] is not None:
+            outcome.update({"status": "failed", "error": str(run["error"])})
+        else:
+            entries = sorted(run["result"], key=entry_position)
+            if state is not None:
+                last_seen = state.last_seen(run["item"])
+                if last_seen is not None:
+                    entries = [entry for entry in entries if entry_position(entry) > last_seen]
+                if entries:
+                    state.seen(run["item"], entry_position(entries[-1]))
+            outcome.update({"status": "fetched", "fetched": len(run["result"]), "new": len(entries), "entries": entries})
+        timelines.append(outcome)
+    return timelines
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
@@ -7,9 +7,6 @@
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 from __future__ import (absolute_import, division, print_function)
 
-# Additional import of common code 
-# from cp4s_common import create_authenticated_client
-
 __metaclass__ = type
 
 DOCUMENTATION = r'''
@@ -34,6 +31,17 @@ options:
             - Control to pass any extra information that might be needed to close a case. Usually mandatory fields, include in the format payload={'resulution_summary': 'duplicate'}
         required: false
         type: dict
+    schema_ttl:
+        description:
+            - Seconds the incident field definitions from /types/incident/fields are cached on disk for
+            - Fields are checked against the definitions and select values can be given by label, e.g 'High', before anything is sent
+            - 0 disables local validation
+        required: false
+        type: int
+        default: 3600
+
+extends_documentation_fragment:
+    - ryan_gordon1.cloud_pak_for_security.cp4s_client
 
 author:
     - Ryan Gordon (@Ryan-Gordon)
@@ -51,6 +59,14 @@ EXAMPLES = r'''
     case_id: 2095
     payload: '{'resolution_summary': {'format': 'text', 'content': 'This was a duplicate'}}'
 
+# select fields can be given by label
+- name: Test closure of a Case
+  ryan_gordon1.cloud_pak_for_security.cp4s_close_incident:
+    case_id: 2095
+    payload:
+      resolution_id: Duplicate
+      resolution_summary: This was a duplicate
+
 '''
 
 RETURN = r'''
@@ -66,11 +82,11 @@ message:
     returned: always
     sample: 'goodbye'
 '''
-# TODO: Review the encapsulation of common logic in module utils
-# So far i have not gotten it to work.
-# When working according to the docs this statement should work
-# from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import create_authenticated_client
 from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import CLIENT_ARGS, configure_client, create_authenticated_client
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import instrument_module
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_cache import invalidate_query_cache
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_schema_cache import SCHEMA_ARGS, load_module_schema
 from resilient_lib import close_incident
 
 def run_module():
@@ -78,7 +94,9 @@ def run_module():
     # ansible module_args cannot accept a dict for custom modules so use a json str for input
     module_args = dict(
         case_id=dict(type='int', required=True),
-        payload=dict(type='dict', required=False, default={})
+        payload=dict(type='dict', required=False, default={}),
+        **SCHEMA_ARGS,
+        **CLIENT_ARGS
     )
 
     # seed the result dict in the object
@@ -99,6 +117,8 @@ def run_module():
         argument_spec=module_args,
         supports_check_mode=True
     )
+    instrument_module(module)
+    configure_client(module.params)
 
     # if the user is working with this module in only check mode we do not
     # want to make any changes to the environment, just return the current
@@ -108,7 +128,13 @@ def run_module():
 
     # TODO: Review if we can make the exception less bare, or if we can use a conditional for the changed property instead
     try:  # Try to make the API call
-        response = close_incident(create_authenticated_client(), module.params['case_id'], module.params['payload'])
+        payload = module.params['payload']
+        schema = load_module_schema(module)
+        if schema:
+            payload = schema.resolve_payload(payload)
+        response = close_incident(create_authenticated_client(), module.params['case_id'], payload)
+        # The closed case can no longer match cached queries for open cases
+        invalidate_query_cache(module)
         
         result.update({"case_closure_result": response.json()})
     except Exception as e:  # we need to except in order to do else; use bare except and just raise the exception as normal
@@ -144,27 +170,6 @@ def create_incident(incident_name: str, payload: dict):
     })
 
 
-def create_authenticated_client():
-    """create_authenticated_client uses the resilient package
-    to gather values from a standard app.config file; the configuration file
-    used for an Integration Server or App Host App.
-    This means all credentials needed to run this module can be kept 
-    separate and we can also avoid var prompts.
-    Note: If your running this module on a host other than localhost, 
-    that host needs to have an app.config file or you need to copy one over.
-
-    :return: An authenticated rest client to CP4S or Resilient
-    :rtype: SimpleClient
-    """
-    import resilient
-    # Create Resilient API Client
-    resilient_parser = resilient.ArgumentParser(
-        config_file=resilient.get_config_file())
-    resilient_opts = resilient_parser.parse_known_args()
-    # Instantiate a client using the gathered opts
-    return resilient.get_client(resilient_opts[0])
-
-
 def main():
     run_module()
 
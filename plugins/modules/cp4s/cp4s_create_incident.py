@@ -7,6 +7,11 @@
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 from __future__ import (absolute_import, division, print_function)
 from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import CLIENT_ARGS, configure_client, create_authenticated_client, get_connection_opts, http_status
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_idempotency import FingerprintIndex, fingerprint_incident
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import instrument_module
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_cache import invalidate_query_cache
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_schema_cache import SCHEMA_ARGS, load_module_schema
 
 
 __metaclass__ = type
@@ -33,6 +38,40 @@ options:
             - Control to set fields on the created case that are not mandatory
         required: false
         type: dict
+    idempotency_key:
+        description:
+            - A unique key for this case. If a case was already created with the same key it is returned instead of creating a duplicate
+            - When not set but fingerprint_fields is, a fingerprint of the name and the fingerprint_fields values is used as the key
+            - When neither is set a new case is always created
+        required: false
+        type: str
+    fingerprint_fields:
+        description:
+            - Fields from the payload which, together with the name, make a case unique
+            - Builtin fields are read from the top level of the payload and custom fields from payload.properties
+            - Pass [name] to treat any case with the same name as a duplicate
+        required: false
+        type: list
+        elements: str
+        default: []
+    idempotency_field:
+        description:
+            - Name of a custom text field the idempotency_key is stored in when the case is created
+            - Lets another host find the case with one query when it is not in its local index
+            - Without it an idempotency_key is only looked up in the local index of this host, a key missing from it always creates a new case
+        required: false
+        type: str
+    schema_ttl:
+        description:
+            - Seconds the incident field definitions from /types/incident/fields are cached on disk for
+            - Fields are checked against the definitions and select values can be given by label, e.g 'High', before anything is sent
+            - 0 disables local validation
+        required: false
+        type: int
+        default: 3600
+
+extends_documentation_fragment:
+    - ryan_gordon1.cloud_pak_for_security.cp4s_client
 
 author:
     - Ryan Gordon (@Ryan-Gordon)
@@ -56,6 +95,20 @@ EXAMPLES = r'''
     name: Case created from an Ansible Module
     payload: {{mydictionary | to_json}}
 
+# only create the case once per alert, re-runs return the existing case with changed false
+- name: Test creation of a Case with a name
+  ryan_gordon1.cloud_pak_for_security.cp4s_create_incident:
+    name: Case created from an Ansible Module
+    idempotency_key: "{{ alert.id }}"
+    idempotency_field: source_alert_id
+
+# select fields can be given by label
+- name: Test creation of a Case with a name
+  ryan_gordon1.cloud_pak_for_security.cp4s_create_incident:
+    name: Case created from an Ansible Module
+    payload:
+      severity_code: High
+
 # fail the module
 - name: Test failure of the module
   ryan_gordon1.cloud_pak_for_security.cp4s_create_incident:
@@ -76,18 +129,18 @@ message:
     sample: 'goodbye'
 '''
 
-# TODO: Review the encapsulation of common logic in module utils
-# So far i have not gotten it to work.
-# When working according to the docs this statement should work
-# from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import create_authenticated_client
-
 
 def run_module():
     # define available arguments/parameters a user can pass to the module
     # ansible module_args cannot accept a dict for custom modules so use a json str for input
     module_args = dict(
         name=dict(type='str', required=True),
-        payload=dict(type='dict', required=False, default={})
+        payload=dict(type='dict', required=False, default={}),
+        idempotency_key=dict(type='str', required=False, default=None, no_log=False),
+        fingerprint_fields=dict(type='list', elements='str', required=False, default=[]),
+        idempotency_field=dict(type='str', required=False, default=None),
+        **SCHEMA_ARGS,
+        **CLIENT_ARGS
     )
 
     # seed the result dict in the object
@@ -108,6 +161,8 @@ def run_module():
         argument_spec=module_args,
         supports_check_mode=True
     )
+    instrument_module(module)
+    configure_client(module.params)
 
     # if the user is working with this module in only check mode we do not
     # want to make any changes to the environment, just return the current
@@ -123,21 +178,34 @@ def run_module():
 
     # TODO: Review if we can make the exception less bare, or if we can use a conditional for the changed property instead
     try:  # Try to make the API call
-        incident = create_incident(incident_name=module.params.get(
-            'name', 'Test from Ansible module'), payload=module.params.get('payload', {}))
-        result.update({"case": incident})
+        name = module.params.get('name', 'Test from Ansible module')
+        payload = module.params.get('payload', {})
+        schema = load_module_schema(module)
+        if schema:
+            payload = schema.resolve_payload(payload)
+        if module.params['idempotency_key'] or module.params['fingerprint_fields']:
+            incident, created = ensure_incident(name, payload,
+                                                idempotency_key=module.params['idempotency_key'],
+                                                fingerprint_fields=module.params['fingerprint_fields'],
+                                                idempotency_field=module.params['idempotency_field'])
+        else:
+            incident, created = create_incident(incident_name=name, payload=payload), True
+        if created:
+            # A new case can change the result of any cached query
+            invalidate_query_cache(module)
+        result.update({"case": incident, "existing": not created})
     except Exception as e:  # we need to except in order to do else; use bare except and just raise the exception as normal
         # raise  # raises the exact error that would have otherwise been raised.
         module.fail_json(msg=u'An exception occurred when creating the case: {}'.format(e), **result)
-    else:  # if no expections are raised we can assume the API call is successful and has changed state
-        result['changed'] = True
+    else:  # only report a change if a case was actually created
+        result['changed'] = created
 
     # in the event of a successful module execution, you will want to
     # simple AnsibleModule.exit_json(), passing the key/value results
     module.exit_json(**result)
 
 
-def create_incident(incident_name: str, payload: dict):
+def create_incident(incident_name: str, payload: dict, client=None):
     """create_incident is a helper function which 
     will get a handle on an instance of the REST API client
     from create and then make an API call to create an incident
@@ -147,10 +215,12 @@ def create_incident(incident_name: str, payload: dict):
     :type incident_name: str
     :param payload: An optional control dictionary which exposes the rest of the REST API call to you should you need it 
     :type payload: dict
+    :param client: An already authenticated client to reuse, a new one is created if not provided
+    :type client: SimpleClient
     :return: The created Incident; no exceptions are handled here. If a 4XX code is returned for Auth or something else, this will fail
     :rtype: dict (IncidentDTO)
     """
-    client = create_authenticated_client()
+    client = client or create_authenticated_client()
 
     return client.post("/incidents", {
         "name": incident_name,
@@ -159,25 +229,91 @@ def create_incident(incident_name: str, payload: dict):
     })
 
 
-def create_authenticated_client():
-    """create_authenticated_client uses the resilient package
-    to gather values from a standard app.config file; the configuration file
-    used for an Integration Server or App Host App.
-    This means all credentials needed to run this module can be kept 
-    separate and we can also avoid var prompts.
-    Note: If your running this module on a host other than localhost, 
-    that host needs to have an app.config file or you need to copy one over.
+def find_existing_incident(client, incident_name: str, fields_fingerprint: str, fingerprint_fields: list, idempotency_key=None, idempotency_field=None):
+    """find_existing_incident makes a single targeted query for a case
+    which was already created for this key or fingerprint. Open and closed
+    cases are both considered so a closed duplicate is not recreated.
 
-    :return: An authenticated rest client to CP4S or Resilient
-    :rtype: SimpleClient
+    :param fields_fingerprint: The fingerprint of the name and fingerprint_fields, compared against the cases of the same name
+    :return: The matching Incident or None
+    :rtype: dict (IncidentDTO)
+    """
+    if idempotency_key and idempotency_field:
+        # The key was stored on the case so it can be matched directly
+        conditions = [{"field_name": "properties.{}".format(idempotency_field), "method": "equals", "value": idempotency_key}]
+    else:
+        conditions = [{"field_name": "name", "method": "equals", "value": incident_name}]
+
+    candidates = client.post(u"/incidents/query?return_level=normal", {
+        "filters": [{"conditions": conditions}],
+        "sorts": [{"field_name": "create_date", "type": "desc"}]
+    })
+    if idempotency_key and idempotency_field:
+        return candidates[0] if candidates else None
+
+    for candidate in candidates:
+        if fingerprint_incident(candidate, fingerprint_fields) == fields_fingerprint:
+            return candidate
+    return None
+
+
+def get_indexed_incident(client, case_id):
+    """get_indexed_incident reads the case the local index points at,
+    None when it was deleted since.
+
+    :rtype: dict (IncidentDTO)
+    """
+    try:
+        return client.get("/incidents/{}".format(case_id))
+    except Exception as e:
+        if http_status(e) == 404:
+            return None
+        raise
+
+
+def ensure_incident(incident_name: str, payload: dict, idempotency_key=None, fingerprint_fields=None, idempotency_field=None):
+    """ensure_incident creates the incident only if one was not already
+    created for the same idempotency key or fingerprint. The local
+    fingerprint index is checked first and the case it points at is read
+    back with one call, an entry for a deleted case is dropped. Otherwise
+    a single query is made before creating, unless the key is not stored
+    on the case in which case a miss in the index always creates.
+
+    :return: The existing or created Incident and whether it was created
+    :rtype: tuple
     """
-    import resilient
-    # Create Resilient API Client
-    resilient_parser = resilient.ArgumentParser(
-        config_file=resilient.get_config_file())
-    resilient_opts = resilient_parser.parse_known_args()
-    # Instantiate a client using the gathered opts
-    return resilient.get_client(resilient_opts[0])
+    fingerprint_fields = fingerprint_fields or []
+    fields_fingerprint = fingerprint_incident({"name": incident_name, **payload}, fingerprint_fields)
+    # The index is keyed by the idempotency key when there is one, the server side match is done separately
+    index_key = idempotency_key or fields_fingerprint
+
+    opts = get_connection_opts()
+    scope = (opts.get("host"), opts.get("org"))
+    index = FingerprintIndex()
+    client = create_authenticated_client(opts)
+
+    case_id = index.get(scope, index_key)
+    if case_id is not None:
+        incident = get_indexed_incident(client, case_id)
+        if incident is not None:
+            return incident, False
+        index.remove(scope, index_key)
+
+    existing = None
+    # A key which is not stored on the case cannot be matched on the server, and the name and fields
+    # are shared by the cases of different keys, so only the local index can answer for it
+    if idempotency_field or not idempotency_key:
+        existing = find_existing_incident(client, incident_name, fields_fingerprint, fingerprint_fields,
+                                          idempotency_key=idempotency_key, idempotency_field=idempotency_field)
+    if existing:
+        index.add(scope, index_key, existing["id"])
+        return existing, False
+
+    if idempotency_key and idempotency_field:
+        payload = {**payload, "properties": {**payload.get("properties", {}), idempotency_field: idempotency_key}}
+    incident = create_incident(incident_name, payload, client=client)
+    index.add(scope, index_key, incident["id"])
+    return incident, True
 
 
 def main():
@@ -7,9 +7,6 @@
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 from __future__ import (absolute_import, division, print_function)
 
-# Additional import of common code 
-# from cp4s_common import create_authenticated_client
-
 __metaclass__ = type
 
 DOCUMENTATION = r'''
@@ -39,6 +36,9 @@ options:
         required: false
         type: dict
 
+extends_documentation_fragment:
+    - ryan_gordon1.cloud_pak_for_security.cp4s_client
+
 author:
     - Ryan Gordon (@Ryan-Gordon)
 '''
@@ -72,11 +72,10 @@ message:
     sample: 'goodbye'
 '''
 
-# TODO: Review the encapsulation of common logic in module utils
-# So far i have not gotten it to work.
-# When working according to the docs this statement should work
-# from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import create_authenticated_client
 from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import CLIENT_ARGS, configure_client, create_authenticated_client
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import instrument_module
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_cache import invalidate_query_cache
 from resilient_lib import close_incident
 
 def run_module():
@@ -85,7 +84,8 @@ def run_module():
     module_args = dict(
         case_id=dict(type='int', required=True),
         text=dict(type='str', required=True),
-        other=dict(type='dict', required=False, default={})
+        other=dict(type='dict', required=False, default={}),
+        **CLIENT_ARGS
     )
 
     # seed the result dict in the object
@@ -106,6 +106,8 @@ def run_module():
         argument_spec=module_args,
         supports_check_mode=True
     )
+    instrument_module(module)
+    configure_client(module.params)
 
     # if the user is working with this module in only check mode we do not
     # want to make any changes to the environment, just return the current
@@ -131,6 +133,8 @@ def run_module():
         module.fail_json(msg=u'An exception occurred when creating a note on Case {}: {}'.format(module.params['case_id'],e), **result)
     else:  # if no expections are raised we can assume the API call is successful and has changed state
         result['changed'] = True
+        # Cached queries hold the old inc_last_modified_date of the Case
+        invalidate_query_cache(module)
 
     # in the event of a successful module execution, you will want to
     # simple AnsibleModule.exit_json(), passing the key/value results
@@ -159,27 +163,6 @@ def create_incident(incident_name: str, payload: dict):
     })
 
 
-def create_authenticated_client():
-    """create_authenticated_client uses the resilient package
-    to gather values from a standard app.config file; the configuration file
-    used for an Integration Server or App Host App.
-    This means all credentials needed to run this module can be kept 
-    separate and we can also avoid var prompts.
-    Note: If your running this module on a host other than localhost, 
-    that host needs to have an app.config file or you need to copy one over.
-
-    :return: An authenticated rest client to CP4S or Resilient
-    :rtype: SimpleClient
-    """
-    import resilient
-    # Create Resilient API Client
-    resilient_parser = resilient.ArgumentParser(
-        config_file=resilient.get_config_file())
-    resilient_opts = resilient_parser.parse_known_args()
-    # Instantiate a client using the gathered opts
-    return resilient.get_client(resilient_opts[0])
-
-
 def main():
     run_module()
 
@@ -7,9 +7,6 @@
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 from __future__ import (absolute_import, division, print_function)
 
-# Additional import of common code 
-# from cp4s_common import create_authenticated_client
-
 __metaclass__ = type
 
 DOCUMENTATION = r'''
@@ -26,9 +23,42 @@ description: This module is an example of how you can choose to use a module or
 
 options:
     task_id:
-        description: This is the ID number of the Case to be closed.
-        required: true
+        description: The ID of the Task to create the note on. Either task_id or case_id is required.
+        required: false
+        type: int
+    case_id:
+        description: Create the note on every Task of this Case which matches task_name and task_status
+        required: false
+        type: int
+    task_name:
+        description: With case_id, only Tasks whose name contains this text, ignoring case
+        required: false
+        type: str
+    task_status:
+        description: With case_id, only Tasks with this status
+        required: false
+        type: str
+        choices: [open, closed, any]
+        default: open
+    concurrency:
+        description: With case_id, the maximum number of notes created at once
+        required: false
         type: int
+        default: 4
+    resume:
+        description:
+            - With case_id, skip the Tasks a previous run with the same parameters already created the note on, so no Task gets it twice
+            - Progress is recorded as each note is created, and written to progress_file as it goes
+        required: false
+        type: bool
+        default: false
+    progress_file:
+        description:
+            - With case_id, a file the progress of the run is written to as it goes, as json with what is done, the total, the cursor and whether it finished
+            - async_status only returns the result of a job once it has ended, to watch a run started with async and poll 0 set a path here and read it, for example with slurp
+            - The file is written on the managed node and its directory must exist. When not set it is written next to the journal under CP4S_CACHE_DIR and its path is only known from the result
+        required: false
+        type: path
     text:
         description: This is the text that will be saved in the note. Accepts plain or rich text
         required: true
@@ -39,6 +69,9 @@ options:
         required: false
         type: dict
 
+extends_documentation_fragment:
+    - ryan_gordon1.cloud_pak_for_security.cp4s_client
+
 author:
     - Ryan Gordon (@Ryan-Gordon)
 '''
@@ -56,6 +89,12 @@ EXAMPLES = r'''
     task_id: 2095
     text: "<b>Report:</b><br><p>Scan result: <b color='green'>False Positive</b></p>"
 
+# Notify every open Task of a Case
+- name: Create a note on the open Tasks of a Case
+  ryan_gordon1.cloud_pak_for_security.cp4s_create_task_note:
+    case_id: 2095
+    text: "Containment is complete, please update your Tasks"
+
 '''
 
 RETURN = r'''
@@ -70,22 +109,48 @@ message:
     type: str
     returned: always
     sample: 'goodbye'
+notes:
+    description:
+        - With case_id, every matching Task with its status (created, failed, timeout or skipped), the seconds it took and the created note.
+        - Tasks not reached by the deadline are timeout, Tasks noted by a resumed run are skipped.
+    type: list
+    returned: when case_id is provided
+    sample: [{'task_id': 301, 'task_name': 'Contain the host', 'status': 'created', 'elapsed': 0.2, 'note': {}}]
+deadline_exceeded:
+    description: With case_id, whether the deadline passed before a note was created on every Task.
+    type: bool
+    returned: when case_id is provided
+progress_file:
+    description: The file the progress of the run was written to, progress_file when it was set.
+    type: str
+    returned: when case_id is provided
+    sample: '~/.ansible/cp4s_cache/journals/create_task_note-3f1c....progress.json'
 '''
 
-# TODO: Review the encapsulation of common logic in module utils
-# So far i have not gotten it to work.
-# When working according to the docs this statement should work
-# from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import create_authenticated_client
 from ansible.module_utils.basic import AnsibleModule
-from resilient_lib import close_incident
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import CLIENT_ARGS, DeadlineExceeded, configure_client, create_authenticated_client, run_concurrently
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_journal import open_journal
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import instrument_module
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_cache import invalidate_query_cache
+
+# Task status codes returned by the API, keyed by the task_status option
+TASK_STATUS_CODES = {"open": ("O",), "closed": ("C",), "any": ("O", "C")}
+
 
 def run_module():
     # define available arguments/parameters a user can pass to the module
     # ansible module_args cannot accept a dict for custom modules so use a json str for input
     module_args = dict(
-        task_id=dict(type='int', required=True),
+        task_id=dict(type='int', required=False, default=None),
+        case_id=dict(type='int', required=False, default=None),
+        task_name=dict(type='str', required=False, default=None),
+        task_status=dict(type='str', required=False, default='open', choices=['open', 'closed', 'any']),
+        concurrency=dict(type='int', required=False, default=4),
+        resume=dict(type='bool', required=False, default=False),
+        progress_file=dict(type='path', required=False, default=None),
         text=dict(type='str', required=True),
-        other=dict(type='dict', required=False, default={})
+        other=dict(type='dict', required=False, default={}),
+        **CLIENT_ARGS
     )
 
     # seed the result dict in the object
@@ -104,8 +169,12 @@ def run_module():
     # supports check mode
     module = AnsibleModule(
         argument_spec=module_args,
+        mutually_exclusive=[('task_id', 'case_id')],
+        required_one_of=[('task_id', 'case_id')],
         supports_check_mode=True
     )
+    instrument_module(module)
+    configure_client(module.params)
 
     # if the user is working with this module in only check mode we do not
     # want to make any changes to the environment, just return the current
@@ -113,17 +182,48 @@ def run_module():
     if module.check_mode:
         module.exit_json(**result)
 
-    client = create_authenticated_client()
-    # TODO: Review if we can make the exception less bare, or if we can use a conditional for the changed property instead
-    try:  # Try to make the API call
-        # Make an API call to the global artifacts endpoint for the org
-        # Pass the provided name and value 
-        # the 'other' module param is dict and is expanded to provide a way to add any other properties to the call 
-        response = client.post('/incidents/{}/comments'.format(module.params['task_id']), {
-            'text': module.params['text'],
-            **module.params['other']
+    note = {
+        'text': module.params['text'],
+        **module.params['other']
+    }
+
+    if module.params['case_id']:
+        try:  # List the tasks of the Case once and post the note to each matching task over the one client
+            journal = open_journal("create_task_note", *[module.params[name] for name in (
+                'case_id', 'task_name', 'task_status', 'text', 'other')], resume=module.params['resume'],
+                progress_path=module.params['progress_file'])
+            result["progress_file"] = journal.progress_path
+            client = create_authenticated_client()
+            tasks = find_case_tasks(client, module.params['case_id'],
+                                    task_name=module.params['task_name'], task_status=module.params['task_status'])
+            notes = create_task_notes(client, tasks, note, concurrency=module.params['concurrency'], journal=journal)
+        except Exception as e:
+            module.fail_json(msg=u'An exception occurred when creating notes on the Tasks of Case {}: {}'.format(module.params['case_id'], e), **result)
+
+        failed = [outcome for outcome in notes if outcome["status"] == "failed"]
+        if not journal.pending([outcome["task_id"] for outcome in notes]):
+            journal.finish()
+        result.update({
+            "notes": notes,
+            "changed": any(outcome["status"] == "created" for outcome in notes),
+            "deadline_exceeded": any(outcome["status"] == "timeout" for outcome in notes)
         })
-        # Add the response to the result to return
+        if result["changed"]:
+            # Cached queries hold the old inc_last_modified_date of the Case
+            invalidate_query_cache(module)
+        if failed:
+            module.fail_json(msg=u'Failed to create a note on {} of {} Tasks of Case {}, rerun with resume: true to retry them'.format(
+                len(failed), len(notes), module.params['case_id']), **result)
+        if result["deadline_exceeded"]:
+            module.warn(u'The deadline passed before a note was created on every Task of Case {}'.format(module.params['case_id']))
+        module.exit_json(**result)
+
+    try:  # Try to make the API call
+        client = create_authenticated_client()
+        # Make an API call to the comments endpoint of the task
+        # the 'other' module param is dict and is expanded to provide a way to add any other properties to the call
+        response = client.post('/tasks/{}/comments'.format(module.params['task_id']), note)
+        # Add the response to the result to return
         result.update({"note_creation_result": response})
 
     except Exception as e:  # we need to except in order to do else; use bare except and just raise the exception as normal
@@ -131,53 +231,65 @@ def run_module():
         module.fail_json(msg=u'An exception occurred when creating a note on Task {}: {}'.format(module.params['task_id'],e), **result)
     else:  # if no expections are raised we can assume the API call is successful and has changed state
         result['changed'] = True
+        # Cached queries hold the old inc_last_modified_date of the Case
+        invalidate_query_cache(module)
 
     # in the event of a successful module execution, you will want to
     # simple AnsibleModule.exit_json(), passing the key/value results
     module.exit_json(**result)
 
 
-def create_incident(incident_name: str, payload: dict):
-    """create_incident is a helper function which 
-    will get a handle on an instance of the REST API client
-    from create and then make an API call to create an incident
-    with the provided name and payload.
+def find_case_tasks(client, case_id: int, task_name=None, task_status="open"):
+    """find_case_tasks lists the tasks of a Case with a single API call
+    and keeps those matching the filters.
 
-    :param incident_name: The name which will be given to the Incident/Case
-    :type incident_name: str
-    :param payload: An optional control dictionary which exposes the rest of the REST API call to you should you need it 
-    :type payload: dict
-    :return: The created Incident; no exceptions are handled here. If a 4XX code is returned for Auth or something else, this will fail
-    :rtype: dict (IncidentDTO)
+    :param task_name: Only keep tasks whose name contains this text, ignoring case
+    :type task_name: str
+    :param task_status: One of open, closed or any
+    :type task_status: str
+    :return: The matching tasks
+    :rtype: list
     """
-    client = create_authenticated_client()
-
-    return client.post("/incidents", {
-        "name": incident_name,
-        "discovered_date": 0,
-        **payload
-    })
-
-
-def create_authenticated_client():
-    """create_authenticated_client uses the resilient package
-    to gather values from a standard app.config file; the configuration file
-    used for an Integration Server or App Host App.
-    This means all credentials needed to run this module can be kept 
-    separate and we can also avoid var prompts.
-    Note: If your running this module on a host other than localhost, 
-    that host needs to have an app.config file or you need to copy one over.
-
-    :return: An authenticated rest client to CP4S or Resilient
-    :rtype: SimpleClient
+    tasks = client.get("/incidents/{}/tasks".format(case_id))
+    return [
+        task for task in tasks
+        if task.get("status") in TASK_STATUS_CODES[task_status]
+        and (not task_name or task_name.lower() in (task.get("name") or "").lower())
+    ]
+
+
+def create_task_notes(client, tasks: list, note: dict, concurrency=4, journal=None):
+    """create_task_notes posts the same note to every task concurrently.
+    A failure on one task does not stop the note being posted to the others.
+    With a journal, tasks noted by a previous run are skipped and every
+    task is recorded as soon as its note is created.
+
+    :return: The outcome of every task, with its status (created, failed, timeout or skipped) and the seconds it took
+    :rtype: list
     """
-    import resilient
-    # Create Resilient API Client
-    resilient_parser = resilient.ArgumentParser(
-        config_file=resilient.get_config_file())
-    resilient_opts = resilient_parser.parse_known_args()
-    # Instantiate a client using the gathered opts
-    return resilient.get_client(resilient_opts[0])
+    def create_note(task):
+        response = client.post("/tasks/{}/comments".format(task["id"]), note)
+        if journal is not None:
+            journal.record_done(task["id"])
+        return response
+
+    notes = []
+    if journal is not None:
+        journal.total = len(tasks)
+        notes = [{"task_id": task["id"], "task_name": task.get("name"), "status": "skipped"}
+                 for task in tasks if journal.is_done(task["id"])]
+        tasks = [task for task in tasks if not journal.is_done(task["id"])]
+
+    for run in run_concurrently(create_note, tasks, concurrency):
+        outcome = {"task_id": run["item"]["id"], "task_name": run["item"].get("name"), "elapsed": run["elapsed"]}
+        if isinstance(run["error"], DeadlineExceeded):
+            outcome.update({"status": "timeout", "error": str(run["error"])})
+        elif run["error"] is not None:
+            outcome.update({"status": "failed", "error": str(run["error"])})
+        else:
+            outcome.update({"status": "created", "note": run["result"]})
+        notes.append(outcome)
+    return notes
 
 
 def main():
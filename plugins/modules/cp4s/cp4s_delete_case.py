@@ -7,6 +7,10 @@
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 from __future__ import (absolute_import, division, print_function)
 from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import CLIENT_ARGS, configure_client, create_authenticated_client
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_idempotency import FingerprintIndex
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import instrument_module
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_cache import invalidate_query_cache
 
 
 __metaclass__ = type
@@ -21,6 +25,9 @@ short_description: A Module used to delete a case
 # i.e. the version is of the form "2.5.0" and not "2.4".
 version_added: "1.0.0"
 
+extends_documentation_fragment:
+    - ryan_gordon1.cloud_pak_for_security.cp4s_client
+
 author:
     - Dara Meaney
 '''
@@ -29,7 +36,8 @@ def run_module():
     # define available arguments/parameters a user can pass to the module
     # ansible module_args cannot accept a dict for custom modules so use a json str for input
     module_args = dict(
-        incidentId=dict(type='str', required=True)
+        incidentId=dict(type='str', required=True),
+        **CLIENT_ARGS
     )
 
     # seed the result dict in the object
@@ -50,6 +58,8 @@ def run_module():
         argument_spec=module_args,
         supports_check_mode=True
     )
+    instrument_module(module)
+    configure_client(module.params)
 
     # if the user is working with this module in only check mode we do not
     # want to make any changes to the environment, just return the current
@@ -67,6 +77,9 @@ def run_module():
     try:  # Try to make the API call
         incident = delete_case(incident_id=module.params.get(
             'incidentId', {}))
+        invalidate_query_cache(module)
+        # Allow the same case to be created again by cp4s_create_incident
+        FingerprintIndex().remove_case(module.params['incidentId'])
         result.update({"case": incident})
     except Exception as e:  # we need to except in order to do else; use bare except and just raise the exception as normal
         # raise  # raises the exact error that would have otherwise been raised.
@@ -91,27 +104,6 @@ def delete_case(incident_id: str):
     return client.delete("/incidents/{}".format(incident_id))
 
 
-def create_authenticated_client():
-    """create_authenticated_client uses the resilient package
-    to gather values from a standard app.config file; the configuration file
-    used for an Integration Server or App Host App.
-    This means all credentials needed to run this module can be kept
-    separate and we can also avoid var prompts.
-    Note: If your running this module on a host other than localhost,
-    that host needs to have an app.config file or you need to copy one over.
-
-    :return: An authenticated rest client to CP4S or Resilient
-    :rtype: SimpleClient
-    """
-    import resilient
-    # Create Resilient API Client
-    resilient_parser = resilient.ArgumentParser(
-        config_file=resilient.get_config_file())
-    resilient_opts = resilient_parser.parse_known_args()
-    # Instantiate a client using the gathered opts
-    return resilient.get_client(resilient_opts[0])
-
-
 def main():
     run_module()
 
@@ -0,0 +1,236 @@
+
+# Copyright: (c) 2021, Brian Reid
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import CLIENT_ARGS, build_incident_query, configure_client, create_authenticated_client, deadline_passed, iter_incidents_paged
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import instrument_module
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_output import DEFAULT_EXPORT_COLUMNS, HAS_PYARROW, PYARROW_IMPORT_ERROR, parse_columns, write_csv, write_parquet
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_dsl import compile_query
+import json
+
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: cp4s_export_incidents
+
+short_description: A Module used to export Cases/Incidents in CP4S or Resilient to a CSV or Parquet file
+
+# If this is part of a collection, you need to use semantic versioning,
+# i.e. the version is of the form "2.5.0" and not "2.4".
+version_added: "1.1.0"
+
+description:
+    - Pages through the Cases matching a query and writes them to a CSV or Parquet file as they arrive, so memory use stays flat for any number of Cases.
+    - Nested fields are flattened into one typed column each. Dates are written as UTC timestamps.
+    - Parquet files are written one row group at a time and need pyarrow on the host running the module.
+
+options:
+    conditions:
+        description:
+            - Export every Case matching these conditions, in the same stringified list format as cp4s_query_incidents
+            - One of conditions or query is required
+        required: false
+        type: str
+    query:
+        description: Export every Case matching this structured query, in the same format as cp4s_query_incidents
+        required: false
+        type: dict
+    method:
+        description: set global method for conditions
+        required: false
+        type: str
+    plan_status:
+        description: pass "C" to export closed incidents, by default open incidents are exported
+        required: false
+        type: str
+        default: A
+    multiple_fields:
+        description: conditions is a list of conditions rather than a single condition
+        required: false
+        type: bool
+        default: false
+    path:
+        description: The file to write
+        required: true
+        type: path
+    format:
+        description: The file format
+        required: false
+        type: str
+        choices: [csv, parquet]
+        default: csv
+    columns:
+        description:
+            - The columns to write, each a dotted path into the Case such as properties.source
+            - A type can follow the path as path:type, one of int, float, bool, str or timestamp
+            - Builtin fields default to their own type, e.g create_date is a timestamp, anything else to str
+            - Lists and objects are written as json
+        required: false
+        type: list
+        elements: str
+        default: [id, name, plan_status, severity_code, owner_id, phase_id, create_date, discovered_date, inc_last_modified_date, incident_type_ids]
+    compression:
+        description:
+            - The compression codec. none or gzip for csv, none, snappy, gzip, zstd, brotli or lz4 for parquet
+            - Defaults to none for csv and snappy for parquet
+        required: false
+        type: str
+    page_size:
+        description: Number of Cases requested per API call
+        required: false
+        type: int
+        default: 500
+    row_group_size:
+        description: Number of Cases per Parquet row group, the most held in memory at once
+        required: false
+        type: int
+        default: 10000
+
+requirements:
+    - pyarrow (for format=parquet)
+
+extends_documentation_fragment:
+    - ryan_gordon1.cloud_pak_for_security.cp4s_client
+
+author:
+    - Ryan Gordon (@Ryan-Gordon)
+'''
+
+EXAMPLES = r'''
+# Export every open phishing Case to a CSV file
+- name: Export phishing Cases
+  ryan_gordon1.cloud_pak_for_security.cp4s_export_incidents:
+    conditions: '["name", "phishing", "contains"]'
+    path: /tmp/phishing_cases.csv
+
+# Export a year of closed Cases, with a custom field, to a zstd compressed Parquet file
+- name: Export closed Cases
+  ryan_gordon1.cloud_pak_for_security.cp4s_export_incidents:
+    query:
+      filters:
+        - conditions:
+            - {field: create_date, op: within, value: 52w}
+    plan_status: C
+    path: /tmp/closed_cases.parquet
+    format: parquet
+    compression: zstd
+    columns: [id, name, severity_code, owner_id, create_date, end_date, properties.source, properties.score:float]
+'''
+
+RETURN = r'''
+output:
+    description: The path, format and columns of the written file, the number of Cases and row groups written and its size in bytes.
+    type: dict
+    returned: success
+    sample: {'path': '/tmp/closed_cases.parquet', 'format': 'parquet', 'record_count': 48211, 'row_groups': 5, 'bytes': 3822104, 'columns': ['id', 'name']}
+deadline_exceeded:
+    description: Whether the deadline passed before every Case was exported. The file holds the Cases fetched until then and is still valid.
+    type: bool
+    returned: always
+'''
+
+# Compression codecs of each format, the first is the default
+CODECS = {
+    "csv": ("none", "gzip"),
+    "parquet": ("snappy", "none", "gzip", "zstd", "brotli", "lz4")
+}
+
+
+def run_module():
+    module_args = dict(
+        conditions=dict(type='str', required=False, default=None),
+        query=dict(type='dict', required=False, default=None),
+        method=dict(type='str', required=False, default=None),
+        plan_status=dict(type='str', required=False, default="A"),
+        multiple_fields=dict(type='bool', required=False, default=False),
+        path=dict(type='path', required=True),
+        format=dict(type='str', required=False, default='csv', choices=['csv', 'parquet']),
+        columns=dict(type='list', elements='str', required=False, default=DEFAULT_EXPORT_COLUMNS),
+        compression=dict(type='str', required=False, default=None),
+        page_size=dict(type='int', required=False, default=500),
+        row_group_size=dict(type='int', required=False, default=10000),
+        **CLIENT_ARGS
+    )
+
+    result = dict(
+        changed=False,
+        output={},
+        deadline_exceeded=False
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        required_one_of=[('conditions', 'query')],
+        mutually_exclusive=[('conditions', 'query')],
+        supports_check_mode=True
+    )
+    instrument_module(module)
+    configure_client(module.params)
+
+    params = module.params
+    if params['format'] == 'parquet' and not HAS_PYARROW:
+        module.fail_json(msg=missing_required_lib('pyarrow'), exception=PYARROW_IMPORT_ERROR, **result)
+
+    codecs = CODECS[params['format']]
+    compression = (params['compression'] or codecs[0]).lower()
+    if compression not in codecs:
+        module.fail_json(msg=u"compression for {} must be one of {}".format(params['format'], ", ".join(codecs)), **result)
+
+    try:
+        columns = parse_columns(params['columns'])
+        plan_status = params['plan_status'].upper()
+        if params['query']:
+            query = compile_query(params['query'], plan_status=plan_status)[1]
+        else:
+            query = build_incident_query(json.loads(params['conditions']), method=params['method'],
+                                         plan_status=plan_status, mulitple_fields=params['multiple_fields'])[1]
+    except ValueError as e:
+        module.fail_json(msg=u'Invalid export: {}'.format(e), **result)
+
+    if module.check_mode:
+        module.exit_json(**result)
+
+    try:  # Try to make the API calls
+        output = export_incidents(query, params['path'], columns, params['format'], compression=compression,
+                                  page_size=params['page_size'], row_group_size=params['row_group_size'])
+    except Exception as e:
+        module.fail_json(msg=u'An exception occurred when exporting cases: {}'.format(e), **result)
+
+    result.update({
+        "output": {**output, "format": params['format'], "compression": compression, "columns": [name for name, _, _ in columns]},
+        "changed": True,
+        "deadline_exceeded": deadline_passed()
+    })
+    if result["deadline_exceeded"]:
+        module.warn(u'The deadline passed after {} Cases, the export is partial'.format(output.get("record_count", 0)))
+    module.exit_json(**result)
+
+
+def export_incidents(query: dict, path: str, columns: list, file_format: str, compression="none", page_size=500, row_group_size=10000):
+    """export_incidents pages through the incidents matching query and
+    writes them to path as they arrive, until the deadline if there is one.
+
+    :param columns: Columns from parse_columns
+    :return: The path, record count and size of the written file
+    :rtype: dict
+    """
+    client = create_authenticated_client()
+    records = iter_incidents_paged(client, query, page_size=page_size)
+
+    if file_format == "parquet":
+        return write_parquet(path, records, columns, compression=compression, row_group_size=row_group_size)
+    return write_csv(path, records, columns, compress=compression == "gzip")
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,10 @@
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 from __future__ import (absolute_import, division, print_function)
 from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import CLIENT_ARGS, configure_client, count_incidents, create_authenticated_client, deadline_passed, iter_incidents_paged
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_instances import INSTANCE_ARGS, merge_instance_results, run_on_instances
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import instrument_module
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_output import OUTPUT_FILE_ARGS, RESULT_ENCODING_ARGS, drop_empty_fields, use_fast_json, write_ndjson
 
 
 __metaclass__ = type
@@ -18,15 +22,94 @@ short_description: A Module used to get a list of open Cases in CP4S or Resilien
 # i.e. the version is of the form "2.5.0" and not "2.4".
 version_added: "1.0.0"
 description: This module is an example of how you can choose to use a module or a role to achieve a similar outcome. An almost identical piece of functionality exists in the CP4S role but this gives a programmatic way to do it.
+options:
+    count_only:
+        description:
+            - Only return the number of open cases under C(count) rather than the cases themselves
+            - Uses a single paged query for one case so the cost does not grow with the number of open cases
+        required: false
+        type: bool
+        default: false
+    output_file:
+        description:
+            - Write the open cases to this file as newline delimited json instead of returning them in the result
+            - Cases are written page by page as they arrive so memory use stays flat for any number of cases
+            - Only the path, record count and file size are returned under C(output)
+        required: false
+        type: path
+    output_gzip:
+        description: gzip compress the output_file as it is written
+        required: false
+        type: bool
+        default: false
+    page_size:
+        description: Number of cases requested per API call when writing to output_file
+        required: false
+        type: int
+        default: 500
+    fast_json:
+        description:
+            - Encode the result with orjson when it is installed on the host running the module, or compact stdlib json otherwise
+            - Cuts the time spent encoding large results, the result itself is the same
+        required: false
+        type: bool
+        default: false
+    drop_empty_fields:
+        description:
+            - Remove the fields which are null or empty in every returned case, including custom fields under properties
+            - Fields with a value in any case are kept in all of them
+        required: false
+        type: bool
+        default: false
+    instances:
+        description:
+            - Get the open cases of each of these instances at once instead of the one in the default app.config
+            - Each instance has a C(name) and is read from its C(config_file), the default app.config if not set
+            - C(host), C(org), C(api_key_id) and C(api_key_secret) override the values in the app.config
+            - Every returned case has the name of its instance under C(cp4s_instance) and every instance is summarised under C(instances)
+            - Instances which fail or time out are reported and the results of the others are still returned
+            - Cannot be combined with output_file
+        required: false
+        type: list
+        elements: dict
+    instance_timeout:
+        description: Seconds to wait for every instance before returning the results which have arrived
+        required: false
+        type: int
+        default: 60
+extends_documentation_fragment:
+    - ryan_gordon1.cloud_pak_for_security.cp4s_client
+
 author:
     - Dara Meaney
 '''
 
+# Paged query body matching the cases returned by /incidents?want_closed=false
+OPEN_CASES_QUERY = {
+    "filters": [{
+        "conditions": [{
+            "field_name": "plan_status",
+            "method": "equals",
+            "value": "A"
+        }]
+    }],
+    "sorts": [{
+        "field_name": "create_date",
+        "type": "desc"
+    }]
+}
+
+
 def run_module():
     # define available arguments/parameters a user can pass to the module
     # ansible module_args cannot accept a dict for custom modules so use a json str for input
     module_args = dict(
-        name=dict(type='str', required=False)
+        name=dict(type='str', required=False),
+        count_only=dict(type='bool', required=False, default=False),
+        **INSTANCE_ARGS,
+        **OUTPUT_FILE_ARGS,
+        **RESULT_ENCODING_ARGS,
+        **CLIENT_ARGS
     )
 
     # seed the result dict in the object
@@ -47,6 +130,10 @@ def run_module():
         argument_spec=module_args,
         supports_check_mode=True
     )
+    instrument_module(module)
+    configure_client(module.params)
+    if module.params['fast_json']:
+        use_fast_json(module)
 
     # if the user is working with this module in only check mode we do not
     # want to make any changes to the environment, just return the current
@@ -60,16 +147,45 @@ def run_module():
     if module.params['name'] == 'fail me':
         module.fail_json(msg='You requested this to fail', **result)
 
+    if module.params['instances'] and module.params['output_file']:
+        module.fail_json(msg='instances cannot be combined with output_file', **result)
+
     # TODO: Review if we can make the exception less bare, or if we can use a conditional for the changed property instead
     try:  # Try to make the API call
-        incident = get_open_cases()
-        result.update({"case": incident})
+        if module.params['instances']:
+            instances = open_cases_on_instances(module.params['instances'], count_only=module.params['count_only'],
+                                                timeout=module.params['instance_timeout'])
+            if not module.params['count_only']:
+                instances["case"] = instances.pop("response")
+            result.update(instances)
+        elif module.params['count_only']:
+            result.update({"count": count_open_cases()})
+        elif module.params['output_file']:
+            result.update({"output": export_open_cases(
+                module.params['output_file'], compress=module.params['output_gzip'], page_size=module.params['page_size']),
+                "deadline_exceeded": deadline_passed()})
+        else:
+            incident = get_open_cases()
+            result.update({"case": incident})
     except Exception as e:  # we need to except in order to do else; use bare except and just raise the exception as normal
         # raise  # raises the exact error that would have otherwise been raised.
         module.fail_json(msg=u'An exception occurred when creating the case: {}'.format(e), **result)
     else:  # if no expections are raised we can assume the API call is successful and has changed state
         result['changed'] = True
 
+    if module.params['instances']:
+        failed = [instance for instance in result["instances"] if instance["status"] != "ok"]
+        if len(failed) == len(result["instances"]):
+            module.fail_json(msg=u'Getting the open cases failed on every instance', **result)
+        for instance in failed:
+            module.warn(u'Getting the open cases {} on instance {}: {}'.format(
+                "timed out" if instance["status"] == "timeout" else "failed", instance["instance"], instance.get("error", "")))
+    if result.get("deadline_exceeded"):
+        module.warn(u'The deadline passed before every open case was written to {}'.format(module.params['output_file']))
+
+    if module.params['drop_empty_fields'] and isinstance(result.get("case"), list):
+        result["case"] = drop_empty_fields(result["case"])
+
     # in the event of a successful module execution, you will want to
     # simple AnsibleModule.exit_json(), passing the key/value results
     module.exit_json(**result)
@@ -87,24 +203,45 @@ def get_open_cases():
     return client.get("/incidents?want_closed=false")
 
 
-def create_authenticated_client():
-    """create_authenticated_client uses the resilient package
-    to gather values from a standard app.config file; the configuration file
-    used for an Integration Server or App Host App.
-    This means all credentials needed to run this module can be kept
-    separate and we can also avoid var prompts.
-    Note: If your running this module on a host other than localhost,
-    that host needs to have an app.config file or you need to copy one over.
-    :return: An authenticated rest client to CP4S or Resilient
-    :rtype: SimpleClient
+def export_open_cases(output_file: str, compress=False, page_size=500):
+    """export_open_cases is a helper function which
+    will get a handle on an instance of the REST API client
+    and then page through the open cases, writing them to
+    output_file as newline delimited json as each page arrives,
+    stopping early if the deadline passes
+    :return: The path, record count and size of the written file
+    :rtype: dict
     """
-    import resilient
-    # Create Resilient API Client
-    resilient_parser = resilient.ArgumentParser(
-        config_file=resilient.get_config_file())
-    resilient_opts = resilient_parser.parse_known_args()
-    # Instantiate a client using the gathered opts
-    return resilient.get_client(resilient_opts[0])
+    client = create_authenticated_client()
+
+    return write_ndjson(output_file, iter_incidents_paged(client, OPEN_CASES_QUERY, page_size=page_size), compress=compress)
+
+
+def count_open_cases():
+    """count_open_cases is a helper function which
+    will get a handle on an instance of the REST API client
+    and then make a single paged query to count the open cases
+    :return: The number of open Incidents
+    :rtype: int
+    """
+    client = create_authenticated_client()
+
+    return count_incidents(client, OPEN_CASES_QUERY)
+
+
+def open_cases_on_instances(profiles: list, count_only=False, timeout=60):
+    """open_cases_on_instances is a helper function which
+    gets or counts the open cases of several instances at once,
+    returning whatever has arrived after timeout seconds
+    :return: The tagged cases or summed count, a summary of every instance and whether any is missing
+    :rtype: dict
+    """
+    def open_cases(client, opts):
+        if count_only:
+            return count_incidents(client, OPEN_CASES_QUERY)
+        return client.get("/incidents?want_closed=false")
+
+    return merge_instance_results(run_on_instances(open_cases, profiles, timeout=timeout), count_only=count_only)
 
 
 def main():
@@ -0,0 +1,424 @@
+
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import CLIENT_ARGS, configure_client, create_authenticated_client, run_concurrently
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_journal import open_journal
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import instrument_module
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_cache import invalidate_query_cache
+import codecs
+import csv
+import json
+import os
+import re
+import time
+
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: cp4s_import_artifacts
+
+short_description: A Module used to import IOCs from a CSV or STIX 2.1 file as Artifacts in CP4S or Resilient
+
+# If this is part of a collection, you need to use semantic versioning,
+# i.e. the version is of the form "2.5.0" and not "2.4".
+version_added: "1.1.0"
+
+description:
+    - Reads indicators from a CSV file or a STIX 2.1 bundle one at a time, so the whole file is never held in memory.
+    - Indicator types are mapped to CP4S artifact types and the artifacts are created in batches with bounded concurrency.
+    - After every complete batch the byte offset reached in the file is saved in a journal, so a failed import can be resumed without re-sending what was already created.
+    - The offset reached and the size of the file are written to progress_file as the import runs.
+    - Repeated indicators are only skipped within one run, up to the first million distinct values. A resumed run does not know the values
+      the run before it created, so a value repeated on both sides of the resume offset is created again.
+
+options:
+    src:
+        description: The CSV or STIX 2.1 json file to import
+        required: true
+        type: path
+    format:
+        description: The format of src, guessed from its extension if not set
+        required: false
+        type: str
+        choices: [csv, stix]
+    case_id:
+        description: Create the artifacts on this Case. Without it they are created as global artifacts, as cp4s_create_artifact does.
+        required: false
+        type: int
+    type_column:
+        description: The CSV column holding the indicator type
+        required: false
+        type: str
+        default: type
+    value_column:
+        description: The CSV column holding the indicator value
+        required: false
+        type: str
+        default: value
+    description_column:
+        description: The CSV column holding an optional description
+        required: false
+        type: str
+        default: description
+    type_map:
+        description:
+            - Extra or overriding mappings from an indicator type, as found in the file, to a CP4S artifact type
+            - Types which are already CP4S artifact type names are used as they are
+        required: false
+        type: dict
+        default: {}
+    batch_size:
+        description: The number of artifacts created between checkpoints
+        required: false
+        type: int
+        default: 200
+    concurrency:
+        description: The maximum number of artifacts created at once
+        required: false
+        type: int
+        default: 8
+    resume:
+        description: Start from the offset saved by a previous failed run on the same file and target instead of the start of the file
+        required: false
+        type: bool
+        default: false
+    progress_file:
+        description:
+            - A file the progress of the run is written to as it goes, as json with what is done, the total, the cursor and whether it finished
+            - async_status only returns the result of a job once it has ended, to watch a run started with async and poll 0 set a path here and read it, for example with slurp
+            - The file is written on the managed node and its directory must exist. When not set it is written next to the journal under CP4S_CACHE_DIR and its path is only known from the result
+        required: false
+        type: path
+
+extends_documentation_fragment:
+    - ryan_gordon1.cloud_pak_for_security.cp4s_client
+
+author:
+    - Ryan Gordon (@Ryan-Gordon)
+'''
+
+EXAMPLES = r'''
+# Import a CSV of IOCs with type and value columns onto a Case
+- name: Import IOCs
+  ryan_gordon1.cloud_pak_for_security.cp4s_import_artifacts:
+    src: /data/feeds/iocs.csv
+    case_id: 2095
+
+# Import a STIX bundle as global artifacts, resuming if a previous run failed part way
+- name: Import a STIX bundle
+  ryan_gordon1.cloud_pak_for_security.cp4s_import_artifacts:
+    src: /data/feeds/bundle.json
+    concurrency: 16
+    resume: true
+'''
+
+RETURN = r'''
+summary:
+    description: The number of indicators read, created, skipped as unmapped or duplicate, and the offset and time reached.
+    type: dict
+    returned: always
+    sample: {'read': 25000, 'created': 24850, 'unmapped': 100, 'duplicates': 50, 'offset': 10485760, 'elapsed': 95.3, 'resumed_from': 0}
+errors:
+    description: The first errors of the batch which stopped the import.
+    type: list
+    returned: when an artifact could not be created
+progress_file:
+    description: The file the progress of the run was written to, progress_file when it was set.
+    type: str
+    returned: when not in check mode
+    sample: '~/.ansible/cp4s_cache/journals/import_artifacts-3f1c....progress.json'
+'''
+
+# Indicator types commonly found in CSV feeds and STIX patterns, mapped to CP4S artifact types
+DEFAULT_TYPE_MAP = {
+    "ip": "IP Address",
+    "ipv4": "IP Address",
+    "ipv6": "IP Address",
+    "ipv4-addr": "IP Address",
+    "ipv6-addr": "IP Address",
+    "domain": "DNS Name",
+    "domain-name": "DNS Name",
+    "hostname": "DNS Name",
+    "url": "URL",
+    "uri": "URL",
+    "email": "Email Sender",
+    "email-addr": "Email Sender",
+    "md5": "Malware MD5 Hash",
+    "sha1": "Malware SHA-1 Hash",
+    "sha-1": "Malware SHA-1 Hash",
+    "sha256": "Malware SHA-256 Hash",
+    "sha-256": "Malware SHA-256 Hash",
+    "filename": "File Name",
+    "file:name": "File Name",
+    "file:hashes.md5": "Malware MD5 Hash",
+    "file:hashes.sha-1": "Malware SHA-1 Hash",
+    "file:hashes.sha-256": "Malware SHA-256 Hash",
+    "mac-addr": "MAC Address",
+    "user-account": "User Account",
+}
+
+# One comparison in a STIX pattern, e.g [file:hashes.'SHA-256' = '...']
+STIX_COMPARISON = re.compile(r"([a-z0-9-]+):([a-zA-Z0-9_.'\-]+)\s*=\s*'((?:[^'\\]|\\.)*)'")
+# Whitespace and commas between the objects of a STIX bundle
+STIX_SEPARATORS = re.compile(r"[ \t\r\n,]*")
+READ_SIZE = 64 * 1024
+# Most distinct values remembered to skip duplicates, so memory stays bounded on very large files
+DEDUP_MAX_VALUES = 1000000
+ERRORS_REPORTED = 10
+
+
+def run_module():
+    module_args = dict(
+        src=dict(type='path', required=True),
+        format=dict(type='str', required=False, default=None, choices=['csv', 'stix']),
+        case_id=dict(type='int', required=False, default=None),
+        type_column=dict(type='str', required=False, default='type'),
+        value_column=dict(type='str', required=False, default='value'),
+        description_column=dict(type='str', required=False, default='description'),
+        type_map=dict(type='dict', required=False, default={}),
+        batch_size=dict(type='int', required=False, default=200),
+        concurrency=dict(type='int', required=False, default=8),
+        resume=dict(type='bool', required=False, default=False),
+        progress_file=dict(type='path', required=False, default=None),
+        **CLIENT_ARGS
+    )
+
+    result = dict(
+        changed=False,
+        summary={}
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+    instrument_module(module)
+    configure_client(module.params)
+
+    params = module.params
+    file_format = params['format'] or ("csv" if params['src'].lower().endswith(".csv") else "stix")
+    type_map = {**DEFAULT_TYPE_MAP, **{key.lower(): value for key, value in params['type_map'].items()}}
+    journal = None
+    start_offset = 0
+    # Check mode leaves the journal and progress alone, so it checks the whole file
+    if not module.check_mode:
+        # The journal is keyed on the file size and mtime so an updated feed file is never resumed part way
+        stat = os.stat(params['src'])
+        journal = open_journal("import_artifacts", os.path.abspath(params['src']), stat.st_size, stat.st_mtime, params['case_id'],
+                               resume=params['resume'], total=stat.st_size, progress_path=params['progress_file'])
+        result["progress_file"] = journal.progress_path
+        start_offset = (journal.cursor or 0) if params['resume'] else 0
+
+    if file_format == "csv":
+        indicators = iter_csv_indicators(params['src'], start_offset, params['type_column'],
+                                         params['value_column'], params['description_column'])
+    else:
+        indicators = iter_stix_indicators(params['src'], start_offset)
+
+    if module.check_mode:
+        # Parse and map the file without creating anything
+        summary = {"read": 0, "unmapped": 0}
+        for indicator, _ in indicators:
+            summary["read"] += 1
+            summary["unmapped"] += map_indicator_type(indicator, type_map) is None
+        result["summary"] = summary
+        module.exit_json(**result)
+
+    try:
+        client = create_authenticated_client()
+        summary, errors = import_indicators(client, indicators, type_map, params['case_id'], journal,
+                                            batch_size=params['batch_size'], concurrency=params['concurrency'])
+    except Exception as e:
+        module.fail_json(msg=u'An exception occurred when importing artifacts: {}'.format(e), **result)
+
+    summary["resumed_from"] = start_offset
+    result.update({"summary": summary, "changed": summary["created"] > 0})
+    if result["changed"]:
+        # Cached queries may hold the old artifacts or inc_last_modified_date of a Case
+        invalidate_query_cache(module)
+    if errors:
+        result["errors"] = errors
+        module.fail_json(msg=u'The import stopped at offset {}, rerun with resume: true to continue'.format(summary["offset"]), **result)
+    module.exit_json(**result)
+
+
+def iter_csv_indicators(path: str, start_offset=0, type_column="type", value_column="value", description_column="description"):
+    """iter_csv_indicators is a generator of (indicator, end offset) pairs
+    for each row of a CSV file. The file is read line by line in binary so
+    the byte offset after every row is known; fields spanning lines are not supported.
+    """
+    with open(path, "rb") as source:
+        header = next(csv.reader([source.readline().decode("utf-8-sig")]))
+        offset = max(start_offset, source.tell())
+        source.seek(offset)
+        for line in source:
+            offset += len(line)
+            text = line.decode("utf-8").strip()
+            if not text:
+                continue
+            row = dict(zip(header, next(csv.reader([text]))))
+            yield {
+                "type": (row.get(type_column) or "").strip(),
+                "value": (row.get(value_column) or "").strip(),
+                "description": (row.get(description_column) or "").strip()
+            }, offset
+
+
+def iter_stix_objects(path: str, start_offset=0):
+    """iter_stix_objects is a generator of (object, end offset) pairs for
+    each entry of the objects list of a STIX bundle. The file is read in
+    blocks and each object is decoded as soon as it is complete, so only
+    one object and one block are held in memory at a time.
+    """
+    decoder = json.JSONDecoder()
+    # Blocks can end part way through a multi-byte character, the incremental decoder holds it back
+    text = codecs.getincrementaldecoder("utf-8")()
+    with open(path, "rb") as source:
+        buffer = ""
+        offset = 0
+        if start_offset:
+            source.seek(start_offset)
+            offset = start_offset
+        else:
+            # Skip everything up to the opening bracket of the objects list
+            while True:
+                block = source.read(READ_SIZE)
+                if not block:
+                    return
+                buffer += text.decode(block)
+                match = re.search(r'"objects"\s*:\s*\[', buffer)
+                if match:
+                    offset = len(buffer[:match.end()].encode("utf-8"))
+                    buffer = buffer[match.end():]
+                    break
+
+        # pos is where the next object starts in buffer and offset its byte offset in the file.
+        # The buffer is only sliced once per block read, never once per object
+        pos = 0
+        while True:
+            skipped = STIX_SEPARATORS.match(buffer, pos).end()
+            offset += len(buffer[pos:skipped].encode("utf-8"))
+            pos = skipped
+            if buffer.startswith("]", pos):
+                return
+            try:
+                obj, end = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                # The object is not complete yet, read another block
+                block = source.read(READ_SIZE)
+                if not block:
+                    if buffer[pos:].strip():
+                        raise ValueError(u"Invalid STIX bundle {} at byte {}".format(path, offset))
+                    return
+                buffer = buffer[pos:] + text.decode(block)
+                pos = 0
+                continue
+            offset += len(buffer[pos:end].encode("utf-8"))
+            pos = end
+            yield obj, offset
+
+
+def iter_stix_indicators(path: str, start_offset=0):
+    """iter_stix_indicators is a generator of (indicator, end offset) pairs for
+    every equality comparison in the patterns of indicator objects, and for
+    cyber observable objects with a value, in a STIX 2.1 bundle.
+    """
+    for obj, offset in iter_stix_objects(path, start_offset):
+        if obj.get("type") == "indicator":
+            for object_type, object_path, value in STIX_COMPARISON.findall(obj.get("pattern", "")):
+                indicator_type = object_type if object_path == "value" else "{}:{}".format(object_type, object_path.replace("'", ""))
+                yield {"type": indicator_type, "value": value, "description": obj.get("name") or obj.get("description", "")}, offset
+        elif "value" in obj:
+            yield {"type": obj["type"], "value": obj["value"], "description": ""}, offset
+
+
+def map_indicator_type(indicator: dict, type_map: dict):
+    """map_indicator_type returns the CP4S artifact type of an indicator or None if it has no mapping"""
+    indicator_type = indicator.get("type", "")
+    if not indicator.get("value") or not indicator_type:
+        return None
+    if indicator_type in type_map.values():
+        return indicator_type
+    return type_map.get(indicator_type.lower())
+
+
+def iter_batches(indicators, batch_size: int):
+    """iter_batches groups (indicator, offset) pairs into batches of about
+    batch_size. Indicators from one STIX object share an offset and are never
+    split across batches, so a checkpoint never lands part way through an object.
+    """
+    batch = []
+    for item in indicators:
+        if len(batch) >= batch_size and item[1] != batch[-1][1]:
+            yield batch
+            batch = []
+        batch.append(item)
+    if batch:
+        yield batch
+
+
+def import_indicators(client, indicators, type_map: dict, case_id, journal, batch_size=200, concurrency=8):
+    """import_indicators creates artifacts for a stream of indicators one batch
+    at a time. The offset is recorded as the journal cursor after every batch
+    which fully succeeds, and the import stops at the first batch with an error.
+
+    :return: The import summary and the errors of the failed batch, if any
+    :rtype: tuple
+    """
+    uri = "/incidents/{}/artifacts".format(case_id) if case_id else "/artifacts"
+    summary = {"read": 0, "created": 0, "unmapped": 0, "duplicates": 0, "offset": 0}
+    seen = set()
+    start = time.time()
+
+    def create_artifact(artifact):
+        return client.post(uri, {
+            "type": {"name": artifact["type"]},
+            "value": artifact["value"],
+            "description": artifact["description"]
+        })
+
+    for batch in iter_batches(indicators, batch_size):
+        artifacts = []
+        for indicator, _ in batch:
+            summary["read"] += 1
+            artifact_type = map_indicator_type(indicator, type_map)
+            if artifact_type is None:
+                summary["unmapped"] += 1
+                continue
+            if (artifact_type, indicator["value"]) in seen:
+                summary["duplicates"] += 1
+                continue
+            if len(seen) < DEDUP_MAX_VALUES:
+                seen.add((artifact_type, indicator["value"]))
+            artifacts.append({**indicator, "type": artifact_type})
+
+        outcomes = run_concurrently(create_artifact, artifacts, concurrency)
+        errors = [{"type": outcome["item"]["type"], "value": outcome["item"]["value"], "error": str(outcome["error"])}
+                  for outcome in outcomes if outcome["error"] is not None]
+        summary["created"] += len(outcomes) - len(errors)
+        if errors:
+            summary["elapsed"] = round(time.time() - start, 3)
+            return summary, errors[:ERRORS_REPORTED]
+
+        summary["offset"] = batch[-1][1]
+        journal.record_cursor(summary["offset"])
+
+    # The whole file is done so there is nothing left to resume
+    journal.finish()
+    summary["elapsed"] = round(time.time() - start, 3)
+    return summary, []
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import CLIENT_ARGS, configure_client, create_authenticated_client, get_connection_opts, query_incidents_paged, raw_request, run_concurrently
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import instrument_module
+import math
+import time
+
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: cp4s_probe
+
+short_description: A Module used to measure the latency and throughput of a CP4S or Resilient instance
+
+# If this is part of a collection, you need to use semantic versioning,
+# i.e. the version is of the form "2.5.0" and not "2.4".
+version_added: "1.1.0"
+
+description:
+    - Times parsing the app.config, the login and a run of small GET calls to find the round trip time to the instance.
+    - Then runs a short load of read calls at each concurrency level and reports the throughput, latency percentiles and error rate of each.
+    - Use the results to pick forks, concurrency options and rate limits for the rest of the collection. Nothing on the instance is changed.
+
+options:
+    rtt_samples:
+        description: The number of GET calls made one after another to measure the round trip time
+        required: false
+        type: int
+        default: 5
+    operations:
+        description:
+            - The read calls to make in the load, taken in turn
+            - query is one page of the paged open case query, open_cases lists every open case as cp4s_get_open_cases does
+        required: false
+        type: list
+        elements: str
+        choices: [query, open_cases]
+        default: [query]
+    requests:
+        description: The number of calls made at each concurrency level
+        required: false
+        type: int
+        default: 50
+    concurrency:
+        description: The concurrency levels to run the load at, one after another
+        required: false
+        type: list
+        elements: int
+        default: [1, 4, 8]
+    page_size:
+        description: The number of cases asked for by each query call
+        required: false
+        type: int
+        default: 50
+
+extends_documentation_fragment:
+    - ryan_gordon1.cloud_pak_for_security.cp4s_client
+
+author:
+    - Ryan Gordon (@Ryan-Gordon)
+'''
+
+EXAMPLES = r'''
+# Measure the instance with the default load
+- name: Probe CP4S
+  ryan_gordon1.cloud_pak_for_security.cp4s_probe:
+  register: probe
+
+# Find where throughput stops growing with concurrency, for both read calls
+- name: Probe CP4S under load
+  ryan_gordon1.cloud_pak_for_security.cp4s_probe:
+    operations: [query, open_cases]
+    requests: 200
+    concurrency: [1, 2, 4, 8, 16, 32]
+'''
+
+RETURN = r'''
+probe:
+    description:
+        - Seconds taken to parse the app.config and to log in, the round trip time percentiles in seconds and the results of the load at each concurrency level.
+        - Each load has its calls per second, error rate, latency percentiles and the same for every operation.
+        - best_concurrency is the level with the most calls per second among those with the lowest error rate.
+    type: dict
+    returned: always
+    sample: {
+        'config_seconds': 0.004, 'login_seconds': 0.41,
+        'rtt': {'samples': 5, 'min': 0.021, 'p50': 0.024, 'p95': 0.031, 'max': 0.031},
+        'load': [{'concurrency': 4, 'requests': 50, 'errors': 0, 'error_rate': 0.0, 'seconds': 1.9, 'throughput': 26.3,
+                  'p50': 0.14, 'p95': 0.22, 'p99': 0.25, 'max': 0.25, 'errors_by_type': {}, 'operations': {}}],
+        'best_concurrency': 4
+    }
+'''
+
+PERCENTILES = (50, 95, 99)
+
+
+def run_module():
+    module_args = dict(
+        rtt_samples=dict(type='int', required=False, default=5),
+        operations=dict(type='list', elements='str', required=False, default=['query'], choices=['query', 'open_cases']),
+        requests=dict(type='int', required=False, default=50),
+        concurrency=dict(type='list', elements='int', required=False, default=[1, 4, 8]),
+        page_size=dict(type='int', required=False, default=50),
+        **CLIENT_ARGS
+    )
+
+    result = dict(
+        changed=False,
+        probe={}
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+    instrument_module(module)
+    configure_client(module.params)
+
+    params = module.params
+    if params['requests'] < 1 or params['rtt_samples'] < 1 or not params['operations'] or any(level < 1 for level in params['concurrency']):
+        module.fail_json(msg=u'requests, rtt_samples and every concurrency level must be at least 1, with at least one operation', **result)
+
+    if module.check_mode:
+        module.exit_json(**result)
+
+    try:  # Try to make the API calls
+        result["probe"] = probe(params['rtt_samples'], params['operations'], params['requests'], params['concurrency'],
+                                page_size=params['page_size'])
+    except Exception as e:
+        module.fail_json(msg=u'An exception occurred when probing the instance: {}'.format(e), **result)
+
+    module.exit_json(**result)
+
+
+def percentile(values: list, percent: float):
+    """percentile returns the nearest rank percentile of values, None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, int(math.ceil(percent / 100.0 * len(ordered))) - 1)]
+
+
+def latency_summary(latencies: list):
+    summary = {"p{}".format(percent): percentile(latencies, percent) for percent in PERCENTILES}
+    summary["max"] = max(latencies) if latencies else None
+    return summary
+
+
+def probe(rtt_samples: int, operations: list, requests: int, levels: list, page_size=50):
+    """probe measures the config parse, the login and the round trip time,
+    then runs the load at every concurrency level over the one client.
+
+    :return: The measurements, see RETURN
+    :rtype: dict
+    """
+    start = time.time()
+    opts = get_connection_opts()
+    config_seconds = time.time() - start
+
+    start = time.time()
+    client = create_authenticated_client(opts)
+    login_seconds = time.time() - start
+
+    rtts = []
+    for _ in range(rtt_samples):
+        start = time.time()
+        raw_request(client, "get", "/rest/session", org_scoped=False)
+        rtts.append(time.time() - start)
+
+    calls = {
+        "query": lambda: query_incidents_paged(client, {"filters": [{"conditions": [
+            {"field_name": "plan_status", "method": "equals", "value": "A"}]}]}, length=page_size),
+        "open_cases": lambda: client.get("/incidents?want_closed=false")
+    }
+    loads = [run_load(calls, operations, requests, level) for level in levels]
+
+    return {
+        "config_seconds": round(config_seconds, 4),
+        "login_seconds": round(login_seconds, 4),
+        "rtt": {"samples": len(rtts), "min": round(min(rtts), 4),
+                **{key: round(value, 4) for key, value in latency_summary(rtts).items() if key != "p99"}},
+        "load": loads,
+        "best_concurrency": max(loads, key=lambda load: (-load["error_rate"], load["throughput"] or 0))["concurrency"]
+    }
+
+
+def run_load(calls: dict, operations: list, requests: int, concurrency: int):
+    """run_load makes requests calls, taking the operations in turn, with
+    at most concurrency in flight, and summarises how they went.
+
+    :param calls: A function making one call for each operation name
+    :return: The throughput, error rate and latency percentiles of the load, overall and per operation
+    :rtype: dict
+    """
+    items = [operations[position % len(operations)] for position in range(requests)]
+    start = time.time()
+    runs = run_concurrently(lambda operation: calls[operation](), items, concurrency)
+    seconds = time.time() - start
+
+    errors_by_type = {}
+    for run in runs:
+        if run["error"] is not None:
+            error_type = type(run["error"]).__name__
+            errors_by_type[error_type] = errors_by_type.get(error_type, 0) + 1
+
+    def summarise(selected):
+        latencies = [run["elapsed"] for run in selected if run["error"] is None]
+        errors = len(selected) - len(latencies)
+        return {
+            "requests": len(selected),
+            "errors": errors,
+            "error_rate": round(errors / float(len(selected)), 4) if selected else 0.0,
+            **latency_summary(latencies)
+        }
+
+    return {
+        "concurrency": concurrency,
+        **summarise(runs),
+        "seconds": round(seconds, 3),
+        # Failed calls still cost a round trip, only the successful ones count as throughput
+        "throughput": round(sum(1 for run in runs if run["error"] is None) / seconds, 2) if seconds else None,
+        "errors_by_type": errors_by_type,
+        "operations": {operation: summarise([run for run in runs if run["item"] == operation]) for operation in set(operations)}
+    }
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,16 @@
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 from __future__ import (absolute_import, division, print_function)
 from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import CLIENT_ARGS, DeadlineExceeded, add_incident_conditions, build_incident_query, configure_client, count_incidents, create_authenticated_client, deadline_passed, get_connection_opts, iter_incidents_paged, query_incidents_paged, run_concurrently
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_instances import INSTANCE_ARGS, merge_instance_results, run_on_instances
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import instrument_module
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_output import OUTPUT_FILE_ARGS, RESULT_ENCODING_ARGS, drop_empty_fields, use_fast_json, write_ndjson
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_cache import QueryCache, cache_key
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_dsl import INCIDENT_FIELDS, compile_query, parse_duration
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_schema_cache import SCHEMA_ARGS, load_module_schema
+import heapq
 import json
+import time
 
 __metaclass__ = type
 
@@ -30,8 +39,21 @@ options:
             - [key, value, method] if querying one field
             - [ [key, value, method], [key, value, method] ] if multiple field query is desired
             - see resilient REST API documentation for a complete list of available methods and field keys
-        required: true
+            - One of conditions or query is required
+        required: false
         type: stringified list
+    query:
+        description:
+            - A structured query compiled into a single server side request, as an alternative to conditions
+            - C(filters) is a list of groups, each with a list of C(conditions). Conditions in a group are AND'ed and the groups are OR'ed
+            - Each condition has a C(field), an C(op) and a C(value). Custom fields need a properties. prefix
+            - C(op) is one of equals, not_equals, contains, not_contains, gt, gte, lt, lte, in, not_in, has_a_value, not_has_a_value
+            - C(op) can also be within or older_than with a relative C(value) such as 30m, 24h, 7d or 2w for date fields
+            - C(sorts) is a list of field names, prefixed with - for descending order. Defaults to -create_date
+            - Field names are checked before the request is sent
+            - plan_status is added to every group which does not filter on plan_status itself
+        required: false
+        type: dict
     method:
         description: set global method for conditions
         required: false
@@ -48,7 +70,103 @@ options:
         description: provide any value to fail the module
         required: false
         type: string
-    
+    cache_ttl:
+        description:
+            - Number of seconds a result for the same query can be reused from the local cache instead of calling the API again
+            - Queries are matched on their normalized conditions, method, plan_status and sort so condition order does not matter
+            - The cache is dropped whenever a cp4s module creates, closes or deletes a case
+            - 0 disables the cache
+        required: false
+        type: int
+        default: 0
+    count_only:
+        description:
+            - Only return the number of matching cases under C(count) rather than the cases themselves
+            - Uses a single paged query for one case so the cost does not grow with the number of matches
+        required: false
+        type: bool
+        default: false
+    output_file:
+        description:
+            - Write the matching cases to this file as newline delimited json instead of returning them in the result
+            - Cases are written page by page as they arrive so memory use stays flat for any number of cases
+            - Only the path, record count and file size are returned under C(output)
+        required: false
+        type: path
+    output_gzip:
+        description: gzip compress the output_file as it is written
+        required: false
+        type: bool
+        default: false
+    page_size:
+        description: Number of cases requested per API call when writing to output_file
+        required: false
+        type: int
+        default: 500
+    fast_json:
+        description:
+            - Encode the result with orjson when it is installed on the host running the module, or compact stdlib json otherwise
+            - Cuts the time spent encoding large results, the result itself is the same
+        required: false
+        type: bool
+        default: false
+    drop_empty_fields:
+        description:
+            - Remove the fields which are null or empty in every returned case, including custom fields under properties
+            - Fields with a value in any case are kept in all of them
+        required: false
+        type: bool
+        default: false
+    shard_by:
+        description:
+            - Split the query into time windows on this field and run the windows concurrently
+            - Results are merged in create_date desc order, the same order as a single query
+            - Useful for queries over a long time range which are slow or time out server side
+        required: false
+        type: str
+        choices: [create_date]
+    shard_count:
+        description: The number of time windows to split the query into
+        required: false
+        type: int
+        default: 4
+    shard_concurrency:
+        description: The maximum number of windows queried at once, defaults to shard_count
+        required: false
+        type: int
+    shard_window:
+        description:
+            - How far back from now the windows cover, as a relative duration such as 90d or 52w
+            - When not set the create_date of the oldest matching case is looked up with one extra call
+        required: false
+        type: str
+    schema_ttl:
+        description:
+            - Seconds the incident field definitions from /types/incident/fields are cached on disk for
+            - Fields are checked against the definitions and select values can be given by label, e.g 'High', before anything is sent
+            - 0 disables local validation
+        required: false
+        type: int
+        default: 3600
+    instances:
+        description:
+            - Run the query against each of these instances at once instead of the one in the default app.config
+            - Each instance has a C(name) and is read from its C(config_file), the default app.config if not set
+            - C(host), C(org), C(api_key_id) and C(api_key_secret) override the values in the app.config
+            - Every returned case has the name of its instance under C(cp4s_instance) and every instance is summarised under C(instances)
+            - Instances which fail or time out are reported and the results of the others are still returned
+            - Cannot be combined with cache_ttl, output_file or shard_by. Fields are not validated locally
+        required: false
+        type: list
+        elements: dict
+    instance_timeout:
+        description: Seconds to wait for every instance before returning the results which have arrived
+        required: false
+        type: int
+        default: 60
+
+extends_documentation_fragment:
+    - ryan_gordon1.cloud_pak_for_security.cp4s_client
 
 author:
     - Brian Reid (@breid1313)
@@ -90,6 +208,59 @@ EXAMPLES = r'''
     method: "equals"
     multiple_fields: "true"
 
+# Reuse the result of an identical query made in the last 5 minutes
+- name: Test query on CP4S cases
+  ryan_gordon1.cloud_pak_for_security.cp4s_query_incidents:
+    conditions: '["name", "example_name", "contains"]'
+    cache_ttl: 300
+
+# Count the open incidents with a matching name without fetching them
+- name: Test query on CP4S cases
+  ryan_gordon1.cloud_pak_for_security.cp4s_query_incidents:
+    conditions: '["name", "example_name", "contains"]'
+    count_only: true
+  register: matched
+
+# Stream a large number of closed incidents to a compressed file
+- name: Test query on CP4S cases
+  ryan_gordon1.cloud_pak_for_security.cp4s_query_incidents:
+    conditions: '["name", "example_name", "contains"]'
+    plan_status: "C"
+    output_file: /tmp/closed_cases.ndjson.gz
+    output_gzip: true
+
+# Query open incidents which are either high severity phishing cases or were created in the last day
+- name: Test query on CP4S cases
+  ryan_gordon1.cloud_pak_for_security.cp4s_query_incidents:
+    query:
+      filters:
+        - conditions:
+            - {field: name, op: contains, value: phishing}
+            - {field: severity_code, op: in, value: [5, 6]}
+        - conditions:
+            - {field: create_date, op: within, value: 24h}
+      sorts: ["-severity_code", "-create_date"]
+
+# Query a year of closed incidents as 12 windows, 4 at a time
+- name: Test query on CP4S cases
+  ryan_gordon1.cloud_pak_for_security.cp4s_query_incidents:
+    conditions: '["name", "example_name", "contains"]'
+    plan_status: "C"
+    shard_by: create_date
+    shard_count: 12
+    shard_concurrency: 4
+    shard_window: 365d
+
+# Query every tenant at once, one app.config per tenant
+- name: Test query on CP4S cases
+  ryan_gordon1.cloud_pak_for_security.cp4s_query_incidents:
+    conditions: '["name", "example_name", "contains"]'
+    instances:
+      - name: emea
+        config_file: ~/.resilient/emea.config
+      - name: apac
+        config_file: ~/.resilient/apac.config
+    instance_timeout: 30
 
 # fail the module (pass anything to fail param)
 - name: Test failure of the module
@@ -110,17 +281,42 @@ message:
     type: str
     returned: always
     sample: 'goodbye'
+instances:
+    description: With instances, the status (ok, failed or timeout), seconds taken and number of cases of every instance.
+    type: list
+    returned: when instances is provided
+    sample: [{'instance': 'emea', 'host': 'emea.example.com', 'org': 'SOC', 'status': 'ok', 'elapsed': 1.2, 'count': 12}]
+partial:
+    description: With instances, true when at least one instance failed or timed out.
+    type: bool
+    returned: when instances is provided
+deadline_exceeded:
+    description: With output_file or shard_by, true when the deadline passed before every case was fetched. The cases fetched so far are still returned.
+    type: bool
+    returned: when output_file or shard_by is provided
 '''
 
 def run_module():
     # define available arguments/parameters a user can pass to the module
     # ansible module_args cannot accept a dict for custom modules so use a json str for input
     module_args = dict(
-        conditions=dict(type='str', required=True),
+        conditions=dict(type='str', required=False, default=None),
+        query=dict(type='dict', required=False, default=None),
         method=dict(type='str', required=False, default=None),
         plan_status=dict(type='str', required=False, default="A"),
         multiple_fields=dict(type='bool', required=False, default=False),
-        fail=dict(type="str", required=False, default="")
+        fail=dict(type="str", required=False, default=""),
+        cache_ttl=dict(type='int', required=False, default=0),
+        count_only=dict(type='bool', required=False, default=False),
+        shard_by=dict(type='str', required=False, default=None, choices=['create_date']),
+        shard_count=dict(type='int', required=False, default=4),
+        shard_concurrency=dict(type='int', required=False, default=None),
+        shard_window=dict(type='str', required=False, default=None),
+        **INSTANCE_ARGS,
+        **SCHEMA_ARGS,
+        **OUTPUT_FILE_ARGS,
+        **RESULT_ENCODING_ARGS,
+        **CLIENT_ARGS
     )
 
     # seed the result dict in the object
@@ -140,8 +336,14 @@ def run_module():
     # supports check mode
     module = AnsibleModule(
         argument_spec=module_args,
+        required_one_of=[('conditions', 'query')],
+        mutually_exclusive=[('conditions', 'query')],
         supports_check_mode=True
     )
+    instrument_module(module)
+    configure_client(module.params)
+    if module.params['fast_json']:
+        use_fast_json(module)
 
     # if the user is working with this module in only check mode we do not
     # want to make any changes to the environment, just return the current
@@ -160,24 +362,68 @@ def run_module():
 
     module.params["plan_status"] = module.params.get("plan_status", "A").upper()
 
+    if module.params["instances"] and (module.params["cache_ttl"] > 0 or module.params["output_file"] or module.params["shard_by"]):
+        module.fail_json(msg='instances cannot be combined with cache_ttl, output_file or shard_by', **result)
+
     # TODO: Review if we can make the exception less bare, or if we can use a conditional for the changed property instead
     try:  # Try to make the API call
-        response = query_incident(
-            json.loads(module.params["conditions"]),
-            method=module.params.get("method", None),
-            plan_status=module.params.get("plan_status", "A"),
-            mulitple_fields=module.params["multiple_fields"]
-            )
-        result.update({
-            "success": True,
-            "response": response
-            })
+        # Each instance can have its own custom fields, leave validation to the servers
+        schema = None if module.params["instances"] else load_module_schema(module)
+        if module.params["query"]:
+            query_uri, query = compile_query(module.params["query"], plan_status=module.params["plan_status"],
+                                             known_fields=schema.field_names() if schema else INCIDENT_FIELDS)
+        else:
+            query_uri, query = build_incident_query(
+                json.loads(module.params["conditions"]),
+                method=module.params.get("method", None),
+                plan_status=module.params.get("plan_status", "A"),
+                mulitple_fields=module.params["multiple_fields"]
+                )
+        if schema:
+            # Catch unknown fields and resolve select labels before the request is sent
+            query = schema.resolve_query(query)
+        if module.params["instances"]:
+            result.update(query_instances(module.params["instances"], query_uri, query,
+                                          count_only=module.params["count_only"], timeout=module.params["instance_timeout"]))
+        elif module.params["count_only"]:
+            result["count"] = count_incident(query)
+        elif module.params["output_file"]:
+            result["output"] = export_incident(
+                query, module.params["output_file"],
+                compress=module.params["output_gzip"], page_size=module.params["page_size"])
+            result["deadline_exceeded"] = deadline_passed()
+        elif module.params["shard_by"]:
+            result["response"], result["shards"] = sharded_query_incident(
+                query_uri, query, module.params["shard_by"], module.params["shard_count"],
+                concurrency=module.params["shard_concurrency"] or module.params["shard_count"],
+                window=module.params["shard_window"])
+            result["cached"] = False
+            result["deadline_exceeded"] = any(shard["timeout"] for shard in result["shards"])
+        elif module.params["cache_ttl"] > 0:
+            result["response"], result["cached"] = cached_query_incident(query_uri, query, module.params["cache_ttl"])
+        else:
+            result["response"], result["cached"] = post_incident_query(query_uri, query), False
+        result["success"] = True
     except Exception as e:  # we need to except in order to do else; use bare except and just raise the exception as normal
         # raise  # raises the exact error that would have otherwise been raised.
         module.fail_json(msg=u'An exception occurred when querying cases : {}'.format(e), **result)
     else:  # if no expections are raised we can assume the API call is successful and has changed state
         result['changed'] = True
 
+    if module.params["instances"]:
+        failed = [instance for instance in result["instances"] if instance["status"] != "ok"]
+        if len(failed) == len(result["instances"]):
+            module.fail_json(msg=u'The query failed on every instance', **result)
+        for instance in failed:
+            module.warn(u'The query {} on instance {}: {}'.format(
+                "timed out" if instance["status"] == "timeout" else "failed", instance["instance"], instance.get("error", "")))
+
+    if result.get("deadline_exceeded"):
+        module.warn(u'The deadline passed before every case was fetched, the result is partial')
+
+    if module.params['drop_empty_fields'] and isinstance(result.get("response"), list):
+        result["response"] = drop_empty_fields(result["response"])
+
     # in the event of a successful module execution, you will want to
     # simple AnsibleModule.exit_json(), passing the key/value results
     module.exit_json(**result)
@@ -192,65 +438,159 @@ def query_incident(conditions: list, method=None, plan_status="A", mulitple_fiel
     :param plan_status: "A" == Active, "C" == Closed
     :param multiple_fields: query more than one field
     """
+    query_uri, query = build_incident_query(conditions, method=method, plan_status=plan_status, mulitple_fields=mulitple_fields)
+
+    return post_incident_query(query_uri, query)
 
-    def buildConditionDict(conditions, method=method):
-        return {
-            'field_name': conditions[0],
-            'value': conditions[1],
-            "method": method if method else conditions[2],
-        }
-    
-    conditionList = []
-    query_uri = u"/incidents/query?return_level=normal"
-
-    if not mulitple_fields:
-        conditionList.append(buildConditionDict(conditions))
-        query_uri += u"&field_handle={}".format(conditions[0])
-    else:
-        for condition in conditions:
-            conditionList.append(buildConditionDict(condition))
-            query_uri += u"&field_handle={}".format(condition[0])
-
-    conditionList.append({
-                    'field_name': 'plan_status',
-                    'method': 'equals',
-                    'value': plan_status
-                })
-
-    query = {
-        'filters': [{
-            'conditions': conditionList
-        }],
-        "sorts": [{
-            "field_name": "create_date",
-            "type": "desc"
-        }]
-    }
 
+def post_incident_query(query_uri: str, query: dict):
+    """
+    Sends an already built query to Resilient/CP4S
+
+    :param query_uri: The query uri with its field handles
+    :param query: The query body with filters and sorts
+    :return: The matching incidents
+    :rtype: list
+    """
     client = create_authenticated_client()
 
     return client.post(query_uri, query)
 
 
-def create_authenticated_client():
-    """create_authenticated_client uses the resilient package
-    to gather values from a standard app.config file; the configuration file
-    used for an Integration Server or App Host App.
-    This means all credentials needed to run this module can be kept 
-    separate and we can also avoid var prompts.
-    Note: If your running this module on a host other than localhost, 
-    that host needs to have an app.config file or you need to copy one over.
+def count_incident(query: dict):
+    """
+    Counts the incidents in Resilient/CP4S matching the query
+    without returning any of them
+
+    :return: The number of matching incidents
+    :rtype: int
+    """
+    return count_incidents(create_authenticated_client(), query)
+
 
-    :return: An authenticated rest client to CP4S or Resilient
-    :rtype: SimpleClient
+def export_incident(query: dict, output_file: str, compress=False, page_size=500):
     """
-    import resilient
-    # Create Resilient API Client
-    resilient_parser = resilient.ArgumentParser(
-        config_file=resilient.get_config_file())
-    resilient_opts = resilient_parser.parse_known_args()
-    # Instantiate a client using the gathered opts
-    return resilient.get_client(resilient_opts[0])
+    Writes the incidents in Resilient/CP4S matching the query to
+    output_file as newline delimited json, one page at a time,
+    stopping early if the deadline passes
+
+    :param output_file: The path of the file to write
+    :param compress: gzip the file as it is written
+    :param page_size: incidents requested per API call
+    :return: The path, record count and size of the written file
+    :rtype: dict
+    """
+    client = create_authenticated_client()
+
+    return write_ndjson(output_file, iter_incidents_paged(client, query, page_size=page_size), compress=compress)
+
+
+def query_instances(profiles: list, query_uri: str, query: dict, count_only=False, timeout=60):
+    """
+    Sends an already built query to several Resilient/CP4S instances at
+    once, returning whatever has arrived after timeout seconds
+
+    :param profiles: The connection profiles from the instances option
+    :param count_only: count the matches on each instance instead of returning them
+    :param timeout: seconds to wait for every instance
+    :return: The tagged cases or summed count, a summary of every instance and whether any is missing
+    :rtype: dict
+    """
+    def query_instance(client, opts):
+        if count_only:
+            return count_incidents(client, query)
+        return client.post(query_uri, query)
+
+    return merge_instance_results(run_on_instances(query_instance, profiles, timeout=timeout), count_only=count_only)
+
+
+def cached_query_incident(query_uri: str, query: dict, cache_ttl: int):
+    """
+    Queries incidents in Resilient/CP4S, reusing a result from the
+    local query cache if the same query was made in the last cache_ttl seconds
+
+    :param cache_ttl: seconds a cached result for the same query stays valid
+    :return: The query response and whether it came from the cache
+    :rtype: tuple
+    """
+    # Scope the key to the instance and org so two app.configs never share results
+    opts = get_connection_opts()
+    key = cache_key(opts.get("host"), opts.get("org"), query_uri, query)
+    cache = QueryCache()
+
+    response = cache.get(key, cache_ttl)
+    if response is not None:
+        return response, True
+
+    response = create_authenticated_client(opts).post(query_uri, query)
+    cache.set(key, response)
+    return response, False
+
+
+def shard_windows(start: int, end: int, shard_count: int):
+    """
+    Splits [start, end) into shard_count contiguous windows of epoch
+    milliseconds, newest first
+
+    :return: A list of (start, end) tuples
+    :rtype: list
+    """
+    shard_count = max(1, min(shard_count, end - start))
+    width = (end - start) / shard_count
+    bounds = [start + int(width * i) for i in range(shard_count)] + [end]
+    return list(reversed(list(zip(bounds[:-1], bounds[1:]))))
+
+
+def sharded_query_incident(query_uri: str, query: dict, shard_by: str, shard_count: int, concurrency=4, window=None):
+    """
+    Queries incidents in Resilient/CP4S as shard_count concurrent queries,
+    each limited to one time window on shard_by, over a single client.
+    Each window comes back sorted by create_date desc so they are heap
+    merged into the same order a single query would return.
+    Windows not fetched by the deadline are left out and marked timeout.
+
+    :param shard_by: The date field to split on
+    :param shard_count: The number of windows
+    :param concurrency: The maximum number of windows queried at once
+    :param window: A relative duration such as 365d, looked up from the oldest match if not set
+    :return: The merged incidents and the timing of every shard
+    :rtype: tuple
+    """
+    client = create_authenticated_client()
+    # Every shard must come back in the order the merge expects
+    query = {**query, "sorts": [{"field_name": "create_date", "type": "desc"}]}
+
+    end = int(time.time() * 1000) + 1
+    if window:
+        start = end - parse_duration(window) * 1000
+    else:
+        oldest = query_incidents_paged(client, {**query, "sorts": [{"field_name": shard_by, "type": "asc"}]},
+                                       start=0, length=1, return_level="partial").get("data", [])
+        if not oldest:
+            return [], []
+        start = oldest[0][shard_by]
+
+    def query_shard(bounds):
+        return client.post(query_uri, add_incident_conditions(query, [
+            {"field_name": shard_by, "method": "gte", "value": bounds[0]},
+            {"field_name": shard_by, "method": "lt", "value": bounds[1]}
+        ]))
+
+    shards = run_concurrently(query_shard, shard_windows(start, end, shard_count), concurrency)
+    for shard in shards:
+        if shard["error"] is not None and not isinstance(shard["error"], DeadlineExceeded):
+            raise shard["error"]
+
+    merged = list(heapq.merge(*[shard["result"] or [] for shard in shards],
+                              key=lambda incident: incident.get("create_date") or 0, reverse=True))
+    timings = [{
+        "start": shard["item"][0],
+        "end": shard["item"][1],
+        "count": len(shard["result"] or []),
+        "elapsed": shard["elapsed"],
+        "timeout": shard["error"] is not None
+    } for shard in shards]
+    return merged, timings
 
 
 def main():
@@ -7,9 +7,12 @@
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 from __future__ import (absolute_import, division, print_function)
 from ansible.module_utils.basic import AnsibleModule
-
-# Additional import of common code
-# from cp4s_common import create_authenticated_client
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import CLIENT_ARGS, DeadlineExceeded, configure_client, create_authenticated_client, deadline_passed, find_incident_ids, remaining_time, run_concurrently
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_journal import open_journal
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import instrument_module
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_cache import invalidate_query_cache
+import json
+import time
 
 __metaclass__ = type
 
@@ -23,17 +26,91 @@ short_description: A Module used to trigger an Action on a CP4S Case
 # i.e. the version is of the form "2.5.0" and not "2.4".
 version_added: "1.0.0"
 
-description: This module is an example of how you can choose to use a module or a role to achieve a similar outcome. An almost identical piece of functionality exists in the CP4S role but this gives a programmatic way to do it.
+description:
+    - This module is an example of how you can choose to use a module or a role to achieve a similar outcome. An almost identical piece of functionality exists in the CP4S role but this gives a programmatic way to do it.
+    - With case_ids or conditions the Action is invoked on many Cases at once with bounded concurrency, then every pending invocation is polled in the same loop until it finishes or wait_timeout passes.
+    - The poll interval starts at poll_interval, doubles up to max_poll_interval while nothing finishes and drops back whenever an invocation finishes.
+    - Every Case the Action is invoked on is recorded in a journal, so a bulk run which was killed or failed can be resumed without invoking the Action twice, and its progress is written to progress_file as it goes.
 
 options:
     case_id:
-        description: This is the ID number of the Case to be closed.
-        required: true
+        description: This is the ID number of the Case to invoke the Action on. One of case_id, case_ids or conditions is required.
+        required: false
         type: int
+    case_ids:
+        description: Invoke the Action on each of these Cases
+        required: false
+        type: list
+        elements: int
+    conditions:
+        description:
+            - Invoke the Action on every Case matching these conditions, in the same stringified list format as cp4s_query_incidents
+        required: false
+        type: str
+    method:
+        description: set global method for conditions
+        required: false
+        type: str
+    plan_status:
+        description: pass "C" to match closed incidents, by default open incidents are matched
+        required: false
+        type: str
+        default: A
+    multiple_fields:
+        description: conditions is a list of conditions rather than a single condition
+        required: false
+        type: bool
+        default: false
     action_id:
         description: This is the ID number of the Action to be invoked.
         required: true
         type: int
+    properties:
+        description: The Action properties to send with each invocation
+        required: false
+        type: dict
+    concurrency:
+        description: The maximum number of API calls in flight at once when invoking and polling
+        required: false
+        type: int
+        default: 8
+    wait:
+        description: With case_ids or conditions, wait for every invocation to finish
+        required: false
+        type: bool
+        default: true
+    poll_interval:
+        description: Seconds between polls while invocations are finishing
+        required: false
+        type: float
+        default: 1
+    max_poll_interval:
+        description: The longest the poll interval grows to while no invocation finishes
+        required: false
+        type: float
+        default: 30
+    wait_timeout:
+        description: Seconds to wait for the invocations before reporting the rest as timeout
+        required: false
+        type: int
+        default: 600
+    resume:
+        description:
+            - With case_ids or conditions, skip the Cases a previous run with the same parameters already invoked the Action on
+            - Without it any previous progress is discarded
+        required: false
+        type: bool
+        default: false
+    progress_file:
+        description:
+            - With case_ids or conditions, a file the progress of the run is written to as it goes, as json with what is done, the total, the cursor and whether it finished
+            - async_status only returns the result of a job once it has ended, to watch a run started with async and poll 0 set a path here and read it, for example with slurp
+            - The file is written on the managed node and its directory must exist. When not set it is written next to the journal under CP4S_CACHE_DIR and its path is only known from the result
+        required: false
+        type: path
+
+extends_documentation_fragment:
+    - ryan_gordon1.cloud_pak_for_security.cp4s_client
 
 author:
     - Ryan Gordon (@Ryan-Gordon)
@@ -46,6 +123,14 @@ EXAMPLES = r'''
     case_id: 2095
     action_id: 42
 
+# Run an enrichment Action on every open phishing Case and wait for it to finish
+- name: Enrich phishing Cases
+  ryan_gordon1.cloud_pak_for_security.cp4s_trigger_action:
+    conditions: '["name", "phishing", "contains"]'
+    action_id: 42
+    concurrency: 16
+  register: enrichment
+
 '''
 
 RETURN = r'''
@@ -60,14 +145,58 @@ message:
     type: str
     returned: always
     sample: 'goodbye'
+cases:
+    description:
+        - The outcome of every Case; invoked, completed, failed or timeout, with the seconds from invocation to completion.
+        - Cases not invoked or not finished by wait_timeout or the deadline are timeout.
+        - An invocation status which is not a known pending, completed or failed status is waited on as pending, a Case which times out with one has it under last_status.
+        - Cases invoked by a previous run are skipped when resuming.
+    type: list
+    returned: when case_ids or conditions are provided
+    sample: [{'case_id': 2095, 'invocation_id': 77, 'status': 'completed', 'latency': 4.2}]
+summary:
+    description: The number of Cases with each outcome, the number of poll rounds and the total time taken.
+    type: dict
+    returned: when case_ids or conditions are provided
+    sample: {'invoked': 0, 'completed': 480, 'failed': 2, 'timeout': 0, 'skipped': 0, 'polls': 9, 'elapsed': 61.5}
+deadline_exceeded:
+    description: Whether the deadline passed before every Case was invoked and waited for. Cases timed out by the deadline do not fail the task.
+    type: bool
+    returned: when case_ids or conditions are provided
+progress_file:
+    description: The file the progress of the run was written to, progress_file when it was set.
+    type: str
+    returned: when case_ids or conditions are provided
+    sample: '~/.ansible/cp4s_cache/journals/trigger_action-3f1c....progress.json'
 '''
 
+# Invocation statuses which mean the Action is still running
+PENDING_STATUSES = frozenset(["pending", "queued", "running", "in_progress", "started"])
+# Invocation statuses which mean the Action finished unsuccessfully
+FAILED_STATUSES = frozenset(["failed", "error", "errored", "cancelled"])
+# Invocation statuses which mean the Action finished successfully, any other status is unknown
+COMPLETED_STATUSES = frozenset(["completed", "complete", "success", "succeeded", "done", "finished"])
+
 
 def run_module():
     # define available arguments/parameters a user can pass to the module
     module_args = dict(
-        case_id=dict(type='int', required=True),
-        action_id=dict(type='int', required=False, default=False)
+        case_id=dict(type='int', required=False, default=None),
+        case_ids=dict(type='list', elements='int', required=False, default=None),
+        conditions=dict(type='str', required=False, default=None),
+        method=dict(type='str', required=False, default=None),
+        plan_status=dict(type='str', required=False, default="A"),
+        multiple_fields=dict(type='bool', required=False, default=False),
+        action_id=dict(type='int', required=True),
+        properties=dict(type='dict', required=False, default=None),
+        concurrency=dict(type='int', required=False, default=8),
+        wait=dict(type='bool', required=False, default=True),
+        poll_interval=dict(type='float', required=False, default=1),
+        max_poll_interval=dict(type='float', required=False, default=30),
+        wait_timeout=dict(type='int', required=False, default=600),
+        resume=dict(type='bool', required=False, default=False),
+        progress_file=dict(type='path', required=False, default=None),
+        **CLIENT_ARGS
     )
 
     # seed the result dict in the object
@@ -87,8 +216,12 @@ def run_module():
     # supports check mode
     module = AnsibleModule(
         argument_spec=module_args,
+        required_one_of=[('case_id', 'case_ids', 'conditions')],
+        mutually_exclusive=[('case_id', 'case_ids', 'conditions')],
         supports_check_mode=True
     )
+    instrument_module(module)
+    configure_client(module.params)
 
     # if the user is working with this module in only check mode we do not
     # want to make any changes to the environment, just return the current
@@ -96,12 +229,15 @@ def run_module():
     if module.check_mode:
         module.exit_json(**result)
 
+    if module.params['case_id'] is None:
+        run_bulk(module, result)
+
     # TODO: Review if we can make the exception less bare, or if we can use a conditional for the changed property instead
     try:  # Try to make the API call
-        response = trigger_rule(case_id=module.params.get(
-            'case_id', 0), action_id=module.params.get('action_id', 0))
+        response = trigger_rule(case_id=module.params['case_id'], action_id=module.params['action_id'],
+                                properties=module.params['properties'])
 
-        # Add the response to the result to return
+        # Add the response to the result to return
         result.update({"rule_trigger_result": response})
 
     except Exception as e:  # we need to except in order to do else; use bare except and just raise the exception as normal
@@ -110,37 +246,196 @@ def run_module():
             module.params['case_id'], e), **result)
     else:  # if no expections are raised we can assume the API call is successful and has changed state
         result['changed'] = True
+        # The Action can change the Case, cached queries may hold its old state
+        invalidate_query_cache(module)
 
     # in the event of a successful module execution, you will want to
     # simple AnsibleModule.exit_json(), passing the key/value results
     module.exit_json(**result)
 
 
-def trigger_rule(case_id: int, action_id: int):
-    client = create_authenticated_client()
+def run_bulk(module, result: dict):
+    """run_bulk invokes the Action on every Case from case_ids or
+    conditions over one client, optionally waits for the invocations,
+    and exits the module with the outcome of every Case.
+    """
+    params = module.params
+    start = time.time()
+    try:  # Try to make the API calls
+        journal = open_journal("trigger_action", *[params[name] for name in (
+            'case_ids', 'conditions', 'method', 'plan_status', 'multiple_fields', 'action_id', 'properties')], resume=params['resume'],
+            progress_path=params['progress_file'])
+        result["progress_file"] = journal.progress_path
+        client = create_authenticated_client()
+        case_ids = params['case_ids']
+        if case_ids is None:
+            case_ids = find_incident_ids(client, json.loads(params['conditions']),
+                                         method=params['method'],
+                                         plan_status=params['plan_status'].upper(),
+                                         mulitple_fields=params['multiple_fields'])
+
+        outcomes = invoke_actions(client, case_ids, params['action_id'], params['properties'], concurrency=params['concurrency'],
+                                  journal=journal)
+        polls = 0
+        if params['wait']:
+            polls = wait_for_invocations(client, outcomes, concurrency=params['concurrency'],
+                                         poll_interval=params['poll_interval'],
+                                         max_poll_interval=params['max_poll_interval'],
+                                         timeout=params['wait_timeout'])
+    except Exception as e:
+        module.fail_json(msg=u'An exception occurred when triggering the action on cases: {}'.format(e), **result)
+
+    summary = {status: 0 for status in ("invoked", "completed", "failed", "timeout", "skipped")}
+    for outcome in outcomes:
+        summary[outcome["status"]] += 1
+    summary.update({"polls": polls, "elapsed": round(time.time() - start, 3)})
+
+    result.update({
+        "cases": outcomes,
+        "summary": summary,
+        "changed": any(outcome.get("invocation") is not None for outcome in outcomes),
+        "deadline_exceeded": bool(summary["timeout"]) and deadline_passed()
+    })
+    if result["changed"]:
+        # The Action can change the Cases, cached queries may hold their old state
+        invalidate_query_cache(module)
+    for outcome in outcomes:
+        outcome.pop("invocation", None)
+        outcome.pop("invoked_at", None)
+
+    # Only Cases the Action was never invoked on are left to resume, however their invocations ended
+    if not journal.pending([outcome["case_id"] for outcome in outcomes]):
+        journal.finish()
+
+    if summary["failed"] or (summary["timeout"] and not result["deadline_exceeded"]):
+        module.fail_json(msg=u'The action failed on {} and timed out on {} of {} cases'.format(
+            summary["failed"], summary["timeout"], len(outcomes)), **result)
+    if result["deadline_exceeded"]:
+        module.warn(u'The deadline passed before the action finished on {} of {} cases'.format(summary["timeout"], len(outcomes)))
+    module.exit_json(**result)
+
+
+def trigger_rule(case_id: int, action_id: int, properties=None, client=None):
+    client = client or create_authenticated_client()
+    if properties is None:
+        properties = {"job_status": [], "last_updated": 152}
     # This API is NOT SUPPORTED at the time of this modules development. You can see it using chrome dev tools.
-    return client.post("/incidents/{case_id}/action_invocations".format(case_id), {"action_id": action_id, "properties": {"job_status": [], "last_updated": 152}})
+    return client.post("/incidents/{}/action_invocations".format(case_id), {"action_id": action_id, "properties": properties})
+
+
+def invoke_actions(client, case_ids: list, action_id: int, properties=None, concurrency=8, journal=None):
+    """invoke_actions invokes the Action on every Case concurrently.
+    A failed invocation on one Case does not stop the others. With a
+    journal, Cases invoked by a previous run are skipped and every Case
+    is recorded as soon as its invocation is accepted.
+
+    :return: The outcome of every Case in the order of case_ids
+    :rtype: list
+    """
+    def invoke(case_id):
+        invoked_at = time.time()
+        invocation = trigger_rule(case_id, action_id, properties=properties, client=client)
+        if journal is not None:
+            journal.record_done(case_id)
+        return invoked_at, invocation
+
+    skipped = set() if journal is None else set(case_ids) - set(journal.pending(case_ids))
+    if journal is not None:
+        journal.total = len(case_ids)
+    runs = {run["item"]: run for run in run_concurrently(invoke, [case_id for case_id in case_ids if case_id not in skipped], concurrency)}
 
+    outcomes = []
+    for case_id in case_ids:
+        if case_id in skipped:
+            outcomes.append({"case_id": case_id, "status": "skipped"})
+            continue
+        run = runs[case_id]
+        outcome = {"case_id": run["item"]}
+        if isinstance(run["error"], DeadlineExceeded):
+            outcome.update({"status": "timeout", "error": str(run["error"])})
+        elif run["error"] is not None:
+            outcome.update({"status": "failed", "error": str(run["error"])})
+        else:
+            invoked_at, invocation = run["result"]
+            invocation = invocation if isinstance(invocation, dict) else {}
+            outcome.update({
+                "status": "invoked",
+                "invocation_id": invocation.get("id"),
+                "invocation": invocation,
+                "invoked_at": invoked_at
+            })
+        outcomes.append(outcome)
+    return outcomes
 
-def create_authenticated_client():
-    """create_authenticated_client uses the resilient package
-    to gather values from a standard app.config file; the configuration file
-    used for an Integration Server or App Host App.
-    This means all credentials needed to run this module can be kept 
-    separate and we can also avoid var prompts.
-    Note: If your running this module on a host other than localhost, 
-    that host needs to have an app.config file or you need to copy one over.
 
-    :return: An authenticated rest client to CP4S or Resilient
-    :rtype: SimpleClient
+def invocation_status(invocation: dict):
+    """invocation_status maps the status of an invocation to pending,
+    completed, failed or unknown. Invocations without a status are pending.
     """
-    import resilient
-    # Create Resilient API Client
-    resilient_parser = resilient.ArgumentParser(
-        config_file=resilient.get_config_file())
-    resilient_opts = resilient_parser.parse_known_args()
-    # Instantiate a client using the gathered opts
-    return resilient.get_client(resilient_opts[0])
+    status = str(invocation.get("status") or "pending").lower()
+    if status in PENDING_STATUSES:
+        return "pending"
+    if status in FAILED_STATUSES:
+        return "failed"
+    if status in COMPLETED_STATUSES:
+        return "completed"
+    return "unknown"
+
+
+def wait_for_invocations(client, outcomes: list, concurrency=8, poll_interval=1, max_poll_interval=30, timeout=600):
+    """wait_for_invocations polls every pending invocation in one loop,
+    fetching their statuses concurrently each round. The interval doubles
+    up to max_poll_interval while nothing finishes and resets as soon as an
+    invocation finishes, so a batch of slow Actions costs a handful of polls.
+    Invocations without an ID cannot be polled and stay invoked. An
+    unknown status is polled like a pending one, and kept under
+    last_status if the invocation times out with it.
+    Polling stops at timeout or the deadline, whichever comes first.
+
+    :param outcomes: The outcomes from invoke_actions, updated in place
+    :type outcomes: list
+    :return: The number of poll rounds
+    :rtype: int
+    """
+    pending = [outcome for outcome in outcomes if outcome["status"] == "invoked" and outcome["invocation_id"] is not None]
+    deadline = time.time() + timeout
+    budget = remaining_time()
+    if budget is not None:
+        deadline = min(deadline, time.time() + budget)
+    interval = poll_interval
+    polls = 0
+
+    while pending:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            for outcome in pending:
+                outcome["status"] = "timeout"
+            break
+        time.sleep(min(interval, remaining))
+
+        polls += 1
+        finished = 0
+        runs = run_concurrently(lambda outcome: client.get("/incidents/{}/action_invocations/{}".format(
+            outcome["case_id"], outcome["invocation_id"])), pending, concurrency)
+        for run in runs:
+            outcome = run["item"]
+            if run["error"] is not None:
+                # A failed poll is retried on the next round
+                outcome["poll_error"] = str(run["error"])
+                continue
+            status = invocation_status(run["result"])
+            if status == "unknown":
+                # Never guess success from a status we do not know, keep polling and report it if it times out
+                outcome["last_status"] = run["result"].get("status")
+            elif status != "pending":
+                outcome.update({"status": status, "latency": round(time.time() - outcome["invoked_at"], 3)})
+                outcome.pop("poll_error", None)
+                finished += 1
+
+        pending = [outcome for outcome in pending if outcome["status"] == "invoked"]
+        interval = poll_interval if finished else min(interval * 2, max_poll_interval)
+
+    return polls
 
 
 def main():
@@ -0,0 +1,354 @@
+
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_common_logic import CLIENT_ARGS, DeadlineExceeded, build_incident_patch, configure_client, create_authenticated_client, diff_incident_fields, find_incident_ids, http_status, run_concurrently
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_journal import open_journal
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_metrics import instrument_module
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_cache import invalidate_query_cache
+import json
+import time
+
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: cp4s_update_incidents
+
+short_description: A Module used to set the same fields on many Cases in CP4S or Resilient
+
+# If this is part of a collection, you need to use semantic versioning,
+# i.e. the version is of the form "2.5.0" and not "2.4".
+version_added: "1.1.0"
+
+description:
+    - Applies one set of field changes to a list of Cases, or to every Case matching a query.
+    - Cases which already have the desired values are not written to.
+    - Changes are sent with the bulk incident patch endpoint where the platform has it, falling back to concurrent single PATCH calls when the endpoint does not exist.
+    - Any other error of the bulk call fails its cases rather than retrying them one by one, as the patches may already have been applied. Rerun with resume to retry them.
+    - Every Case is reported with its outcome and timing, including Cases changed by someone else between the read and the write.
+    - Every Case updated or found unchanged is recorded in a journal as it finishes, so a run which was killed or failed can be resumed, and its progress is written to progress_file as it goes.
+
+options:
+    case_ids:
+        description: The IDs of the Cases to update. Either case_ids or conditions is required.
+        required: false
+        type: list
+        elements: int
+    conditions:
+        description:
+            - Update every Case matching these conditions, in the same stringified list format as cp4s_query_incidents
+        required: false
+        type: str
+    method:
+        description: set global method for conditions
+        required: false
+        type: str
+    plan_status:
+        description: pass "C" to match closed incidents, by default open incidents are matched
+        required: false
+        type: str
+        default: A
+    multiple_fields:
+        description: conditions is a list of conditions rather than a single condition
+        required: false
+        type: bool
+        default: false
+    fields:
+        description:
+            - The desired value of each field, keyed by the field API name
+            - Custom fields are given by their plain name, without a properties. prefix
+        required: true
+        type: dict
+    concurrency:
+        description: The maximum number of API calls in flight at once when reading Cases and for single PATCH calls
+        required: false
+        type: int
+        default: 8
+    use_bulk:
+        description: Try the bulk incident patch endpoint before falling back to single PATCH calls
+        required: false
+        type: bool
+        default: true
+    overwrite_conflict:
+        description: Apply the changes even if a Case was modified between the read and the PATCH
+        required: false
+        type: bool
+        default: false
+    resume:
+        description:
+            - Skip the Cases a previous run with the same parameters already updated or found unchanged
+            - Without it any previous progress is discarded and every Case is read again
+        required: false
+        type: bool
+        default: false
+    progress_file:
+        description:
+            - A file the progress of the run is written to as it goes, as json with what is done, the total, the cursor and whether it finished
+            - async_status only returns the result of a job once it has ended, to watch a run started with async and poll 0 set a path here and read it, for example with slurp
+            - The file is written on the managed node and its directory must exist. When not set it is written next to the journal under CP4S_CACHE_DIR and its path is only known from the result
+        required: false
+        type: path
+
+extends_documentation_fragment:
+    - ryan_gordon1.cloud_pak_for_security.cp4s_client
+
+author:
+    - Ryan Gordon (@Ryan-Gordon)
+'''
+
+EXAMPLES = r'''
+# Reassign a list of Cases
+- name: Reassign Cases
+  ryan_gordon1.cloud_pak_for_security.cp4s_update_incidents:
+    case_ids: [2095, 2096, 2097]
+    fields:
+      owner_id: 12
+
+# Raise the severity of every open Case with a matching name
+- name: Raise severity
+  ryan_gordon1.cloud_pak_for_security.cp4s_update_incidents:
+    conditions: '["name", "phishing", "contains"]'
+    fields:
+      severity_code: 6
+    concurrency: 16
+
+# Run a large update in the background and watch its progress, async_status only has the result once it ends
+- name: Close stale Cases in the background
+  ryan_gordon1.cloud_pak_for_security.cp4s_update_incidents:
+    conditions: '["name", "stale", "contains"]'
+    fields:
+      plan_status: C
+    progress_file: /tmp/close_stale.progress.json
+  async: 3600
+  poll: 0
+  register: close_stale
+
+- name: Watch the progress
+  ansible.builtin.slurp:
+    src: /tmp/close_stale.progress.json
+  register: progress
+  until: (progress.content | b64decode | from_json).finished
+  retries: 120
+  delay: 30
+'''
+
+RETURN = r'''
+cases:
+    description: The outcome of every Case; updated, unchanged, conflict, failed, timeout when the deadline passed first or skipped when done by a resumed run.
+    type: list
+    returned: always
+    sample: [{'id': 2095, 'status': 'updated', 'changes': ['owner_id'], 'elapsed': 0.12}]
+summary:
+    description: The number of Cases with each outcome, how the writes were sent and the total time taken.
+    type: dict
+    returned: always
+    sample: {'updated': 480, 'unchanged': 18, 'conflict': 2, 'failed': 0, 'timeout': 0, 'skipped': 0, 'mode': 'bulk', 'elapsed': 3.4}
+deadline_exceeded:
+    description: Whether the deadline passed before every Case was read and written.
+    type: bool
+    returned: always
+progress_file:
+    description: The file the progress of the run was written to, progress_file when it was set.
+    type: str
+    returned: when not in check mode
+    sample: '~/.ansible/cp4s_cache/journals/update_incidents-3f1c....progress.json'
+'''
+
+
+def run_module():
+    module_args = dict(
+        case_ids=dict(type='list', elements='int', required=False, default=None),
+        conditions=dict(type='str', required=False, default=None),
+        method=dict(type='str', required=False, default=None),
+        plan_status=dict(type='str', required=False, default="A"),
+        multiple_fields=dict(type='bool', required=False, default=False),
+        fields=dict(type='dict', required=True),
+        concurrency=dict(type='int', required=False, default=8),
+        use_bulk=dict(type='bool', required=False, default=True),
+        overwrite_conflict=dict(type='bool', required=False, default=False),
+        resume=dict(type='bool', required=False, default=False),
+        progress_file=dict(type='path', required=False, default=None),
+        **CLIENT_ARGS
+    )
+
+    result = dict(
+        changed=False,
+        cases=[],
+        summary={},
+        deadline_exceeded=False
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        required_one_of=[('case_ids', 'conditions')],
+        mutually_exclusive=[('case_ids', 'conditions')],
+        supports_check_mode=True
+    )
+    instrument_module(module)
+    configure_client(module.params)
+
+    start = time.time()
+    journal = None
+    try:  # Try to make the API call
+        if not module.check_mode:
+            journal = open_journal("update_incidents", *[module.params[name] for name in (
+                'case_ids', 'conditions', 'method', 'plan_status', 'multiple_fields', 'fields')], resume=module.params['resume'],
+                progress_path=module.params['progress_file'])
+            result["progress_file"] = journal.progress_path
+        client = create_authenticated_client()
+        case_ids = module.params['case_ids']
+        if case_ids is None:
+            case_ids = find_incident_ids(client, json.loads(module.params['conditions']),
+                                         method=module.params['method'],
+                                         plan_status=module.params['plan_status'].upper(),
+                                         mulitple_fields=module.params['multiple_fields'])
+
+        outcomes, mode = update_incidents(client, case_ids, module.params['fields'],
+                                          concurrency=module.params['concurrency'],
+                                          use_bulk=module.params['use_bulk'],
+                                          overwrite_conflict=module.params['overwrite_conflict'],
+                                          check_mode=module.check_mode,
+                                          journal=journal)
+    except Exception as e:
+        module.fail_json(msg=u'An exception occurred when updating cases: {}'.format(e), **result)
+
+    summary = {status: 0 for status in ("updated", "unchanged", "conflict", "failed", "timeout", "skipped")}
+    for outcome in outcomes:
+        summary[outcome["status"]] += 1
+    summary.update({"mode": mode, "elapsed": round(time.time() - start, 3)})
+
+    result.update({"cases": outcomes, "summary": summary, "changed": summary["updated"] > 0,
+                   "deadline_exceeded": summary["timeout"] > 0})
+    if summary["updated"] and not module.check_mode:
+        invalidate_query_cache(module)
+
+    if journal is not None and not (summary["conflict"] or summary["failed"] or summary["timeout"]):
+        journal.finish()
+
+    if summary["failed"]:
+        module.fail_json(msg=u'{} of {} cases could not be updated, rerun with resume: true to continue'.format(
+            summary["failed"], len(outcomes)), **result)
+    if summary["timeout"]:
+        module.warn(u'The deadline passed before {} of {} cases were updated'.format(summary["timeout"], len(outcomes)))
+    module.exit_json(**result)
+
+
+def update_incidents(client, case_ids: list, fields: dict, concurrency=8, use_bulk=True, overwrite_conflict=False, check_mode=False,
+                     journal=None):
+    """update_incidents reads every incident concurrently, works out which
+    need to change and writes only those, in bulk if possible. With a
+    journal, cases done by a previous run are skipped without a read and
+    every case is recorded as soon as it is updated or found unchanged.
+
+    :return: One outcome per case and how the writes were sent (bulk, single or none)
+    :rtype: tuple
+    """
+    to_read = case_ids if journal is None else journal.pending(case_ids)
+    if journal is not None:
+        journal.total = len(case_ids)
+    reads = run_concurrently(lambda case_id: client.get("/incidents/{}".format(case_id)), to_read, concurrency)
+
+    outcomes = {case_id: {"id": case_id, "status": "skipped"} for case_id in case_ids if journal is not None and journal.is_done(case_id)}
+    pending = {}
+    for read in reads:
+        case_id = read["item"]
+        if read["error"] is not None:
+            status = "timeout" if isinstance(read["error"], DeadlineExceeded) else "failed"
+            outcomes[case_id] = {"id": case_id, "status": status, "error": str(read["error"]), "elapsed": read["elapsed"]}
+            continue
+        changes = diff_incident_fields(read["result"], fields)
+        outcomes[case_id] = {"id": case_id, "status": "updated" if changes else "unchanged",
+                             "changes": sorted(changes), "elapsed": read["elapsed"]}
+        if changes:
+            pending[case_id] = (read["result"], changes)
+
+    if journal is not None:
+        journal.record_done(*[case_id for case_id in to_read if outcomes[case_id]["status"] == "unchanged"])
+
+    mode = "none"
+    if pending and not check_mode:
+        if use_bulk and not overwrite_conflict and bulk_patch_incidents(client, pending, outcomes, journal):
+            mode = "bulk"
+        else:
+            single_patch_incidents(client, pending, outcomes, concurrency, overwrite_conflict, journal)
+            mode = "single"
+
+    return [outcomes[case_id] for case_id in case_ids], mode
+
+
+def bulk_patch_incidents(client, pending: dict, outcomes: dict, journal=None):
+    """bulk_patch_incidents sends every patch in one call to the bulk incident
+    patch endpoint and records the status the platform returns for each case.
+
+    Any other error fails every case of the call rather than falling back,
+    as a timeout or server error may come after the patches were applied.
+
+    :return: False if the endpoint is not available, so the caller can fall back to single PATCH calls
+    :rtype: bool
+    """
+    start = time.time()
+    try:
+        response = client.put("/incidents/patch", {
+            "patches": {
+                str(case_id): build_incident_patch(incident, changes).to_dict()
+                for case_id, (incident, changes) in pending.items()
+            }
+        })
+    except Exception as e:
+        # Only a missing endpoint is safe to retry case by case
+        if http_status(e) in (404, 405):
+            return False
+        elapsed = round(time.time() - start, 3)
+        status = "timeout" if isinstance(e, DeadlineExceeded) else "failed"
+        for case_id in pending:
+            outcome = outcomes[case_id]
+            outcome.update({"status": status, "error": str(e), "elapsed": round(outcome["elapsed"] + elapsed, 3)})
+        return True
+    elapsed = round(time.time() - start, 3)
+
+    for case_id in pending:
+        status = (response or {}).get(str(case_id), {})
+        outcome = outcomes[case_id]
+        outcome["elapsed"] = round(outcome["elapsed"] + elapsed, 3)
+        if not status.get("success", True):
+            outcome.update({"status": "conflict" if status.get("field_failures") else "failed",
+                            "error": status.get("message") or status.get("field_failures")})
+    if journal is not None:
+        journal.record_done(*[case_id for case_id in pending if outcomes[case_id]["status"] == "updated"])
+    return True
+
+
+def single_patch_incidents(client, pending: dict, outcomes: dict, concurrency=8, overwrite_conflict=False, journal=None):
+    """single_patch_incidents sends one PATCH per case concurrently, recording
+    a conflict for any case which was changed since it was read.
+    """
+    def patch_one(case_id):
+        incident, changes = pending[case_id]
+        response = client.patch("/incidents/{}".format(case_id), build_incident_patch(incident, changes),
+                                overwrite_conflict=overwrite_conflict)
+        if journal is not None:
+            journal.record_done(case_id)
+        return response
+
+    for patch in run_concurrently(patch_one, list(pending), concurrency):
+        outcome = outcomes[patch["item"]]
+        outcome["elapsed"] = round(outcome["elapsed"] + patch["elapsed"], 3)
+        if isinstance(patch["error"], DeadlineExceeded):
+            outcome.update({"status": "timeout", "error": str(patch["error"])})
+        elif patch["error"] is not None:
+            is_conflict = "conflict" in type(patch["error"]).__name__.lower()
+            outcome.update({"status": "conflict" if is_conflict else "failed", "error": str(patch["error"])})
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+import pytest
+
+from ansible.errors import AnsibleFilterError
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.filter.cp4s_cases import FilterModule, cp4s_age_buckets, cp4s_group_by_severity
+
+__metaclass__ = type
+
+NOW = 1700000000.0
+DAY_MS = 86400 * 1000
+
+
+def case(case_id, **fields):
+    return dict(id=case_id, **fields)
+
+
+def test_filters_are_registered():
+    filters = FilterModule().filters()
+    assert filters["cp4s_group_by_severity"] is cp4s_group_by_severity
+    assert filters["cp4s_age_buckets"] is cp4s_age_buckets
+
+
+def test_group_by_severity():
+    cases = [case(1, severity_code=6), case(2, severity_code=4), case(3, severity_code=6), case(4, severity_code=5)]
+    groups = cp4s_group_by_severity(cases)
+    assert groups == {"High": [cases[0], cases[2]], "Low": [cases[1]], "Medium": [cases[3]]}
+
+
+def test_group_by_severity_unknown_labelled_and_handle_names():
+    cases = [case(1), case(2, severity_code=None), case(3, severity_code=9), case(4, severity_code="Critical")]
+    assert cp4s_group_by_severity(cases) == {"Unknown": [cases[0], cases[1]], "9": [cases[2]], "Critical": [cases[3]]}
+    # labels maps other codes, with keys as strings as they come from yaml
+    assert cp4s_group_by_severity(cases[2:3], labels={"9": "Critical"}) == {"Critical": [cases[2]]}
+
+
+def test_group_by_severity_empty_and_invalid_input():
+    assert cp4s_group_by_severity(None) == {}
+    assert cp4s_group_by_severity([]) == {}
+    with pytest.raises(AnsibleFilterError):
+        cp4s_group_by_severity({"id": 1})
+
+
+def test_age_buckets():
+    now_ms = NOW * 1000
+    cases = [
+        case(1, create_date=now_ms - 3600 * 1000),
+        case(2, create_date=now_ms - 2 * DAY_MS),
+        case(3, create_date=now_ms - 7 * DAY_MS),
+        case(4, create_date=now_ms - 90 * DAY_MS),
+        case(5),
+        case(6, create_date="yesterday"),
+    ]
+    grouped = cp4s_age_buckets(cases, now=NOW)
+    assert list(grouped) == ["<1d", "1d-7d", "7d-30d", ">=30d", "unknown"]
+    assert grouped == {
+        "<1d": [cases[0]],
+        "1d-7d": [cases[1]],
+        # A bucket edge belongs to the older bucket
+        "7d-30d": [cases[2]],
+        ">=30d": [cases[3]],
+        "unknown": [cases[4], cases[5]],
+    }
+
+
+def test_age_buckets_sorts_edges_and_reads_other_fields():
+    now_ms = NOW * 1000
+    cases = [case(1, properties={"seen": now_ms - 10 * 60 * 1000}), case(2, properties={"seen": now_ms - 2 * 3600 * 1000})]
+    grouped = cp4s_age_buckets(cases, buckets=["1h", "15m"], field="properties.seen", now=NOW)
+    assert grouped == {"<15m": [cases[0]], "15m-1h": [], ">=1h": [cases[1]], "unknown": []}
+
+
+@pytest.mark.parametrize("buckets", [[], ["1 day"], ["7"]])
+def test_age_buckets_rejects_invalid_buckets(buckets):
+    with pytest.raises(AnsibleFilterError):
+        cp4s_age_buckets([], buckets=buckets, now=NOW)
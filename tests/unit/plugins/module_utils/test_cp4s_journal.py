@@ -0,0 +1,96 @@
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+import json
+import os
+
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_journal import Journal
+
+__metaclass__ = type
+
+
+def journal(tmp_path, resume=False, total=None):
+    return Journal("key", operation="update_incidents", journal_dir=str(tmp_path)).start(resume=resume, total=total)
+
+
+def test_resume_skips_what_a_previous_run_finished(tmp_path):
+    first = journal(tmp_path, total=4)
+    first.record_done(1, 2)
+    first.record_done(2)
+
+    resumed = journal(tmp_path, resume=True, total=4)
+    assert resumed.done == {1, 2}
+    assert resumed.resumed == 2
+    assert resumed.is_done(1) and not resumed.is_done(3)
+    assert resumed.pending([4, 3, 2, 1]) == [4, 3]
+
+
+def test_start_without_resume_discards_the_journal(tmp_path):
+    journal(tmp_path).record_done(1)
+    fresh = journal(tmp_path)
+    assert fresh.done == set()
+    assert fresh.pending([1]) == [1]
+
+
+def test_cursor_resumes_from_the_last_recorded_position(tmp_path):
+    first = journal(tmp_path)
+    for offset in (100, 250, 4096):
+        first.record_cursor(offset)
+    assert journal(tmp_path, resume=True).cursor == 4096
+
+
+def test_torn_last_line_is_ignored_and_not_appended_to(tmp_path):
+    first = journal(tmp_path)
+    first.record_done(1)
+    first.record_cursor(10)
+    # A run killed while writing leaves a partial last line
+    with open(first.path, "a") as journal_file:
+        journal_file.write('{"done":[2')
+
+    resumed = journal(tmp_path, resume=True)
+    assert resumed.done == {1}
+    assert resumed.cursor == 10
+    resumed.record_done(3)
+    assert journal(tmp_path, resume=True).done == {1, 3}
+
+
+def test_finish_removes_the_journal_and_marks_the_progress_finished(tmp_path):
+    done = journal(tmp_path, total=2)
+    done.record_done(1, 2)
+    done.finish()
+
+    assert not os.path.exists(done.path)
+    with open(done.progress_path) as progress_file:
+        progress = json.load(progress_file)
+    assert progress["operation"] == "update_incidents"
+    assert progress["done"] == 2
+    assert progress["total"] == 2
+    assert progress["finished"] is True
+    assert journal(tmp_path, resume=True).done == set()
+
+
+def test_progress_file_written_on_start(tmp_path):
+    started = journal(tmp_path, total=10)
+    with open(started.progress_path) as progress_file:
+        progress = json.load(progress_file)
+    assert progress["done"] == 0
+    assert progress["total"] == 10
+    assert progress["finished"] is False
+    assert os.path.basename(started.progress_path) == "update_incidents-key.progress.json"
+
+
+def test_progress_file_at_a_chosen_path(tmp_path):
+    chosen = str(tmp_path / "watch" / "progress.json")
+    os.mkdir(os.path.dirname(chosen))
+    started = Journal("key", operation="update_incidents", journal_dir=str(tmp_path), progress_path=chosen).start(total=3)
+    started.record_done(1)
+    started.report_progress(force=True)
+
+    assert started.progress_path == chosen
+    with open(chosen) as progress_file:
+        assert json.load(progress_file)["done"] == 1
+    assert not os.path.exists(os.path.join(str(tmp_path), "update_incidents-key.progress.json"))
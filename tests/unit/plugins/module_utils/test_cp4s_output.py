@@ -0,0 +1,102 @@
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+import io
+import json
+import sys
+
+import pytest
+
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils import cp4s_output
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_output import drop_empty_fields, fast_jsonify
+
+__metaclass__ = type
+
+
+def make_case(case_id, **fields):
+    case = {
+        "id": case_id,
+        "name": "Case {}".format(case_id),
+        "owner_id": None,
+        "reporter": "",
+        "members": [],
+        "severity_code": 0,
+        "inc_training": False,
+        "description": None,
+        "perms": {"read": True, "write": False},
+        "properties": {"source": None, "score": None, "notes": ""},
+        "gdpr": {"gdpr_breach_type": None, "gdpr_breach_circumstances": []}
+    }
+    case.update(fields)
+    return case
+
+
+CASES = [
+    make_case(1),
+    make_case(2, owner_id=5, properties={"source": "qradar", "score": None, "notes": ""}),
+    make_case(3, description={"format": "html", "content": "<p>Phish</p>"}),
+]
+
+
+def test_drop_empty_fields_removes_fields_empty_in_every_record():
+    pruned = drop_empty_fields(CASES)
+    for case in pruned:
+        assert "reporter" not in case
+        assert "members" not in case
+        assert "gdpr" not in case
+        assert "score" not in case["properties"]
+        assert "notes" not in case["properties"]
+
+
+def test_drop_empty_fields_keeps_the_same_shape():
+    pruned = drop_empty_fields(CASES)
+    assert len(set(tuple(sorted(case)) for case in pruned)) == 1
+    assert len(set(tuple(sorted(case["properties"])) for case in pruned)) == 1
+    # A field with a value in any record is kept, empty or not, in all of them
+    assert [case["owner_id"] for case in pruned] == [None, 5, None]
+    assert [case["properties"]["source"] for case in pruned] == [None, "qradar", None]
+    assert [case["description"] for case in pruned] == [None, None, CASES[2]["description"]]
+
+
+def test_drop_empty_fields_keeps_zero_and_false():
+    pruned = drop_empty_fields(CASES)
+    for case in pruned:
+        assert case["severity_code"] == 0
+        assert case["inc_training"] is False
+        assert case["perms"] == {"read": True, "write": False}
+
+
+def test_drop_empty_fields_does_not_change_the_input():
+    cases = [make_case(1), make_case(2)]
+    before = json.dumps(cases, sort_keys=True)
+    drop_empty_fields(cases)
+    assert json.dumps(cases, sort_keys=True) == before
+
+
+def test_drop_empty_fields_no_records():
+    assert drop_empty_fields([]) == []
+
+
+@pytest.fixture
+def utf8_stdout(monkeypatch):
+    monkeypatch.setattr(sys, "stdout", io.TextIOWrapper(io.BytesIO(), encoding="utf-8"))
+
+
+@pytest.mark.parametrize("cases", [CASES, drop_empty_fields(CASES)], ids=["full", "pruned"])
+def test_fast_jsonify_orjson_matches_json_dumps(monkeypatch, utf8_stdout, cases):
+    pytest.importorskip("orjson")
+    monkeypatch.setattr(cp4s_output, "HAS_ORJSON", True)
+    result = {"changed": False, "case": cases}
+    encoded = fast_jsonify(result)
+    assert encoded == json.dumps(result, separators=(",", ":"))
+    assert json.loads(encoded) == result
+
+
+def test_fast_jsonify_stdlib_fallback_matches_json_dumps(monkeypatch):
+    monkeypatch.setattr(cp4s_output, "HAS_ORJSON", False)
+    result = {"changed": False, "case": CASES}
+    assert json.loads(fast_jsonify(result)) == json.loads(json.dumps(result))
@@ -0,0 +1,88 @@
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+import pytest
+
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_query_dsl import compile_query, parse_duration
+
+__metaclass__ = type
+
+NOW = 1700000000.0
+
+
+@pytest.mark.parametrize("duration, seconds", [
+    ("30s", 30), ("15m", 900), ("24h", 86400), ("7d", 604800), ("2w", 1209600), (" 3 d ", 259200)
+])
+def test_parse_duration(duration, seconds):
+    assert parse_duration(duration) == seconds
+
+
+@pytest.mark.parametrize("duration", ["", "7", "d", "1.5h", "-1d", "7y", "7 days"])
+def test_parse_duration_rejects_invalid(duration):
+    with pytest.raises(ValueError, match="Invalid duration"):
+        parse_duration(duration)
+
+
+def test_compile_query_adds_plan_status_and_field_handles():
+    query_uri, body = compile_query({"filters": [{"conditions": [
+        {"field": "severity_code", "op": "gte", "value": 5},
+        {"field": "properties.source", "value": "qradar"}
+    ]}]})
+    assert query_uri == "/incidents/query?return_level=normal&field_handle=properties.source&field_handle=severity_code"
+    assert body["filters"] == [{"conditions": [
+        {"field_name": "severity_code", "method": "gte", "value": 5},
+        {"field_name": "properties.source", "method": "equals", "value": "qradar"},
+        {"field_name": "plan_status", "method": "equals", "value": "A"}
+    ]}]
+    assert body["sorts"] == [{"field_name": "create_date", "type": "desc"}]
+
+
+def test_compile_query_keeps_groups_separate():
+    _, body = compile_query({"filters": [
+        {"conditions": [{"field": "owner_id", "op": "has_a_value"}]},
+        {"conditions": [{"field": "plan_status", "value": "C"}]}
+    ]}, plan_status="A")
+    assert body["filters"] == [
+        {"conditions": [{"field_name": "owner_id", "method": "has_a_value"},
+                        {"field_name": "plan_status", "method": "equals", "value": "A"}]},
+        {"conditions": [{"field_name": "plan_status", "method": "equals", "value": "C"}]}
+    ]
+
+
+def test_compile_query_without_plan_status():
+    _, body = compile_query({"filters": [{"conditions": [{"field": "id", "op": "in", "value": 5}]}]}, plan_status=None)
+    assert body["filters"] == [{"conditions": [{"field_name": "id", "method": "in", "value": [5]}]}]
+
+
+def test_compile_query_relative_dates():
+    _, body = compile_query({"filters": [{"conditions": [
+        {"field": "create_date", "op": "within", "value": "24h"},
+        {"field": "inc_last_modified_date", "op": "older_than", "value": "7d"}
+    ]}]}, plan_status=None, now=NOW)
+    assert body["filters"][0]["conditions"] == [
+        {"field_name": "create_date", "method": "gte", "value": int((NOW - 86400) * 1000)},
+        {"field_name": "inc_last_modified_date", "method": "lt", "value": int((NOW - 604800) * 1000)}
+    ]
+
+
+def test_compile_query_sorts():
+    _, body = compile_query({"filters": [{"conditions": []}], "sorts": ["severity_code", "-create_date"]})
+    assert body["sorts"] == [{"field_name": "severity_code", "type": "asc"}, {"field_name": "create_date", "type": "desc"}]
+
+
+@pytest.mark.parametrize("query, message", [
+    ({"filters": []}, "at least one entry in filters"),
+    ({"filters": [{"conditions": [{"field": "severity", "value": 5}]}]}, "did you mean severity_code"),
+    ({"filters": [{"conditions": [{"field": "my_custom_field", "value": 5}]}]}, "properties. prefix"),
+    ({"filters": [{"conditions": [{"field": "name", "op": "like", "value": "x"}]}]}, "Unknown operator 'like'"),
+    ({"filters": [{"conditions": [{"op": "equals", "value": "x"}]}]}, "has no field"),
+    ({"filters": [{"conditions": [{"field": "create_date", "op": "within", "value": "a week"}]}]}, "Invalid duration"),
+    ({"filters": [{"conditions": []}], "sorts": ["-severity"]}, "Unknown incident field 'severity'"),
+])
+def test_compile_query_rejects_invalid_queries(query, message):
+    with pytest.raises(ValueError, match=message):
+        compile_query(query)
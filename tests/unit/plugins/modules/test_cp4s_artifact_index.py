@@ -0,0 +1,69 @@
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils.cp4s_artifact_index import ArtifactIndex
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.modules.cp4s.cp4s_artifact_index import sync_artifact_index
+
+__metaclass__ = type
+
+
+class FakeClient(object):
+    """FakeClient lists a fixed set of Cases in one page and serves their artifacts."""
+
+    def __init__(self, incidents, artifacts):
+        self.incidents = incidents
+        self.artifacts = artifacts
+        self.fetched = []
+
+    def post(self, uri, query):
+        return {"data": list(self.incidents)}
+
+    def get(self, uri):
+        case_id = int(uri.split("/")[2])
+        self.fetched.append(case_id)
+        return self.artifacts[case_id]
+
+
+def indexed(tmp_path):
+    index = ArtifactIndex(str(tmp_path / "index.json"))
+    index.set_case(1, [{"type": 1, "value": "10.0.0.8"}], modified=100, plan_status="A")
+    index.set_case(2, [{"type": 1, "value": "10.0.0.9"}], modified=100, plan_status="A")
+    index.set_case(3, [{"type": 2, "value": "example.com"}], modified=100, plan_status="A")
+    return index
+
+
+INCIDENTS = [
+    {"id": 1, "inc_last_modified_date": 100, "plan_status": "A"},
+    {"id": 2, "inc_last_modified_date": 200, "plan_status": "C"},
+    {"id": 3, "inc_last_modified_date": 300, "plan_status": "A"},
+    {"id": 4, "inc_last_modified_date": 400, "plan_status": "A"},
+]
+ARTIFACTS = {3: [{"type": 2, "value": "example.org"}], 4: [{"type": 1, "value": "10.0.0.8"}]}
+
+
+def test_check_mode_counts_what_a_sync_would_do(tmp_path):
+    index = indexed(tmp_path)
+    client = FakeClient(INCIDENTS, ARTIFACTS)
+    summary, failed = sync_artifact_index(client, index, include_closed=False, check_mode=True)
+
+    assert summary == {"listed": 4, "indexed": 2, "unchanged": 1, "removed": 1, "failed": 0, "timeout": 0}
+    assert failed == []
+    assert client.fetched == []
+    assert sorted(index.cases) == ["1", "2", "3"]
+    assert index.lookup(["example.com"])[0]["case_ids"] == [3]
+
+
+def test_sync_matches_its_check_mode_counts(tmp_path):
+    index = indexed(tmp_path)
+    client = FakeClient(INCIDENTS, ARTIFACTS)
+    summary, failed = sync_artifact_index(client, index, include_closed=False)
+
+    assert summary == {"listed": 4, "indexed": 2, "unchanged": 1, "removed": 1, "failed": 0, "timeout": 0}
+    assert sorted(client.fetched) == [3, 4]
+    assert sorted(index.cases) == ["1", "3", "4"]
+    assert index.lookup(["10.0.0.8"])[0]["case_ids"] == [1, 4]
+    assert index.synced_to == 400
@@ -0,0 +1,71 @@
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+import threading
+
+import pytest
+
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.modules.cp4s.cp4s_case_pipeline import plan_steps, run_pipeline
+
+__metaclass__ = type
+
+STEPS = [
+    {"type": "create_case", "params": {"name": "Phishing report"}},
+    {"type": "note", "params": {"text": "Hello SOC Team"}},
+    {"type": "artifact", "params": {"type": "DNS Name", "value": "example.com"}},
+    {"type": "task", "params": {"name": "Review the DNS artifact"}},
+    {"type": "artifact", "params": {"type": "IP Address", "value": "10.0.0.8"}},
+    {"type": "action", "params": {"action_id": 42}},
+]
+
+
+def test_plan_steps_follows_the_order_of_the_list():
+    depends_on = {step["name"]: step["depends_on"] for step in plan_steps(STEPS)}
+
+    assert depends_on["step_0"] == set()
+    # Notes and artifacts only wait for the last ordered step before them
+    assert depends_on["step_1"] == {"step_0"}
+    assert depends_on["step_2"] == {"step_0"}
+    assert depends_on["step_4"] == {"step_3"}
+    # Every other step waits for everything before it
+    assert depends_on["step_3"] == {"step_0", "step_1", "step_2"}
+    assert depends_on["step_5"] == {"step_0", "step_1", "step_2", "step_3", "step_4"}
+
+
+def test_plan_steps_rejects_duplicate_names():
+    steps = [{"type": "note", "name": "hello", "params": {"text": "a"}}, {"type": "note", "name": "hello", "params": {"text": "b"}}]
+    with pytest.raises(ValueError, match="hello"):
+        plan_steps(steps, case_id=2095)
+
+
+def test_plan_steps_requires_create_case_first():
+    with pytest.raises(ValueError, match="first"):
+        plan_steps([STEPS[1], STEPS[0]])
+
+
+class FakeClient(object):
+    """FakeClient records the order of the calls made against it."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def post(self, uri, payload):
+        with self.lock:
+            self.calls.append(uri)
+        return {"id": 2095} if uri == "/incidents" else {}
+
+
+def test_run_pipeline_runs_the_action_after_every_artifact():
+    client = FakeClient()
+    context = {"case": {}}
+    outcomes = run_pipeline(client, plan_steps(STEPS), context, concurrency=4)
+
+    assert [outcome["status"] for outcome in outcomes] == ["ok"] * len(STEPS)
+    assert client.calls[0] == "/incidents"
+    assert sorted(client.calls[1:3]) == ["/incidents/2095/artifacts", "/incidents/2095/comments"]
+    assert client.calls[3:] == ["/incidents/2095/tasks", "/incidents/2095/artifacts", "/incidents/2095/action_invocations"]
@@ -0,0 +1,77 @@
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+import pytest
+
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.module_utils import cp4s_idempotency
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.modules.cp4s import cp4s_create_incident
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.modules.cp4s.cp4s_create_incident import ensure_incident
+
+__metaclass__ = type
+
+
+class FakeClient(object):
+    """FakeClient keeps created cases in memory and answers name and property queries over them."""
+
+    def __init__(self):
+        self.incidents = {}
+        self.queries = []
+
+    def post(self, uri, payload):
+        if uri == "/incidents":
+            incident = dict(payload, id=len(self.incidents) + 1)
+            self.incidents[incident["id"]] = incident
+            return incident
+        self.queries.append(payload)
+        condition = payload["filters"][0]["conditions"][0]
+        field = condition["field_name"]
+        if field.startswith("properties."):
+            return [incident for incident in self.incidents.values()
+                    if incident.get("properties", {}).get(field.split(".", 1)[1]) == condition["value"]]
+        return [incident for incident in self.incidents.values() if incident.get(field) == condition["value"]]
+
+    def get(self, uri):
+        return self.incidents[int(uri.rsplit("/", 1)[1])]
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    client = FakeClient()
+    monkeypatch.setattr(cp4s_idempotency, "get_cache_dir", lambda name: str(tmp_path))
+    monkeypatch.setattr(cp4s_create_incident, "get_connection_opts", lambda: {"host": "cp4s.example.com", "org": "Test"})
+    monkeypatch.setattr(cp4s_create_incident, "create_authenticated_client", lambda *args: client)
+    return client
+
+
+def test_keys_sharing_a_name_create_separate_cases(client):
+    first, first_created = ensure_incident("Phishing report", {}, idempotency_key="A")
+    second, second_created = ensure_incident("Phishing report", {}, idempotency_key="B")
+
+    assert first_created and second_created
+    assert first["id"] != second["id"]
+    # A key which is not stored on the case is never matched on the server
+    assert client.queries == []
+
+
+def test_key_is_found_again_in_the_local_index(client):
+    created, _ = ensure_incident("Phishing report", {}, idempotency_key="A")
+    again, again_created = ensure_incident("Phishing report", {}, idempotency_key="A")
+
+    assert not again_created
+    assert again["id"] == created["id"]
+    assert len(client.incidents) == 1
+
+
+def test_stored_key_is_matched_on_the_server_when_the_index_is_lost(client, tmp_path):
+    created, _ = ensure_incident("Phishing report", {}, idempotency_key="A", idempotency_field="source_alert_id")
+    for path in tmp_path.iterdir():
+        path.unlink()
+    other, other_created = ensure_incident("Phishing report", {}, idempotency_key="B", idempotency_field="source_alert_id")
+    again, again_created = ensure_incident("Phishing report", {}, idempotency_key="A", idempotency_field="source_alert_id")
+
+    assert other_created and other["id"] != created["id"]
+    assert not again_created and again["id"] == created["id"]
@@ -0,0 +1,69 @@
+# Copyright: (c) 2021, Ryan Gordon
+# The MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from __future__ import (absolute_import, division, print_function)
+import random
+
+import pytest
+
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.modules.cp4s import cp4s_query_incidents
+from ansible_collections.ryan_gordon1.cloud_pak_for_security.plugins.modules.cp4s.cp4s_query_incidents import shard_windows, sharded_query_incident
+
+__metaclass__ = type
+
+NOW = 1700000000.0
+DAY_MS = 86400 * 1000
+
+
+@pytest.mark.parametrize("start, end, shard_count", [(0, 1000, 4), (0, 1000, 3), (5, 12, 7), (0, 10 * DAY_MS, 16)])
+def test_shard_windows_cover_the_range_newest_first(start, end, shard_count):
+    windows = shard_windows(start, end, shard_count)
+    assert len(windows) == shard_count
+    assert windows[0][1] == end
+    assert windows[-1][0] == start
+    # Contiguous, non overlapping and newest first
+    for newer, older in zip(windows, windows[1:]):
+        assert older[1] == newer[0]
+    assert all(low < high for low, high in windows)
+
+
+def test_shard_windows_never_split_finer_than_one_millisecond():
+    assert shard_windows(10, 13, 8) == [(12, 13), (11, 12), (10, 11)]
+    assert shard_windows(10, 11, 4) == [(10, 11)]
+
+
+class FakeClient(object):
+    """FakeClient answers incident queries from a fixed list, honouring the create_date window of each shard."""
+
+    def __init__(self, incidents):
+        self.incidents = incidents
+        self.queries = []
+
+    def post(self, uri, query):
+        self.queries.append(query)
+        conditions = query["filters"][0]["conditions"]
+        low = next(condition["value"] for condition in conditions if condition["method"] == "gte")
+        high = next(condition["value"] for condition in conditions if condition["method"] == "lt")
+        matches = [incident for incident in self.incidents if low <= incident["create_date"] < high]
+        return sorted(matches, key=lambda incident: incident["create_date"], reverse=True)
+
+
+def test_sharded_query_merges_shards_in_create_date_order(monkeypatch):
+    rng = random.Random(7)
+    end = int(NOW * 1000)
+    incidents = [{"id": case_id, "create_date": end - rng.randrange(0, 30 * DAY_MS)} for case_id in range(500)]
+    client = FakeClient(incidents)
+    monkeypatch.setattr(cp4s_query_incidents.time, "time", lambda: NOW)
+    monkeypatch.setattr(cp4s_query_incidents, "create_authenticated_client", lambda *args: client)
+
+    query = {"filters": [{"conditions": [{"field_name": "plan_status", "method": "equals", "value": "A"}]}]}
+    merged, timings = sharded_query_incident("/incidents/query", query, "create_date", 8, concurrency=4, window="31d")
+
+    assert len(client.queries) == 8
+    assert [incident["create_date"] for incident in merged] == sorted((incident["create_date"] for incident in incidents), reverse=True)
+    assert sorted(incident["id"] for incident in merged) == list(range(500))
+    assert sum(timing["count"] for timing in timings) == 500
+    assert not any(timing["timeout"] for timing in timings)